@@ -0,0 +1,89 @@
+from __future__ import annotations
+from datetime import date
+from pathlib import Path
+import argparse, glob, signal, sys, threading
+
+from .config import OUTPUTS_DIR, PROCESS_WORKERS, OUTPUT_COMPRESSION, OUTPUT_COMPRESSION_LEVEL
+
+# python -m app process reportes/*.csv --cliente acme
+# python -m app watch /data/entrantes --cliente acme
+# Eventos en stdout, una línea JSON cada uno: log, progress, result, error (ver batch.py).
+
+def _expand(patterns: list[str]) -> list[Path]:
+    files: list[Path] = []
+    for pat in patterns:
+        matches = sorted(glob.glob(pat)) if glob.has_magic(pat) else [pat]
+        if not matches:
+            raise SystemExit(f"sin archivos para {pat!r}")
+        files += [Path(m) for m in matches]
+    missing = [str(p) for p in files if not p.is_file()]
+    if missing:
+        raise SystemExit(f"no existen: {', '.join(missing)}")
+    return list(dict.fromkeys(files))
+
+def _common(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--cliente", required=True)
+    ap.add_argument("--out", type=Path, default=OUTPUTS_DIR, help="carpeta de salida (una subcarpeta por lote)")
+    ap.add_argument("--workers", type=int, default=PROCESS_WORKERS, help="procesos del pool (1 = secuencial)")
+    ap.add_argument("--split", action="store_true", help="partir archivos grandes en rangos (requiere --workers > 1)")
+    ap.add_argument("--single-pass", action="store_true")
+    ap.add_argument("--compression", choices=["none", "gzip", "zstd"], default=OUTPUT_COMPRESSION or "none")
+    ap.add_argument("--compression-level", type=int, default=OUTPUT_COMPRESSION_LEVEL)
+    ap.add_argument("--parquet", action="store_true", help="además escribe cada tabla en Parquet (requiere pyarrow)")
+    ap.add_argument("--push-es", action="store_true", help="indexa en Elasticsearch mientras escribe (ES_URL, ...)")
+
+def _batch_opts(args: argparse.Namespace) -> dict:
+    return {
+        "workers": args.workers, "split": args.split, "single_pass": args.single_pass,
+        "compression": None if args.compression == "none" else args.compression,
+        "level": args.compression_level, "parquet": args.parquet, "push_es": args.push_es,
+    }
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app", description="Procesa reportes Qualys sin el servidor web.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("process", help="procesa archivos locales (paths o globs) en un lote")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--fecha", default=date.today().isoformat(), help="YYYY-MM-DD")
+    _common(p)
+    w = sub.add_parser("watch", help="procesa en micro-lotes los reportes que llegan a una carpeta")
+    w.add_argument("dir", type=Path)
+    w.add_argument("--fecha", default=None, help="YYYY-MM-DD (default: el día de cada lote)")
+    w.add_argument("--pattern", default="*.csv")
+    w.add_argument("--interval", type=float, default=5.0, help="segundos entre revisiones")
+    w.add_argument("--settle", type=float, default=10.0, help="segundos sin cambios para tomar un archivo")
+    w.add_argument("--batch-max", type=int, default=20, help="archivos por lote")
+    w.add_argument("--done", type=Path, default=None, help="a dónde mover los procesados (default: DIR/done)")
+    w.add_argument("--failed", type=Path, default=None, help="a dónde mover los fallidos (default: DIR/failed)")
+    _common(w)
+    args = ap.parse_args(argv)
+
+    # SIGINT/SIGTERM: el lote en curso corta en su próximo chequeo y no deja salidas a medias
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    from .batch import emit_json, run_batch
+    from .parser import RunCancelled
+    if args.cmd == "process":
+        files = _expand(args.files)
+        try:
+            run_batch(files, cliente=args.cliente, fecha=args.fecha, out_dir=args.out, cancel=stop, **_batch_opts(args))
+        except RunCancelled:
+            emit_json({"type": "cancelled"})
+            return 130
+        except Exception as e:
+            emit_json({"type": "error", "message": f"{type(e).__name__}: {e}"})
+            return 1
+        return 0
+
+    from .watch import watch
+    if not args.dir.is_dir():
+        ap.error(f"no es una carpeta: {args.dir}")
+    watch(args.dir, cliente=args.cliente, out_dir=args.out, fecha=args.fecha, pattern=args.pattern,
+          interval=args.interval, settle=args.settle, batch_max=args.batch_max,
+          done_dir=args.done, failed_dir=args.failed, stop=stop, **_batch_opts(args))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
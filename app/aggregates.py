@@ -0,0 +1,168 @@
+from __future__ import annotations
+from collections import Counter
+from operator import itemgetter
+from pathlib import Path
+import json, os
+
+try:  # opcional: solo para el resumen en Parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+# Agregados de cumplimiento por salida, calculados con los mismos lotes que se escriben (como
+# la preview): por dimensión (control, sistema operativo, host) un Counter de (valor, estado)
+# -> cantidad, más el total por estado. Ocupa O(controles + hosts + SO) por estado en vez de
+# O(filas), así los reportes comunes no necesitan agregar sobre todo el índice de ES.
+# La variante (normal/ajustada) y el tipo de tabla ya son la key de la salida.
+#
+# RESULTS (t2) tiene una fila por host y control con su Status: cada fila suma 1.
+# Control Statistics (t1) ya viene agregada por control: se suman sus columnas Passed, Failed...
+#
+# Las columnas se eligen según el header de cada tabla, no el de la salida: con la unión de
+# headers (dos pasadas) un archivo con IP y otro con Host IP tienen ambas columnas, y la que
+# no trae la tabla está vacía en sus filas.
+
+# columnas candidatas por dimensión, en orden de preferencia
+DIMENSIONS = {
+    "control": ("Control ID", "CID", "Control"),
+    "os": ("Operating System", "operating system", "OS"),
+    "host": ("Host IP", "IP", "DNS Hostname", "NetBIOS Hostname"),
+}
+STATUS_COLUMN = "Status"
+COUNT_COLUMNS = ("Passed", "Failed", "Error", "Exceptions")
+
+def _first(index: dict[str, int], names: tuple[str, ...]) -> int | None:
+    return next((index[n] for n in names if n in index), None)
+
+class _Plan:
+    """Índices en `fieldnames` de las columnas que trae la tabla (`columns`)."""
+    def __init__(self, fieldnames: list[str], columns):
+        index = {c: i for i, c in enumerate(fieldnames) if c in columns}
+        self.dims = {d: i for d, names in DIMENSIONS.items() if (i := _first(index, names)) is not None}
+        self.status = index.get(STATUS_COLUMN)
+        self.totals = [(c, index[c]) for c in COUNT_COLUMNS if c in index]
+        cid, title = index.get("Control ID"), index.get("Control")
+        self.title = itemgetter(cid, title) if cid is not None and title is not None else None
+
+class TableAggregates:
+    def __init__(self):
+        self.rows = 0
+        self.status: Counter = Counter()
+        self.by: dict[str, Counter] = {d: Counter() for d in DIMENSIONS}
+        self.controls: dict[str, str] = {}  # Control ID -> título
+        self._fns: list[str] | None = None
+        self._cols = None
+        self._plan: _Plan | None = None
+
+    def offer(self, fieldnames: list[str], rows: list[tuple], columns=None) -> None:
+        """Suma un lote de filas (en el orden de `fieldnames`); `columns` son las que trae la
+        tabla de origen (header y constantes): las demás de la salida se ignoran. None = todas."""
+        if self._fns is not fieldnames or self._cols is not columns:
+            self._fns, self._cols = fieldnames, columns
+            self._plan = _Plan(fieldnames, fieldnames if columns is None else columns)
+        plan = self._plan
+        self.rows += len(rows)
+        if plan.title is not None:
+            self.controls.update(map(plan.title, rows))
+        if plan.status is not None:
+            # Counter.update sobre un itemgetter: el conteo por fila corre en C
+            self.status.update(map(itemgetter(plan.status), rows))
+            for d, i in plan.dims.items():
+                self.by[d].update(map(itemgetter(i, plan.status), rows))
+        elif plan.totals:
+            dims = [(self.by[d], itemgetter(j)) for d, j in plan.dims.items()]
+            for st, i in plan.totals:
+                hits = [(r, int(v)) for r, v in zip(rows, map(itemgetter(i), rows)) if v.isdigit() and v != "0"]
+                self.status[st] += sum(n for _, n in hits)
+                for c, get in dims:
+                    for r, n in hits:
+                        c[get(r), st] += n
+
+    def merge(self, other: 'TableAggregates') -> None:
+        self.rows += other.rows
+        self.status.update(other.status)
+        for d, c in other.by.items():
+            self.by[d].update(c)
+        self.controls.update(other.controls)
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "_fns": None, "_cols": None, "_plan": None}
+
+    @classmethod
+    def from_json(cls, d: dict) -> 'TableAggregates':
+        t = cls()
+        t.rows = d["rows"]
+        t.status = Counter(d["status"])
+        for dim, values in d["by"].items():
+            t.by[dim] = Counter({(v, st): n for v, sts in values.items() for st, n in sts.items()})
+        t.controls = dict(d.get("controls", {}))
+        return t
+
+    def to_json(self) -> dict:
+        by: dict[str, dict[str, dict[str, int]]] = {}
+        for dim, c in self.by.items():
+            out = by[dim] = {}
+            for (v, st), n in sorted(c.items()):
+                out.setdefault(v, {})[st] = n
+        return {"rows": self.rows, "status": dict(sorted(self.status.items())), "by": by,
+                "controls": dict(sorted(self.controls.items()))}
+
+class AggregateSet:
+    """Un TableAggregates por salida (t1_normal, ...); picklable para volver de los workers."""
+    def __init__(self):
+        self.tables: dict[str, TableAggregates] = {}
+
+    def table(self, key: str) -> TableAggregates:
+        t = self.tables.get(key)
+        if t is None:
+            t = self.tables[key] = TableAggregates()
+        return t
+
+    @classmethod
+    def from_json(cls, d: dict[str, dict]) -> 'AggregateSet':
+        s = cls()
+        s.tables = {key: TableAggregates.from_json(t) for key, t in d.items()}
+        return s
+
+    def merge(self, other: 'AggregateSet') -> None:
+        for key, t in other.tables.items():
+            self.table(key).merge(t)
+
+    def to_json(self, keys) -> dict[str, dict]:
+        return {key: self.table(key).to_json() for key in keys}
+
+def write_summary(path: Path, summary: dict[str, dict]) -> None:
+    """Resumen como JSON; se reemplaza de forma atómica (agregar archivos lo reescribe)."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(summary, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+def write_summary_parquet(path: Path, summary: dict[str, dict]) -> None:
+    """Resumen en formato largo: table, dimension, value, status, count (dimension "" = total)."""
+    if pa is None:
+        raise RuntimeError("pyarrow no está instalado")
+    cols: dict[str, list] = {"table": [], "dimension": [], "value": [], "status": [], "count": []}
+
+    def add(table: str, dim: str, value: str, st: str, n: int) -> None:
+        for c, v in zip(cols.values(), (table, dim, value, st, n)):
+            c.append(v)
+
+    for table, t in summary.items():
+        for st, n in t["status"].items():
+            add(table, "", "", st, n)
+        for dim, values in t["by"].items():
+            for v, sts in values.items():
+                for st, n in sts.items():
+                    add(table, dim, v, st, n)
+    schema = pa.schema([("table", pa.string()), ("dimension", pa.string()), ("value", pa.string()),
+                        ("status", pa.string()), ("count", pa.int64())])
+    tmp = path.with_name(f".{path.name}.tmp")
+    pq.write_table(pa.Table.from_pydict(cols, schema=schema), str(tmp), compression="zstd")
+    os.replace(tmp, path)
+
+def write_summaries(paths: dict[str, Path], summary: dict[str, dict]) -> None:
+    """Escribe el resumen en cada path de `paths` (summary.json / summary.parquet) según su sufijo."""
+    for key, path in paths.items():
+        (write_summary_parquet if key.endswith(".parquet") else write_summary)(path, summary)
@@ -0,0 +1,43 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import TextIO
+import csv
+
+from .storage import open_output_reader
+
+# Agregar archivos a un run terminado: las columnas nuevas van al final, así cada registro
+# existente solo necesita `n` separadores antes del fin de línea. No se parsea el CSV: se
+# copia línea por línea siguiendo la paridad de comillas para no cortar campos multilínea
+# (Evidence, Remediation). Requiere el formato que escribe csv.writer (QUOTE_MINIMAL, "\r\n").
+
+def widen_csv(src: Path, out: TextIO, fieldnames: list[str], n_new: int) -> int:
+    """Copia la salida `src` en `out` con header `fieldnames` y `n_new` columnas vacías más
+    en cada registro. Devuelve la cantidad de registros de datos copiados."""
+    pad = "," * n_new
+    csv.writer(out).writerow(fieldnames)
+    records = 0
+    quoted = False
+    old_header: str | None = None
+    with open_output_reader(src) as f:
+        for line in f:
+            starts = not quoted
+            if line.count('"') & 1:
+                quoted = not quoted
+            if starts and (old_header is None or (records == 0 and line == old_header)):
+                # header viejo (repetido si hubo tablas vacías antes de la primera fila): se reemplaza
+                old_header = line
+                continue
+            if quoted:
+                out.write(line)
+            elif line.endswith("\r\n"):
+                out.write(line[:-2] + pad + "\r\n")
+                records += 1
+            else:
+                out.write(line + pad)
+                records += 1
+    return records
+
+def new_columns(current: list[str], incoming: list[str]) -> list[str]:
+    """Columnas de `incoming` que no están en `current`, en orden."""
+    seen = set(current)
+    return [c for c in incoming if c not in seen]
@@ -0,0 +1,121 @@
+from __future__ import annotations
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+import json, shutil, sys, threading, time, uuid
+
+from .config import (
+    ES, ES_BULK_THREADS, ES_BULK_MAX_BYTES, ES_BULK_MAX_RETRIES, ES_POOL_CONNECTIONS, ES_TEE_QUEUE_BATCHES,
+    PARQUET_ROW_GROUP_ROWS, SPLIT_CHUNK_BYTES,
+)
+from .aggregates import AggregateSet, write_summaries
+from .encoding import detect_encoding
+from .pipeline import process_files
+from .sinks import ParquetSink, RowSink
+from .storage import make_run_output_paths, make_parquet_paths, make_summary_paths, open_output
+from .utils import parse_fecha
+
+# Procesamiento sin servidor (python -m app): los mismos pasos que un run de /api/process
+# pero sobre paths locales, sin copiarlos a storage/uploads ni escribir índices sidecar.
+# Cada lote escribe en `{out}/{batch_id}/` vía una carpeta `.partial` que se publica con un
+# rename, igual que los runs.
+
+Emit = Callable[[dict], None]
+
+def emit_json(evt: dict) -> None:
+    """Una línea JSON por evento en stdout (progreso, logs y resultado)."""
+    sys.stdout.write(json.dumps(evt, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+def new_batch_id() -> str:
+    return datetime.utcnow().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+def run_batch(
+    files: list[Path], *,
+    cliente: str, fecha: str, out_dir: Path,
+    workers: int = 1, split: bool = False, single_pass: bool = False,
+    compression: str | None = None, level: int | None = None,
+    parquet: bool = False, push_es: bool = False,
+    emit: Emit = emit_json, cancel: threading.Event | None = None,
+    batch_id: str | None = None,
+) -> dict:
+    """Procesa `files` y devuelve el resumen (también emitido como evento "result").
+
+    Si falla o se cancela (RunCancelled) no quedan salidas a medias.
+    """
+    batch_id = batch_id or new_batch_id()
+    final = out_dir / batch_id
+    staging = out_dir / f".{batch_id}.partial"
+    outputs = make_run_output_paths(batch_id, cliente, fecha, compression, root=staging)
+    parquet_paths = make_parquet_paths(outputs) if parquet else {}
+    summary_paths = make_summary_paths(outputs, cliente, fecha)
+    if not parquet:
+        del summary_paths["summary.parquet"]
+    aggregates = AggregateSet()
+    counts = {k: 0 for k in outputs}
+    y, m, d = parse_fecha(fecha)
+    t0 = time.monotonic()
+
+    def log(msg: str) -> None:
+        emit({"type": "log", "batch": batch_id, "message": msg})
+
+    def progress(evt: dict) -> None:
+        e = max(evt.get("elapsed_s", 0.0), 1e-6)
+        evt["rows_per_sec"] = round(evt.get("rows", 0) / e, 2)
+        evt["mb_per_sec"] = round((evt.get("bytes", 0) / 1_000_000.0) / e, 2)
+        emit({"type": "progress", "batch": batch_id, **evt})
+
+    es = tee = None
+    if push_es:
+        from .es_uploader import ESUploader
+        es = ESUploader(ES.url, ES.username, ES.password, connections=ES_POOL_CONNECTIONS)
+        tee = es.pool(queue_chunks=ES_TEE_QUEUE_BATCHES, workers=ES_BULK_THREADS,
+                      max_chunk_bytes=ES_BULK_MAX_BYTES, max_retries=ES_BULK_MAX_RETRIES)
+
+    def sinks(key: str, fieldnames: list[str]) -> list[RowSink]:
+        extra: list[RowSink] = []
+        if parquet_paths:
+            extra.append(ParquetSink(parquet_paths[f"{key}.parquet"], fieldnames, row_group_rows=PARQUET_ROW_GROUP_ROWS))
+        if tee is not None:
+            index = ES.index_t1 if key.startswith("t1_") else ES.index_t2
+            extra.append(tee.stream(outputs[key].name, index, fieldnames))
+        return extra
+
+    staging.mkdir(parents=True, exist_ok=True)
+    es_stats = []
+    try:
+        try:
+            enc = {}
+            for p in files:
+                enc[p] = detect_encoding(p)
+                log(f"{p.name}: encoding detectado = {enc[p]}")
+            fns = process_files(
+                files, enc, outputs, cliente=cliente, y=y, m=m, d=d, counts=counts,
+                open_out=lambda key, path: open_output(path, level=level), spill_dir=staging,
+                log=log, progress=progress, sinks=sinks, workers=workers,
+                split_bytes=SPLIT_CHUNK_BYTES if split else None, single_pass=single_pass,
+                aggregates=aggregates, cancel=cancel,
+            )
+            write_summaries(summary_paths, aggregates.to_json(outputs))
+        finally:
+            if tee is not None:
+                es_stats = tee.close()
+                es.close()
+        staging.replace(final)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    result = {
+        "type": "result", "batch": batch_id, "out_dir": str(final),
+        "files": [str(p) for p in files],
+        "outputs": {k: str(final / p.name) for k, p in outputs.items()},
+        "counts": counts, "columns": {k: len(v) for k, v in fns.items()},
+        "summary": {k: str(final / p.name) for k, p in summary_paths.items()},
+        "seconds": round(time.monotonic() - t0, 3),
+    }
+    if parquet_paths:
+        result["parquet"] = {k: str(final / p.name) for k, p in parquet_paths.items()}
+    if tee is not None:
+        result["es"] = {"ok": sum(s.ok for s in es_stats), "failed": sum(s.failed for s in es_stats)}
+    emit(result)
+    return result
@@ -0,0 +1,237 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Iterator
+import fcntl, hashlib, json, math, re, shutil, threading, time, uuid
+
+# Upload por partes: la sesión reserva un archivo del tamaño final (sparse) y cada parte se
+# escribe en su offset, así el ensamblado no copia nada y el archivo se mueve a uploads con un
+# rename. Las partes recibidas se marcan con un archivo vacío en parts/ (sirve entre workers
+# y reinicios). El sha256 avanza sobre el prefijo contiguo de partes a medida que se completa
+# (relee de page cache); al cerrar solo falta hashear lo que llegó fuera de orden, así que una
+# parte ya recibida no se puede volver a escribir. Completar deja un archivo done con el sha256:
+# repetir el complete (o dos en paralelo, entre workers) devuelve el mismo upload.
+#
+#   storage/incoming/{session_id}/session.json   metadata
+#   storage/incoming/{session_id}/data           contenido
+#   storage/incoming/{session_id}/parts/{n}      parte n recibida
+#   storage/incoming/{session_id}/done           sha256, una vez movido a uploads
+
+MIN_PART_BYTES = 1024 * 1024
+MAX_PARTS = 10000
+_ID = re.compile(r"[0-9a-f]{32}")
+_READ_CHUNK = 8 * 1024 * 1024
+
+class UploadSessionError(Exception):
+    pass
+
+class PartAlreadyReceived(UploadSessionError):
+    pass
+
+@dataclass
+class UploadSession:
+    session_id: str
+    filename: str
+    size: int
+    part_size: int
+    sha256: str | None = None
+    created: float = field(default_factory=time.time)
+
+    @property
+    def parts(self) -> int:
+        return math.ceil(self.size / self.part_size)
+
+    def part_range(self, n: int) -> tuple[int, int]:
+        """(offset, largo) de la parte `n`; la última puede ser más corta."""
+        if not 0 <= n < self.parts:
+            raise UploadSessionError(f"parte fuera de rango: {n} (hay {self.parts})")
+        off = n * self.part_size
+        return off, min(self.part_size, self.size - off)
+
+class PartWriter:
+    """Escribe una parte en su offset del archivo de la sesión; `close` valida el largo."""
+    def __init__(self, path: Path, offset: int, length: int):
+        self._f = path.open("r+b")
+        self._f.seek(offset)
+        self.length = length
+        self.written = 0
+
+    def write(self, chunk: bytes) -> None:
+        if self.written + len(chunk) > self.length:
+            raise UploadSessionError(f"la parte supera los {self.length} bytes esperados")
+        self._f.write(chunk)
+        self.written += len(chunk)
+
+    def close(self) -> None:
+        self._f.close()
+        if self.written != self.length:
+            raise UploadSessionError(f"parte incompleta: {self.written} de {self.length} bytes")
+
+    def abort(self) -> None:
+        self._f.close()
+
+class _Hashing:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.h = hashlib.sha256()
+        self.next = 0  # primera parte todavía no hasheada
+
+class UploadSessions:
+    """Sesiones de upload por partes bajo `root`; las que no se completan en `ttl` segundos se borran."""
+    def __init__(self, root: Path, part_size: int = 32 * 1024 * 1024, ttl: float = 24 * 3600):
+        self.root = root
+        self.part_size = part_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._hashing: dict[str, _Hashing] = {}
+
+    def _dir(self, sid: str) -> Path:
+        if not _ID.fullmatch(sid):
+            raise UploadSessionError("session_id inválido")
+        return self.root / sid
+
+    def create(self, filename: str, size: int, part_size: int | None = None,
+               sha256: str | None = None) -> UploadSession:
+        self.sweep()
+        part_size = part_size or self.part_size
+        if size < 0:
+            raise UploadSessionError("size negativo")
+        if part_size < MIN_PART_BYTES:
+            raise UploadSessionError(f"part_size mínimo: {MIN_PART_BYTES} bytes")
+        if math.ceil(size / part_size) > MAX_PARTS:
+            raise UploadSessionError(f"más de {MAX_PARTS} partes: usar un part_size mayor")
+        s = UploadSession(uuid.uuid4().hex, filename, size, part_size, sha256)
+        d = self.root / s.session_id
+        (d / "parts").mkdir(parents=True)
+        with (d / "data").open("wb") as f:
+            f.truncate(size)
+        (d / "session.json").write_text(json.dumps(asdict(s), ensure_ascii=False), encoding="utf-8")
+        return s
+
+    def get(self, sid: str) -> UploadSession | None:
+        try:
+            raw = (self._dir(sid) / "session.json").read_text(encoding="utf-8")
+        except (OSError, UploadSessionError):
+            return None
+        return UploadSession(**json.loads(raw))
+
+    def received(self, s: UploadSession) -> set[int]:
+        return {int(p.name) for p in (self.root / s.session_id / "parts").iterdir()}
+
+    def missing(self, s: UploadSession) -> list[int]:
+        got = self.received(s)
+        return [n for n in range(s.parts) if n not in got]
+
+    def part_writer(self, s: UploadSession, n: int) -> PartWriter:
+        off, length = s.part_range(n)
+        if (self.root / s.session_id / "parts" / str(n)).exists():
+            # puede estar hasheada: reescribirla dejaría el sha256 incremental desfasado
+            raise PartAlreadyReceived(f"la parte {n} ya se recibió")
+        return PartWriter(self.root / s.session_id / "data", off, length)
+
+    def mark(self, s: UploadSession, n: int) -> None:
+        """Registra la parte `n` (ya escrita) y avanza el hash si no hay otro hilo haciéndolo."""
+        (self.root / s.session_id / "parts" / str(n)).touch()
+        with self._lock:
+            st = self._hashing.get(s.session_id)
+            if st is not None and n < st.next:
+                # dos PUT de la misma parte a la vez: el hash empieza de nuevo
+                del self._hashing[s.session_id]
+        self._advance(s, blocking=False)
+
+    def _state(self, sid: str) -> _Hashing:
+        with self._lock:
+            st = self._hashing.get(sid)
+            if st is None:
+                st = self._hashing[sid] = _Hashing()
+            return st
+
+    def _advance(self, s: UploadSession, blocking: bool) -> _Hashing | None:
+        st = self._state(s.session_id)
+        if not st.lock.acquire(blocking=blocking):
+            return None
+        try:
+            got = self.received(s)
+            with (self.root / s.session_id / "data").open("rb") as f:
+                while st.next in got:
+                    off, length = s.part_range(st.next)
+                    f.seek(off)
+                    while length:
+                        b = f.read(min(_READ_CHUNK, length))
+                        if not b:
+                            raise UploadSessionError("archivo de la sesión truncado")
+                        st.h.update(b)
+                        length -= len(b)
+                    st.next += 1
+            return st
+        finally:
+            st.lock.release()
+
+    def complete(self, s: UploadSession) -> tuple[Path, str]:
+        """Verifica que estén todas las partes y el sha256; devuelve (archivo, sha256).
+
+        El archivo sigue en la carpeta de la sesión: moverlo (finalize_upload) y después `discard`.
+        """
+        missing = self.missing(s)
+        if missing:
+            raise UploadSessionError(f"faltan {len(missing)} partes (primera: {missing[0]})")
+        digest = self._advance(s, blocking=True).h.hexdigest()
+        if s.sha256 and digest != s.sha256:
+            # el contenido no sirve: que el cliente vuelva a subir todas las partes
+            self.reset(s)
+            raise UploadSessionError("el contenido no coincide con sha256; se descartaron las partes")
+        return self.root / s.session_id / "data", digest
+
+    @contextmanager
+    def completing(self, s: UploadSession) -> Iterator[None]:
+        """Lock de la sesión (entre workers) para que un solo complete la mueva a uploads."""
+        try:
+            f = (self.root / s.session_id / "session.json").open("rb")
+        except FileNotFoundError:
+            raise UploadSessionError("sesión no encontrada") from None
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def completed(self, s: UploadSession) -> str | None:
+        """sha256 del upload si la sesión ya se completó."""
+        try:
+            return (self.root / s.session_id / "done").read_text(encoding="ascii")
+        except FileNotFoundError:
+            return None
+
+    def finished(self, s: UploadSession, digest: str) -> None:
+        """Marca la sesión completada (el contenido ya se movió); el sweep la borra con el ttl."""
+        d = self.root / s.session_id
+        (d / "done").write_text(digest, encoding="ascii")
+        (d / "data").unlink(missing_ok=True)
+        with self._lock:
+            self._hashing.pop(s.session_id, None)
+
+    def reset(self, s: UploadSession) -> None:
+        for p in (self.root / s.session_id / "parts").iterdir():
+            p.unlink(missing_ok=True)
+        with self._lock:
+            self._hashing.pop(s.session_id, None)
+
+    def discard(self, sid: str) -> bool:
+        with self._lock:
+            self._hashing.pop(sid, None)
+        d = self._dir(sid)
+        if not d.exists():
+            return False
+        shutil.rmtree(d, ignore_errors=True)
+        return True
+
+    def sweep(self) -> None:
+        cutoff = time.time() - self.ttl
+        for d in self.root.iterdir():
+            if not d.is_dir() or not _ID.fullmatch(d.name):
+                continue
+            try:
+                # la carpeta parts/ cambia con cada parte recibida
+                if max(d.stat().st_mtime, (d / "parts").stat().st_mtime) < cutoff:
+                    self.discard(d.name)
+            except OSError:
+                pass
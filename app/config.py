@@ -7,8 +7,11 @@ STORAGE_DIR = BASE_DIR / "storage"
 UPLOADS_DIR = STORAGE_DIR / "uploads"
 OUTPUTS_DIR = STORAGE_DIR / "outputs"
 LOGS_DIR = STORAGE_DIR / "logs"
+ES_STATE_DIR = STORAGE_DIR / "es_state"  # checkpoints y documentos fallidos del push a ES, por run
+INCOMING_DIR = STORAGE_DIR / "incoming"  # uploads en curso; misma partición que UPLOADS_DIR (rename O(1))
+DELTA_DIR = STORAGE_DIR / "delta"  # huellas de filas del último run en modo delta, por cliente
 
-for d in (UPLOADS_DIR, OUTPUTS_DIR, LOGS_DIR):
+for d in (UPLOADS_DIR, OUTPUTS_DIR, LOGS_DIR, ES_STATE_DIR, INCOMING_DIR, DELTA_DIR):
     d.mkdir(parents=True, exist_ok=True)
 
 class ESConfig(BaseModel):
@@ -17,5 +20,57 @@ class ESConfig(BaseModel):
     password: str | None = os.getenv("ES_PASS")
     index_t1: str = os.getenv("ES_INDEX_T1", "qualys-t1")
     index_t2: str = os.getenv("ES_INDEX_T2", "qualys-t2")
+    # alias de los índices gestionados: otro nombre que los índices fijos, que siguen recibiendo
+    # las cargas no gestionadas (delta, push sin managed, python -m app)
+    alias_t1: str = os.getenv("ES_ALIAS_T1", "qualys-t1-managed")
+    alias_t2: str = os.getenv("ES_ALIAS_T2", "qualys-t2-managed")
 
 ES = ESConfig()
+
+# Bulk a ES: hilos concurrentes (compartidos por las 4 salidas), bytes por lote, reintentos ante 429,
+# conexiones del cliente compartido y lotes en cola antes de frenar el parseo (modo tee)
+ES_BULK_THREADS = int(os.getenv("ES_BULK_THREADS", "4"))
+ES_BULK_MAX_BYTES = int(os.getenv("ES_BULK_MAX_BYTES", str(10 * 1024 * 1024)))
+ES_BULK_MAX_RETRIES = int(os.getenv("ES_BULK_MAX_RETRIES", "5"))
+ES_POOL_CONNECTIONS = int(os.getenv("ES_POOL_CONNECTIONS", "10"))
+ES_TEE_QUEUE_BATCHES = int(os.getenv("ES_TEE_QUEUE_BATCHES", "8"))
+
+# Índices gestionados (ver es_index.py): cada carga en un índice propio publicado con un swap de
+# alias (ES_ALIAS_T1/ES_ALIAS_T2); shards, réplicas y refresh que quedan al terminar la carga y
+# segmentos del force-merge (0 = sin force-merge)
+ES_MANAGED_INDICES = os.getenv("ES_MANAGED_INDICES", "").lower() in ("1", "true", "yes")
+ES_INDEX_SHARDS = int(os.getenv("ES_INDEX_SHARDS", "1"))
+ES_INDEX_REPLICAS = int(os.getenv("ES_INDEX_REPLICAS", "1"))
+ES_INDEX_REFRESH_INTERVAL = os.getenv("ES_INDEX_REFRESH_INTERVAL", "1s")
+ES_FORCEMERGE_SEGMENTS = int(os.getenv("ES_FORCEMERGE_SEGMENTS", "1"))
+
+# Estado de los runs (SQLite; ":memory:" para no persistir): eventos de log por run, vencimiento y máximo
+RUN_STORE_PATH = os.getenv("RUN_STORE_PATH") or str(STORAGE_DIR / "runs.sqlite3")
+RUN_LOG_RING = int(os.getenv("RUN_LOG_RING", "5000"))
+RUN_TTL_HOURS = float(os.getenv("RUN_TTL_HOURS", "72"))
+RUN_MAX_RUNS = int(os.getenv("RUN_MAX_RUNS", "500"))
+
+# Vista previa por salida: primeras filas y muestra uniforme (reservoir) de todo el archivo
+PREVIEW_HEAD_ROWS = int(os.getenv("PREVIEW_HEAD_ROWS", "20"))
+PREVIEW_SAMPLE_ROWS = int(os.getenv("PREVIEW_SAMPLE_ROWS", "50"))
+
+# Perfil cProfile de todos los runs (si no, solo los que piden `profile`); se guarda junto a las salidas
+PROFILE_RUNS = os.getenv("PROFILE_RUNS", "").lower() in ("1", "true", "yes")
+
+# Runs ejecutándose a la vez (cada uno puede usar además su pool de procesos) y runs en espera
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "2"))
+MAX_QUEUED_RUNS = int(os.getenv("MAX_QUEUED_RUNS", "100"))
+
+# Upload por partes: tamaño de parte por defecto y horas sin actividad antes de borrar una sesión
+UPLOAD_PART_BYTES = int(os.getenv("UPLOAD_PART_BYTES", str(32 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+# Procesos para parsear archivos en paralelo (1 = secuencial en el hilo del job)
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", "1"))
+# Modo split: tamaño mínimo de cada rango de bytes de un mismo archivo
+SPLIT_CHUNK_BYTES = int(os.getenv("SPLIT_CHUNK_BYTES", str(256 * 1024 * 1024)))
+# Salida Parquet opcional: filas por row group
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "65536"))
+# Compresión por defecto de las salidas CSV ("", "gzip" o "zstd") y su nivel
+OUTPUT_COMPRESSION = os.getenv("OUTPUT_COMPRESSION", "") or None
+OUTPUT_COMPRESSION_LEVEL = int(os.getenv("OUTPUT_COMPRESSION_LEVEL")) if os.getenv("OUTPUT_COMPRESSION_LEVEL") else None
@@ -0,0 +1,132 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, TextIO
+import csv, fcntl, hashlib, json, os, re, time
+
+from .sinks import RowSink
+
+# Modo delta: por cliente y tipo de tabla (t1/t2) se guarda la huella de cada fila del último
+# run en delta, como uint64 ordenados en un archivo binario (8 bytes por fila). Un run en
+# delta escribe además salidas `-delta` con las filas cuya huella no estaba (nuevas o
+# cambiadas), manda solo esas al tee de ES y cuenta las huellas anteriores que ya no aparecen.
+#
+#   storage/delta/{cliente}-{hash}/t1.fp    huellas ordenadas y únicas
+#   storage/delta/{cliente}-{hash}/t1.json  run que las generó y cantidad
+#   storage/delta/{cliente}-{hash}/.lock    flock: un run en delta por cliente a la vez
+#
+# {cliente} va saneado (solo legible) y {hash} es del nombre original: clientes distintos
+# nunca comparten carpeta y ninguno sale de storage/delta.
+
+# cambian en cada run aunque la fila sea la misma
+EXCLUDED_COLUMNS = frozenset({"scan_name", "periodo"})
+_BUCKETS = 256  # las huellas del run se ordenan por byte alto: pico de memoria acotado al guardar
+
+def row_fingerprinter(fieldnames: list[str]) -> Callable[[tuple], int]:
+    """Huella de 64 bits de una fila (tupla en el orden de `fieldnames`).
+
+    Usa los pares columna/valor no vacíos ordenados por columna, así no depende del orden
+    ni de columnas vacías que agregue la unión de headers de otro run.
+    """
+    order = sorted((n, i) for i, n in enumerate(fieldnames) if n not in EXCLUDED_COLUMNS)
+
+    def fp(row: tuple) -> int:
+        raw = "\x1f".join(f"{n}\x1e{row[i]}" for n, i in order if row[i]).encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little")
+    return fp
+
+def index_dir(root: Path, cliente: str) -> Path:
+    safe = re.sub(r"[^\w-]", "_", cliente)[:64]
+    return root / f"{safe}-{hashlib.sha256(cliente.encode('utf-8')).hexdigest()[:12]}"
+
+@contextmanager
+def index_lock(d: Path) -> Iterator[None]:
+    """Lock exclusivo sobre los índices de la carpeta `d`, entre hilos y entre workers."""
+    d.mkdir(parents=True, exist_ok=True)
+    with (d / ".lock").open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # se suelta al cerrar
+        yield
+
+class DeltaIndex:
+    """Huellas de un cliente y tipo de tabla: las del run anterior (`prev`) y las de este run."""
+    def __init__(self, path: Path):
+        self.path = path
+        self.prev = array("Q")
+        self.meta: dict = {}
+        try:
+            self.prev.frombytes(path.read_bytes())
+        except (OSError, ValueError):  # primer run en delta o archivo dañado: todo es nuevo
+            self.prev = array("Q")
+        try:
+            self.meta = json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+        self._cur = [array("Q") for _ in range(_BUCKETS)]
+        self._new: list[array] | None = None
+
+    def seen(self, fp: int) -> bool:
+        i = bisect_left(self.prev, fp)
+        return i < len(self.prev) and self.prev[i] == fp
+
+    def add(self, fp: int) -> None:
+        self._cur[fp >> 56].append(fp)
+
+    def close(self) -> int:
+        """Ordena las huellas del run y devuelve cuántas del run anterior ya no están."""
+        self._new = []
+        gone = 0
+        lo = 0
+        for b, cur in enumerate(self._cur):
+            uniq = sorted(set(cur))
+            self._new.append(array("Q", uniq))
+            self._cur[b] = array("Q")
+            hi = bisect_left(self.prev, (b + 1) << 56) if b + 1 < _BUCKETS else len(self.prev)
+            present = set(uniq)
+            gone += sum(1 for fp in self.prev[lo:hi] if fp not in present)
+            lo = hi
+        return gone
+
+    def save(self, run_id: str) -> None:
+        """Reemplaza el índice por las huellas de este run (después de `close`)."""
+        assert self._new is not None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".fp.tmp")
+        with tmp.open("wb") as f:
+            for a in self._new:
+                a.tofile(f)
+        os.replace(tmp, self.path)
+        meta = {"run_id": run_id, "rows": sum(len(a) for a in self._new), "updated": time.time()}
+        self.path.with_suffix(".json").write_text(json.dumps(meta), encoding="utf-8")
+
+class DeltaSink:
+    """RowSink que escribe en `out` las filas que no estaban en el índice y solo esas pasa a `downstream`."""
+    def __init__(self, index: DeltaIndex, fieldnames: list[str], out: TextIO,
+                 downstream: list[RowSink] | None = None):
+        self.index = index
+        self.rows = 0
+        self._fp = row_fingerprinter(fieldnames)
+        self._out = out
+        self._w = csv.writer(out)
+        self._w.writerow(fieldnames)
+        self._downstream = downstream or []
+
+    def writerows(self, rows: list) -> None:
+        idx = self.index
+        changed = []
+        for r in rows:
+            fp = self._fp(r)
+            idx.add(fp)
+            if not idx.seen(fp):
+                changed.append(r)
+        if changed:
+            self._w.writerows(changed)
+            self.rows += len(changed)
+            for s in self._downstream:
+                s.writerows(changed)
+
+    def close(self) -> None:
+        for s in self._downstream:
+            s.close()
+        self._out.close()
@@ -0,0 +1,167 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterator
+from email.utils import formatdate
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from .storage import compression_of, csv_name, open_output_binary
+
+CHUNK = 1024 * 1024
+# compresión de la salida -> token de Content-Encoding / Content-Type del archivo tal cual
+_CONTENT_CODING = {"gzip": "gzip", "zstd": "zstd"}
+_RAW_MEDIA = {"gzip": "application/gzip", "zstd": "application/zstd"}
+
+def _accepts(accept_encoding: str, coding: str) -> bool:
+    """True si Accept-Encoding admite `coding` (respeta q=0 y el comodín *)."""
+    found_star = None
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try: q = float(v)
+                except ValueError: q = 0.0
+        if token == coding:
+            return q > 0
+        if token == "*":
+            found_star = q > 0
+    return bool(found_star)
+
+def _none_match(header: str | None, etag: str) -> bool:
+    """True si If-None-Match coincide con `etag`: "*", lista separada por comas y comparación
+    débil (RFC 9110: W/"x" y "x" son el mismo tag)."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == opaque for t in header.split(","))
+
+def _parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Rango único "bytes=a-b" / "a-" / "-n" -> (inicio, fin inclusivo).
+
+    None si no hay header o no se entiende (se sirve completo, como permite RFC 9110);
+    ValueError si el rango no es satisfacible.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, sep, end_s = header[len("bytes="):].strip().partition("-")
+    valid = sep and (start_s.isdigit() or start_s == "") and (end_s.isdigit() or end_s == "")
+    if not valid or start_s == end_s == "":
+        return None
+    if start_s == "":
+        n = int(end_s)
+        if n == 0 or size == 0:
+            raise ValueError("rango vacío")
+        return max(0, size - n), size - 1
+    start = int(start_s)
+    if end_s and int(end_s) < start:
+        return None
+    if start >= size:
+        raise ValueError("rango fuera del archivo")
+    end = int(end_s) if end_s else size - 1
+    return start, min(end, size - 1)
+
+def _iter_file(path: Path, start: int, length: int) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        f.seek(start)
+        while length > 0:
+            b = f.read(min(CHUNK, length))
+            if not b:
+                break
+            length -= len(b)
+            yield b
+
+def _disposition(filename: str) -> str:
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+def serve_file(
+    request: Request, path: Path, *, filename: str, media_type: str,
+    content_encoding: str | None = None,
+) -> Response:
+    """Sirve `path` tal cual con ETag, Last-Modified, If-None-Match, Range e If-Range."""
+    st = path.stat()
+    # cada representación tiene su ETag: la codificada no debe validar contra la identidad
+    tag = f"{st.st_size:x}-{st.st_mtime_ns:x}" + (f"-{content_encoding}" if content_encoding else "")
+    etag = f'"{tag}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": _disposition(filename),
+    }
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    if content_encoding or compression_of(path):
+        headers["Vary"] = "Accept-Encoding"
+
+    if _none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    rng = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            rng = _parse_range(request.headers.get("range"), st.st_size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{st.st_size}"
+            return Response(status_code=416, headers=headers)
+
+    if rng is None:
+        status, start, length = 200, 0, st.st_size
+    else:
+        status, start, length = 206, rng[0], rng[1] - rng[0] + 1
+        headers["Content-Range"] = f"bytes {rng[0]}-{rng[1]}/{st.st_size}"
+    headers["Content-Length"] = str(length)
+
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(_iter_file(path, start, length), status_code=status,
+                             headers=headers, media_type=media_type)
+
+def _iter_decompressed(path: Path) -> Iterator[bytes]:
+    with open_output_binary(path) as f:
+        while True:
+            b = f.read(CHUNK)
+            if not b:
+                break
+            yield b
+
+def serve_output(request: Request, path: Path, *, raw: bool = False,
+                 uncompressed_size: int | None = None) -> Response:
+    """Sirve una salida CSV negociando Accept-Encoding según su compresión en disco.
+
+    - sin compresión, o `raw`: el archivo tal cual (Range/resume soportado).
+    - comprimida y el cliente acepta esa codificación: bytes comprimidos con
+      Content-Encoding (Range sobre la representación codificada).
+    - si no: se descomprime al vuelo (sin Range; Content-Length si se conoce el tamaño).
+    """
+    comp = compression_of(path)
+    if comp is None:
+        return serve_file(request, path, filename=path.name, media_type="text/csv")
+    if raw:
+        return serve_file(request, path, filename=path.name, media_type=_RAW_MEDIA[comp])
+    coding = _CONTENT_CODING[comp]
+    if _accepts(request.headers.get("accept-encoding", ""), coding):
+        return serve_file(request, path, filename=csv_name(path), media_type="text/csv",
+                          content_encoding=coding)
+
+    st = path.stat()
+    etag = f'W/"{st.st_size:x}-{st.st_mtime_ns:x}-identity"'
+    headers = {
+        "ETag": etag,
+        "Content-Disposition": _disposition(csv_name(path)),
+        "Vary": "Accept-Encoding",
+    }
+    if _none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if uncompressed_size is not None:
+        headers["Content-Length"] = str(uncompressed_size)
+    if request.method == "HEAD":
+        return Response(headers=headers, media_type="text/csv")
+    return StreamingResponse(_iter_decompressed(path), headers=headers, media_type="text/csv")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 from pathlib import Path
+from .metrics import ENCODING_SECONDS
 
 # Firmas BOM conocidas
 _BOMS = [
@@ -12,6 +13,10 @@ _BOMS = [
 
 def detect_encoding(path: Path, sample_size: int = 512 * 1024) -> str:
     """Detecta encoding de manera rápida y robusta, sin cargar todo el archivo."""
+    with ENCODING_SECONDS.time():
+        return _detect_encoding(path, sample_size)
+
+def _detect_encoding(path: Path, sample_size: int) -> str:
     with path.open("rb") as f:
         head4 = f.read(4)
         # 1) BOM
@@ -0,0 +1,104 @@
+from __future__ import annotations
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import json, os
+
+from .config import ES_STATE_DIR
+
+CHECKPOINT_VERSION = 1
+
+@dataclass
+class Checkpoint:
+    """Avance del push de una salida: filas de datos confirmadas por ES, contiguas desde el inicio."""
+    key: str
+    file: str
+    index: str
+    rows: int = 0
+    byte_offset: int | None = None  # posición en el CSV sin comprimir tras `rows` filas (si se conoce)
+    complete: bool = False
+    failed_docs: int = 0
+    version: int = CHECKPOINT_VERSION
+
+def run_state_dir(run_id: str) -> Path:
+    return ES_STATE_DIR / run_id
+
+def checkpoint_path(run_id: str, key: str) -> Path:
+    return run_state_dir(run_id) / f"{key}.checkpoint.json"
+
+def failed_path(run_id: str, key: str) -> Path:
+    """Documentos rechazados por ES (pares de líneas NDJSON acción + fuente), para reenviarlos."""
+    return run_state_dir(run_id) / f"{key}.failed.ndjson"
+
+def load_checkpoint(run_id: str, key: str, file: str, index: str) -> Checkpoint | None:
+    """Checkpoint de la salida, o None si falta o es de otro archivo/índice/versión."""
+    try:
+        raw = json.loads(checkpoint_path(run_id, key).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if raw.get("version") != CHECKPOINT_VERSION or raw.get("file") != file or raw.get("index") != index:
+        return None
+    return Checkpoint(**raw)
+
+def save_checkpoint(run_id: str, cp: Checkpoint) -> None:
+    p = checkpoint_path(run_id, cp.key)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(asdict(cp)), encoding="utf-8")
+    os.replace(tmp, p)
+
+def reset_state(run_id: str, key: str) -> None:
+    for p in (checkpoint_path(run_id, key), failed_path(run_id, key)):
+        p.unlink(missing_ok=True)
+
+class Checkpointer:
+    """Lo que un BulkStream reporta mientras envía: avance confirmado y documentos fallidos.
+
+    Los lotes se confirman en cualquier orden (varios workers); el checkpoint solo avanza
+    hasta el último lote contiguo confirmado, así un reintento nunca salta filas sin enviar.
+    Un lote que falla por transporte (ES caído) no se confirma y frena el avance.
+    Con `resend` (reenvío de fallidos) no se toca el avance: los que vuelven a fallar
+    reemplazan al archivo de fallidos al terminar.
+    """
+    def __init__(self, run_id: str, cp: Checkpoint, *, resend: bool = False):
+        self.run_id = run_id
+        self.cp = cp
+        self.resend = resend
+        self._pending: dict[int, tuple[int, int | None]] = {}
+        self._failed_path = failed_path(run_id, cp.key)
+        self._failed_to = self._failed_path.with_suffix(".retry") if resend else self._failed_path
+        self._failed_fh = None
+        self._failed_docs = 0
+
+    def acked(self, first_row: int, end_row: int, byte_end: int | None) -> None:
+        if self.resend:
+            return
+        self._pending[first_row] = (end_row, byte_end)
+        advanced = False
+        while self.cp.rows in self._pending:
+            self.cp.rows, self.cp.byte_offset = self._pending.pop(self.cp.rows)
+            advanced = True
+        if advanced:
+            save_checkpoint(self.run_id, self.cp)
+
+    def failed(self, lines: list[bytes]) -> None:
+        if self._failed_fh is None:
+            self._failed_to.parent.mkdir(parents=True, exist_ok=True)
+            self._failed_fh = self._failed_to.open("wb" if self.resend else "ab")
+        for line in lines:
+            self._failed_fh.write(line + b"\n")
+        self._failed_docs += len(lines) // 2
+
+    def finish(self, total_rows: int) -> None:
+        if self._failed_fh is not None:
+            self._failed_fh.close()
+            self._failed_fh = None
+        if self.resend:
+            if self._failed_docs:
+                os.replace(self._failed_to, self._failed_path)
+            else:
+                self._failed_path.unlink(missing_ok=True)
+            self.cp.failed_docs = self._failed_docs
+        else:
+            self.cp.failed_docs += self._failed_docs
+            self.cp.complete = self.cp.rows >= total_rows
+        save_checkpoint(self.run_id, self.cp)
@@ -0,0 +1,123 @@
+from __future__ import annotations
+from elasticsearch import Elasticsearch, NotFoundError
+import re
+
+# Modo índice gestionado: cada carga va a un índice propio `{alias}-{cliente}-{fecha}-{carga}`,
+# creado desde un template con mappings explícitos. Mientras se carga no hay refresh ni
+# réplicas; al terminar bien se restauran, se hace force-merge y, en un solo _aliases, el alias
+# (ES_ALIAS_T1/ES_ALIAS_T2) pasa de los índices de cargas anteriores del mismo cliente y fecha
+# al nuevo, y esos se borran. Una carga que falla borra su índice: el alias nunca apunta a algo
+# a medio indexar. El alias no es ES_INDEX_T1/ES_INDEX_T2: esos siguen siendo índices concretos
+# para lo que no se gestiona (delta, push sin managed, python -m app), y un alias con varios
+# índices no admite escrituras.
+
+# Columnas conocidas de los reportes: keyword salvo los textos largos. Las demás columnas de la
+# unión también quedan keyword (dynamic template), sin el multi-field text+keyword por defecto.
+KEYWORD_COLUMNS = (
+    "Host IP", "DNS Hostname", "NetBIOS Hostname", "Tracking Method", "Operating System",
+    "operating system", "OS CPE", "Last Scan Date", "Evaluation Date", "Control ID", "Technology",
+    "Criticality Label", "Criticality Value", "Instance", "Status", "Deprecated",
+    "Exception Assignee", "Exception Status", "Passed", "Failed", "Error", "Exceptions",
+    "Percentage", "scan_name", "periodo",
+)
+TEXT_COLUMNS = ("Evidence", "Remediation", "Rationale", "Cause of Failure")
+KEYWORD_IGNORE_ABOVE = 1024
+
+def index_mappings() -> dict:
+    props: dict[str, dict] = {c: {"type": "keyword", "ignore_above": KEYWORD_IGNORE_ABOVE} for c in KEYWORD_COLUMNS}
+    props.update({c: {"type": "text"} for c in TEXT_COLUMNS})
+    props["Control"] = {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": KEYWORD_IGNORE_ABOVE}}}
+    return {
+        "dynamic_templates": [{"strings": {
+            "match_mapping_type": "string",
+            "mapping": {"type": "keyword", "ignore_above": KEYWORD_IGNORE_ABOVE},
+        }}],
+        "properties": props,
+    }
+
+def _slug(s: str) -> str:
+    # nombres de índice: minúsculas, sin espacios ni \/*?"<>|,#
+    return re.sub(r"[^a-z0-9_-]+", "-", s.lower()).strip("-_") or "x"
+
+def check_alias(client: Elasticsearch, alias: str) -> None:
+    """Falla si ya hay un índice concreto con el nombre del alias (ES no deja crear el alias)."""
+    if client.indices.exists(index=alias) and not client.indices.exists_alias(name=alias):
+        raise RuntimeError(
+            f"ya existe un índice {alias!r}: no puede usarse como alias de índices gestionados "
+            f"(reindexar y borrar ese índice, o configurar otro nombre en ES_ALIAS_T1/ES_ALIAS_T2)"
+        )
+
+class ManagedIndex:
+    """Carga de un tipo de tabla en un índice propio que se publica con un swap de alias."""
+    def __init__(self, client: Elasticsearch, alias: str, cliente: str, fecha: str, load_id: str, *,
+                 shards: int = 1, replicas: int = 1, refresh_interval: str = "1s", max_segments: int = 1):
+        self._client = client
+        self.alias = alias
+        self.prefix = f"{alias}-{_slug(cliente)}-{_slug(fecha)}-"
+        self.index = self.prefix + _slug(load_id)
+        self.shards = shards
+        self.replicas = replicas
+        self.refresh_interval = refresh_interval
+        self.max_segments = max_segments
+
+    def create(self) -> None:
+        """Crea el índice (el template se actualiza siempre) con refresh y réplicas apagados."""
+        check_alias(self._client, self.alias)
+        self._client.indices.put_index_template(
+            name=f"{self.alias}-ingest", index_patterns=[f"{self.alias}-*"], priority=200,
+            template={
+                "settings": {"index": {
+                    "number_of_shards": self.shards, "number_of_replicas": self.replicas,
+                    "refresh_interval": self.refresh_interval,
+                }},
+                "mappings": index_mappings(),
+            },
+        )
+        self._client.indices.create(index=self.index, settings={"index": {
+            "number_of_replicas": 0, "refresh_interval": "-1",
+        }})
+
+    def prepare(self) -> None:
+        """Restaura refresh y réplicas y hace force-merge (antes de que el alias apunte acá)."""
+        self._client.indices.put_settings(index=self.index, settings={"index": {
+            "number_of_replicas": self.replicas, "refresh_interval": self.refresh_interval,
+        }})
+        self._client.indices.refresh(index=self.index)
+        if self.max_segments > 0:
+            # puede tardar bastante más que un request normal
+            self._client.options(request_timeout=3600).indices.forcemerge(
+                index=self.index, max_num_segments=self.max_segments,
+            )
+
+    def superseded(self) -> list[str]:
+        """Índices de cargas anteriores del mismo cliente y fecha a los que apunta el alias."""
+        try:
+            current = self._client.indices.get_alias(name=self.alias)
+        except NotFoundError:
+            return []
+        return [i for i in current if i.startswith(self.prefix) and i != self.index]
+
+    def discard(self) -> None:
+        self._client.indices.delete(index=self.index, ignore_unavailable=True)
+
+def publish(client: Elasticsearch, indices: list[ManagedIndex]) -> list[str]:
+    """Prepara los índices y mueve todos sus alias en un solo _aliases (atómico).
+
+    Devuelve los índices reemplazados, que ya no tienen alias (ver `delete_indices`).
+    """
+    for m in indices:
+        check_alias(client, m.alias)
+        m.prepare()
+    actions: list[dict] = []
+    old: list[str] = []
+    for m in indices:
+        prev = m.superseded()
+        old += prev
+        actions += [{"remove": {"index": i, "alias": m.alias}} for i in prev]
+        actions.append({"add": {"index": m.index, "alias": m.alias}})
+    client.indices.update_aliases(actions=actions)
+    return old
+
+def delete_indices(client: Elasticsearch, names: list[str]) -> None:
+    if names:
+        client.indices.delete(index=",".join(names), ignore_unavailable=True)
@@ -1,30 +1,410 @@
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import Elasticsearch, ApiError, TransportError
+from dataclasses import dataclass, field
 from pathlib import Path
-import csv
-from typing import Iterator
+import csv, hashlib, itertools, json, queue, random, threading, time
+from .storage import open_output_binary, compression_of
+from .parser import _BATCH_ROWS
+from .es_checkpoint import Checkpointer
+from .es_index import ManagedIndex
+from .metrics import ES_BULK_SECONDS, ES_DOCS, ES_RETRIES
+
+# Lotes de bulk: se cortan por bytes (las filas de RESULTS varían mucho de tamaño) con un tope de docs
+DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+DEFAULT_MAX_CHUNK_DOCS = 50_000
+MAX_ERROR_DETAILS = 20  # errores de documento guardados por archivo
 
 class ESUploader:
-    def __init__(self, url: str, username: str | None, password: str | None):
+    """Cliente de ES de larga vida: el pool de conexiones se reutiliza entre requests y runs."""
+    def __init__(self, url: str, username: str | None, password: str | None, *, connections: int = 10):
         self.client = Elasticsearch(
             url,
             basic_auth=(username, password) if username and password else None,
-            request_timeout=120
+            request_timeout=120,
+            connections_per_node=connections,
         )
 
-    def _iter_csv(self, path: Path, index: str) -> Iterator[dict]:
-        with path.open("r", encoding="utf-8", errors="replace", newline="") as f:
-            reader = csv.DictReader(f)
+    def pool(self, **kwargs) -> 'BulkPool':
+        return BulkPool(self.client, **kwargs)
+
+    def managed_index(self, alias: str, cliente: str, fecha: str, load_id: str, **kwargs) -> ManagedIndex:
+        return ManagedIndex(self.client, alias, cliente, fecha, load_id, **kwargs)
+
+    def bulk_files(self, jobs: list['PushJob'], **kwargs) -> list['BulkStats']:
+        """Envía varios CSV de salida con workers de bulk compartidos; con checkpoint, retoma donde quedó."""
+        pool = self.pool(**kwargs)
+        readers = []
+        for job in jobs:
+            start = job.checkpoint.cp if job.checkpoint else None
+            stream = pool.stream(job.label, job.index, checkpoint=job.checkpoint,
+                                 start_row=start.rows if start else 0)
+            readers.append(threading.Thread(
+                target=_feed_csv, name=f"es-read-{job.label}",
+                args=(job.path, stream, start.rows if start else 0, start.byte_offset if start else None),
+            ))
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+        return pool.close()
+
+    def bulk_file(self, path: Path, index: str, **kwargs) -> tuple[int, int, list[dict]]:
+        st, = self.bulk_files([PushJob(path.name, path, index)], **kwargs)
+        return st.ok, st.failed, st.errors
+
+    def resend_lines(self, label: str, index: str, path: Path, checkpoint: Checkpointer, **kwargs) -> 'BulkStats':
+        """Reenvía documentos ya serializados (el NDJSON de fallidos de un push)."""
+        pool = self.pool(**kwargs)
+        stream = pool.stream(label, index, checkpoint=checkpoint)
+        try:
+            with path.open("rb") as f:
+                while lines := [ln.rstrip(b"\n") for ln in itertools.islice(f, 2 * _BATCH_ROWS)]:
+                    stream.write_lines(lines)
+        finally:
+            stream.close()
+        st, = pool.close()
+        return st
+
+    def close(self) -> None:
+        self.client.close()
+
+@dataclass
+class PushJob:
+    label: str
+    path: Path
+    index: str
+    checkpoint: Checkpointer | None = None
+
+def _feed_csv(path: Path, stream: 'BulkStream', start_row: int = 0, start_byte: int | None = None) -> None:
+    """Lee una salida y la pasa al stream desde la fila `start_row`.
+
+    Sin comprimir y con `start_byte` conocido se hace seek directo; si no, se saltean filas.
+    Cada fila va con su posición final en bytes (sin comprimir) para el checkpoint.
+    """
+    try:
+        with open_output_binary(path) as f:
+            pos = 0
+            def lines():
+                nonlocal pos
+                for raw in f:
+                    pos += len(raw)
+                    yield raw.decode("utf-8", errors="replace")
+            reader = csv.reader(lines())
+            header = next(reader, None)
+            if header is None:
+                return
+            stream.fieldnames = header
+            first = next(reader, None)
+            # Réplica del modo dos pasadas: puede haber headers repetidos antes de la primera fila
+            while first == header:
+                first = next(reader, None)
+            if first is None:
+                return
+            pending = [first]; ends = [pos]
+            if start_row:
+                pending = []; ends = []
+                if start_byte is not None and compression_of(path) is None:
+                    f.seek(start_byte)
+                    pos = start_byte
+                else:
+                    for _ in itertools.islice(reader, start_row - 1):
+                        pass
             for row in reader:
-                yield {"_index": index, "_source": row}
-
-    def bulk_file(self, path: Path, index: str, *, chunk_size: int = 5000) -> tuple[int, int, list[dict]]:
-        ok = 0; fail = 0; details: list[dict] = []
-        for success, info in helpers.streaming_bulk(
-            self.client, self._iter_csv(path, index),
-            chunk_size=chunk_size, max_retries=3, raise_on_error=False
-        ):
-            if success: ok += 1
-            else:
-                fail += 1
-                details.append(info)
-        return ok, fail, details
+                pending.append(row); ends.append(pos)
+                if len(pending) >= _BATCH_ROWS:
+                    stream.writerows(pending, ends)
+                    pending = []; ends = []
+            stream.writerows(pending, ends)
+    finally:
+        stream.close()
+
+@dataclass
+class BulkStats:
+    """Resultado de un stream de bulk (un archivo / una tabla)."""
+    label: str
+    index: str
+    ok: int = 0
+    failed: int = 0
+    bytes: int = 0
+    retries: int = 0
+    resumed_from: int = 0
+    started: float | None = None
+    finished: float | None = None
+    errors: list[dict] = field(default_factory=list)
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    def as_detail(self) -> dict:
+        secs = self.seconds
+        d = {
+            "file": self.label, "index": self.index, "ok": self.ok, "failed": self.failed,
+            "bytes": self.bytes, "retries": self.retries, "seconds": round(secs, 3),
+            "docs_per_sec": round(self.ok / secs, 1) if secs > 0 else None,
+        }
+        if self.resumed_from:
+            d["resumed_from"] = self.resumed_from
+        if self.errors:
+            d["errors"] = self.errors
+        return d
+
+class _Throttle:
+    """Pausa compartida por los workers: se duplica con cada rechazo (429) y se reduce
+    a la mitad con cada lote aceptado, así todos bajan el ritmo cuando el cluster se satura."""
+    def __init__(self, initial: float, maximum: float):
+        self._initial = initial
+        self._max = maximum
+        self._lock = threading.Lock()
+        self.delay = 0.0
+
+    def wait(self) -> None:
+        d = self.delay
+        if d:
+            time.sleep(d * random.uniform(0.5, 1.0))
+
+    def rejected(self) -> None:
+        with self._lock:
+            self.delay = min(self._max, max(self._initial, self.delay * 2))
+
+    def accepted(self) -> None:
+        with self._lock:
+            half = self.delay / 2
+            self.delay = half if half >= self._initial / 4 else 0.0
+
+@dataclass
+class _Chunk:
+    stream: 'BulkStream'
+    lines: list[bytes]
+    size: int
+    first_row: int
+    end_row: int
+    byte_end: int | None
+
+class BulkPool:
+    """Workers de bulk compartidos por varios streams (uno por archivo o tabla).
+
+    Cada stream serializa sus filas a NDJSON y corta lotes por `max_chunk_bytes`
+    (o `max_chunk_docs`); los lotes van a una cola acotada (`queue_chunks`) que
+    consumen `workers` hilos, así un ES lento frena a quien produce las filas.
+    Los 429 (del request o por documento) se reintentan hasta `max_retries` veces
+    con una pausa adaptativa común a todos los workers. Si ES queda inaccesible
+    tras los reintentos, el resto de los lotes se da por fallido sin enviarse (`error`).
+    """
+    def __init__(self, client: Elasticsearch, *, workers: int = 4,
+                 max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES, max_chunk_docs: int = DEFAULT_MAX_CHUNK_DOCS,
+                 max_retries: int = 5, initial_backoff: float = 0.5, max_backoff: float = 30.0,
+                 queue_chunks: int | None = None):
+        self._client = client
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_chunk_docs = max_chunk_docs
+        self._max_retries = max_retries
+        self._throttle = _Throttle(initial_backoff, max_backoff)
+        self._q: queue.Queue = queue.Queue(maxsize=queue_chunks or workers * 2)
+        self._lock = threading.Lock()
+        self._streams: list[BulkStream] = []
+        self.error: Exception | None = None
+        self._workers = [
+            threading.Thread(target=self._work, name=f"es-bulk-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._workers:
+            t.start()
+
+    def stream(self, label: str, index: str, fieldnames: list[str] | None = None, *,
+               checkpoint: Checkpointer | None = None, start_row: int = 0) -> 'BulkStream':
+        s = BulkStream(self, BulkStats(label, index, resumed_from=start_row), index, fieldnames,
+                       checkpoint=checkpoint, start_row=start_row)
+        with self._lock:
+            self._streams.append(s)
+        return s
+
+    def _put(self, chunk: _Chunk) -> None:
+        self._q.put(chunk)
+
+    def _work(self) -> None:
+        while (chunk := self._q.get()) is not None:
+            st = chunk.stream.stats
+            try:
+                if self.error is not None:
+                    self._fail(chunk.stream, chunk.lines, self.error)
+                elif self._send(chunk):
+                    cp = chunk.stream.checkpoint
+                    if cp is not None:
+                        with self._lock:
+                            cp.acked(chunk.first_row, chunk.end_row, chunk.byte_end)
+            except Exception as e:  # no tirar el worker: el lote cuenta como fallido
+                self._fail(chunk.stream, chunk.lines, e)
+            with self._lock:
+                st.bytes += chunk.size
+                st.finished = time.monotonic()
+
+    def _send(self, chunk: _Chunk) -> bool:
+        """Envía un lote; True si ES respondió por cada documento (aceptado o rechazado)."""
+        st = chunk.stream.stats
+        lines = chunk.lines
+        attempt = 0
+        while True:
+            self._throttle.wait()
+            t = time.perf_counter()
+            try:
+                resp = self._client.bulk(
+                    operations=lines, filter_path=["errors", "items.*.status", "items.*.error"],
+                )
+            except ApiError as e:
+                ES_BULK_SECONDS.observe(time.perf_counter() - t)
+                if e.meta.status == 429 and attempt < self._max_retries:
+                    attempt += 1
+                    self._retried(st)
+                    continue
+                self._fail(chunk.stream, lines, e)
+                return False
+            except TransportError as e:
+                if attempt < self._max_retries:
+                    attempt += 1
+                    self._retried(st)
+                    continue
+                self.error = e
+                self._fail(chunk.stream, lines, e)
+                return False
+
+            ES_BULK_SECONDS.observe(time.perf_counter() - t)
+            ok = 0; retry: list[bytes] = []; errors: list[dict] = []; rejected: list[bytes] = []
+            for i, item in enumerate(resp.get("items", [])):
+                op, info = next(iter(item.items()))
+                status = info.get("status", 500)
+                if status < 300:
+                    ok += 1
+                elif status == 429 and attempt < self._max_retries:
+                    retry += lines[2 * i:2 * i + 2]
+                else:
+                    errors.append({op: info})
+                    rejected += lines[2 * i:2 * i + 2]
+            ES_DOCS.inc(ok, result="ok")
+            if errors:
+                ES_DOCS.inc(len(errors), result="failed")
+            with self._lock:
+                st.ok += ok
+                st.failed += len(errors)
+                for err in errors:
+                    _add_error(st, err)
+                if rejected and chunk.stream.checkpoint is not None:
+                    chunk.stream.checkpoint.failed(rejected)
+            if not retry:
+                self._throttle.accepted()
+                return True
+            attempt += 1
+            self._retried(st)
+            lines = retry
+
+    def _fail(self, stream: 'BulkStream', lines: list[bytes], e: Exception) -> None:
+        ES_DOCS.inc(len(lines) // 2, result="failed")
+        with self._lock:
+            stream.stats.failed += len(lines) // 2
+            _add_error(stream.stats, {"error": str(e)})
+            # al reenviar fallidos no hay checkpoint que retome: lo no enviado sigue pendiente
+            if stream.checkpoint is not None and stream.checkpoint.resend:
+                stream.checkpoint.failed(lines)
+
+    def _retried(self, st: BulkStats) -> None:
+        ES_RETRIES.inc()
+        self._throttle.rejected()
+        with self._lock:
+            st.retries += 1
+
+    def close(self) -> list[BulkStats]:
+        """Espera a que se envíen los lotes encolados (cerrar antes los streams) y devuelve las estadísticas."""
+        for _ in self._workers:
+            self._q.put(None)
+        for t in self._workers:
+            t.join()
+        for s in self._streams:
+            if s.checkpoint is not None and s.closed:
+                s.checkpoint.finish(s.rows)
+        return [s.stats for s in self._streams]
+
+def _add_error(st: BulkStats, err: dict) -> None:
+    if len(st.errors) < MAX_ERROR_DETAILS:
+        st.errors.append(err)
+
+class BulkStream:
+    """RowSink que indexa en ES: serializa las filas (tuplas en el orden de `fieldnames`) y encola lotes.
+
+    El `_id` de cada documento es un hash del scan_name y del contenido de la fila (pares
+    columna/valor no vacíos, ordenados), así reenviar un archivo sobrescribe en vez de duplicar
+    aunque la unión de columnas cambie entre runs.
+    """
+    def __init__(self, pool: BulkPool, stats: BulkStats, index: str, fieldnames: list[str] | None, *,
+                 checkpoint: Checkpointer | None = None, start_row: int = 0):
+        self._pool = pool
+        self.stats = stats
+        self.checkpoint = checkpoint
+        self._index = json.dumps(index)
+        self.fieldnames = list(fieldnames) if fieldnames is not None else None
+        self._order: list[tuple[str, int]] | None = None
+        self._scan_col: int | None = None
+        self._lines: list[bytes] = []
+        self._size = 0
+        self.rows = start_row  # filas de datos vistas (incluye las salteadas al retomar)
+        self._first_row = start_row
+        self._byte_end: int | None = None
+        self.closed = False
+
+    def _prepare(self) -> None:
+        names = self.fieldnames
+        self._order = sorted((n, i) for i, n in enumerate(names))
+        self._scan_col = names.index("scan_name") if "scan_name" in names else None
+
+    def doc_id(self, row) -> str:
+        scan = row[self._scan_col] if self._scan_col is not None else ""
+        content = "\x1e".join(f"{n}\x1f{row[i]}" for n, i in self._order if row[i])
+        return hashlib.blake2b(f"{scan}\x1d{content}".encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+    def writerows(self, rows: list, ends: list[int] | None = None) -> None:
+        if not rows:
+            return
+        if self._pool.error is not None:
+            with self._pool._lock:
+                self.stats.failed += len(rows)
+            return
+        if self.stats.started is None:
+            self.stats.started = time.monotonic()
+        if self._order is None:
+            self._prepare()
+        names = self.fieldnames
+        prefix = f'{{"index":{{"_index":{self._index},"_id":"'.encode()
+        limit_bytes = self._pool.max_chunk_bytes
+        limit_lines = self._pool.max_chunk_docs * 2
+        for n, row in enumerate(rows):
+            action = prefix + self.doc_id(row).encode() + b'"}}'
+            src = json.dumps(dict(zip(names, row)), ensure_ascii=False, separators=(",", ":")).encode()
+            self._lines += (action, src)
+            self._size += len(action) + len(src) + 2
+            self.rows += 1
+            if ends is not None:
+                self._byte_end = ends[n]
+            if self._size >= limit_bytes or len(self._lines) >= limit_lines:
+                self._flush()
+
+    def write_lines(self, lines: list[bytes]) -> None:
+        """Pares acción/fuente ya serializados (reenvío de fallidos)."""
+        if self.stats.started is None:
+            self.stats.started = time.monotonic()
+        for i in range(0, len(lines) - 1, 2):
+            self._lines += lines[i:i + 2]
+            self._size += len(lines[i]) + len(lines[i + 1]) + 2
+            self.rows += 1
+            if self._size >= self._pool.max_chunk_bytes or len(self._lines) >= self._pool.max_chunk_docs * 2:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._lines:
+            self._pool._put(_Chunk(self, self._lines, self._size, self._first_row, self.rows, self._byte_end))
+            self._lines = []
+            self._size = 0
+            self._first_row = self.rows
+
+    def close(self) -> None:
+        self._flush()
+        self.closed = True
@@ -1,187 +1,943 @@
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks
-from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
 from datetime import datetime
-import tempfile, uuid, csv
-import json, time
-
-from .models import UploadResponse, ProcessRequest, ProcessResponse, ResultsResponse, ResultFile, PushToESResponse
-from .storage import finalize_upload, make_run_output_paths
-from .config import OUTPUTS_DIR, ES
-from .parser import scan_file_headers, process_file, _ensure_extra_cols_for_table1, _ensure_extra_cols_for_table2, HeaderUnion
-from .es_uploader import ESUploader
+from typing import Callable
+import uuid, csv, shutil, re, contextlib
+import json, time, threading
+
+from .models import (
+    UploadResponse, ProcessRequest, ProcessResponse, ResultsResponse, ResultFile, PushToESResponse, DeltaSummary,
+    PreviewResponse, PreviewTable, RunStatusResponse, UploadSessionRequest, UploadSessionResponse,
+    AppendRequest, SummaryResponse, SummaryTable,
+)
+from .storage import (
+    UploadSink, finalize_upload, find_upload, make_run_output_paths, make_parquet_paths, make_delta_paths, make_summary_paths, make_profile_path, open_output, compression_of,
+    run_output_dir, run_staging_dir, publish_run_outputs, remove_run_outputs,
+)
+from .config import (
+    OUTPUTS_DIR, ES, PROCESS_WORKERS, SPLIT_CHUNK_BYTES, PARQUET_ROW_GROUP_ROWS,
+    OUTPUT_COMPRESSION, OUTPUT_COMPRESSION_LEVEL, ES_TEE_QUEUE_BATCHES, ES_BULK_THREADS,
+    ES_BULK_MAX_BYTES, ES_BULK_MAX_RETRIES, ES_POOL_CONNECTIONS,
+    ES_MANAGED_INDICES, ES_INDEX_SHARDS, ES_INDEX_REPLICAS, ES_INDEX_REFRESH_INTERVAL, ES_FORCEMERGE_SEGMENTS,
+    RUN_STORE_PATH, RUN_LOG_RING, RUN_TTL_HOURS, RUN_MAX_RUNS, PROFILE_RUNS,
+    PREVIEW_HEAD_ROWS, PREVIEW_SAMPLE_ROWS, MAX_CONCURRENT_RUNS, MAX_QUEUED_RUNS,
+    INCOMING_DIR, UPLOAD_PART_BYTES, UPLOAD_SESSION_TTL_HOURS, DELTA_DIR,
+)
+from .downloads import serve_output, serve_file
+from .upload_stream import receive_upload, UploadError
+from .append import widen_csv, new_columns
+from .delta import DeltaIndex, DeltaSink, index_dir, index_lock
+from .chunked_upload import PartAlreadyReceived, UploadSession, UploadSessions, UploadSessionError
+from .parser import process_file, HeaderUnion, TableMark, RunCancelled, add_header_to_union
+from .pipeline import choose_mode, process_files
+from .sinks import TeeWriter, ParquetSink, RowSink, parquet_available
+from .es_uploader import ESUploader, BulkPool, BulkStats, PushJob
+from .es_index import ManagedIndex, publish as publish_indices, delete_indices
+from .es_checkpoint import Checkpoint, Checkpointer, load_checkpoint, reset_state, failed_path, run_state_dir
+from .run_store import RunStore, RunState
+from .run_events import EventHub, coalesce_progress
 from .utils import parse_fecha
 from .encoding import detect_encoding
+from .upload_index import UploadIndex, load_index, ensure_index, record_tables
+from .metrics import REGISTRY, RUN_SECONDS, RUNS_TOTAL, RUNS_ACTIVE
+from .profiling import RunProfiler
+from .preview import PreviewSet
+from .aggregates import AggregateSet, write_summaries
+from .scheduler import JobScheduler, QueueFull
+from .logging_setup import logger
 
 app = FastAPI(title="Qualys CSV Processor")
 
-RUN_LOGS: dict[str, list[str]] = {}
-RUN_WARN: dict[str, list[str]] = {}
-RUN_FILES: dict[str, dict[str, Path]] = {}
-RUN_COUNTS: dict[str, dict[str, int]] = {}
-RUN_FNS: dict[str, dict[str, list[str]]] = {}
-RUN_HANDLES: dict[str, dict[str, any]] = {}  # file handles para cerrar
+# Estado de los runs: logs, salidas, conteos, fieldnames, artefactos (ver run_store)
+HUB = EventHub()
+def _evict_run(run_id: str) -> None:
+    remove_run_outputs(run_id)
+    shutil.rmtree(run_state_dir(run_id), ignore_errors=True)
+
+RUNS = RunStore(
+    RUN_STORE_PATH, ring=RUN_LOG_RING, ttl=RUN_TTL_HOURS * 3600, max_runs=RUN_MAX_RUNS,
+    on_evict=_evict_run, on_change=HUB.notify,
+)
+def _run_done(run_id: str) -> None:
+    # el job cierra el run en su propio finally; si no llegó (falló antes), queda como error
+    run = RUNS.get(run_id)
+    if run is not None and run.finished is None:
+        if run.status in ("queued", "running"):
+            run.status = "error"
+        RUNS.finish(run_id)
+
+# Runs en hilos propios (no en el threadpool de requests), con tope de concurrencia y cola con prioridad
+SCHEDULER = JobScheduler(
+    MAX_CONCURRENT_RUNS, MAX_QUEUED_RUNS,
+    on_queue=lambda run_id, pos: RUNS.log(run_id, json.dumps({"type": "queue", "position": pos})),
+    on_error=lambda run_id, e: logger.error("run_failed", run_id=run_id, error=f"{type(e).__name__}: {e}"),
+    on_done=_run_done,
+)
+# Uploads por partes (reanudables, partes en paralelo)
+SESSIONS = UploadSessions(INCOMING_DIR, part_size=UPLOAD_PART_BYTES, ttl=UPLOAD_SESSION_TTL_HOURS * 3600)
+SSE_KEEPALIVE_S = 15.0
+SSE_REMOTE_POLL_S = 1.0  # runs de otro worker: solo se ven vía SQLite
+
+_ES_UPLOADER: ESUploader | None = None
+_ES_LOCK = threading.Lock()
+
+def es_uploader() -> ESUploader:
+    """Cliente de ES compartido por toda la app (pool de conexiones de larga vida)."""
+    global _ES_UPLOADER
+    with _ES_LOCK:
+        if _ES_UPLOADER is None:
+            _ES_UPLOADER = ESUploader(ES.url, ES.username, ES.password, connections=ES_POOL_CONNECTIONS)
+        return _ES_UPLOADER
+
+def es_index_for(key: str, run: RunState | None = None) -> str:
+    # un run publicado como índice gestionado sigue escribiendo en el suyo (el alias tiene varios)
+    if run is not None and run.es_indices:
+        return run.es_indices[key[:2]]
+    return ES.index_t1 if key.startswith("t1_") else ES.index_t2
+
+def managed_indices(cliente: str, fecha: str, load_id: str) -> dict[str, ManagedIndex]:
+    """Un índice nuevo por tipo de tabla (t1/t2), con alias ES_ALIAS_T1/ES_ALIAS_T2."""
+    aliases = {"t1": ES.alias_t1, "t2": ES.alias_t2}
+    return {t: es_uploader().managed_index(
+        aliases[t], cliente, fecha, load_id, shards=ES_INDEX_SHARDS, replicas=ES_INDEX_REPLICAS,
+        refresh_interval=ES_INDEX_REFRESH_INTERVAL, max_segments=ES_FORCEMERGE_SEGMENTS,
+    ) for t in ("t1", "t2")}
+
+def discard_indices(loads: dict[str, ManagedIndex], warn: Callable[[str], None]) -> None:
+    for m in loads.values():
+        try:
+            m.discard()
+        except Exception as e:
+            warn(f"No se pudo borrar el índice {m.index}: {type(e).__name__}: {e}")
+
+def publish_managed(loads: dict[str, ManagedIndex], run: RunState, res: PushToESResponse) -> None:
+    """Publica la carga si ES aceptó todos los documentos; si no, la descarta y el alias queda como estaba."""
+    if res.failed:
+        run.warn(f"Índices no publicados: {res.failed} documentos fallidos (el alias no cambió)")
+        discard_indices(loads, run.warn)
+        return
+    try:
+        old = publish_indices(es_uploader().client, list(loads.values()))
+    except Exception as e:
+        run.warn(f"Índices no publicados: {type(e).__name__}: {e}")
+        discard_indices(loads, run.warn)
+        return
+    run.es_indices = {t: m.index for t, m in loads.items()}
+    res.published = {m.alias: m.index for m in loads.values()}
+    try:
+        delete_indices(es_uploader().client, old)
+    except Exception as e:
+        run.warn(f"No se pudieron borrar los índices reemplazados {old}: {type(e).__name__}: {e}")
+
+def es_bulk_options() -> dict:
+    return {"workers": ES_BULK_THREADS, "max_chunk_bytes": ES_BULK_MAX_BYTES, "max_retries": ES_BULK_MAX_RETRIES}
+
+def es_response(stats: list[BulkStats], seconds: float) -> PushToESResponse:
+    ok = sum(st.ok for st in stats); failed = sum(st.failed for st in stats)
+    return PushToESResponse(
+        total_docs=ok + failed, failed=failed, details=[st.as_detail() for st in stats],
+        seconds=round(seconds, 3), docs_per_sec=round(ok / seconds, 1) if seconds > 0 else None,
+    )
+
+@app.on_event("shutdown")
+def stop_scheduler() -> None:
+    # los runs en curso cortan en su próximo lote; los que esperaban quedan cancelados
+    for run_id in SCHEDULER.shutdown(timeout=30):
+        run = RUNS.get(run_id)
+        if run is not None:
+            run.status = "cancelled"
+        RUNS.finish(run_id)
+
+@app.on_event("shutdown")
+def close_es() -> None:
+    if _ES_UPLOADER is not None:
+        _ES_UPLOADER.close()
+
+@app.on_event("shutdown")
+def close_runs() -> None:
+    RUNS.close()
+
+def _upload_response(digest: str, path: Path, size: int, dedup: bool) -> UploadResponse:
+    return UploadResponse(upload_id=digest, filename=path.name, size=size, deduplicated=dedup)
+
+def _valid_sha256(h: str) -> bool:
+    return len(h) == 64 and all(c in "0123456789abcdef" for c in h)
 
 @app.post("/api/upload", response_model=UploadResponse)
-async def upload(file: UploadFile = File(...)):
-    # Escritura streaming a /tmp sin cargar el archivo a RAM
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        total = 0
-        while True:
-            chunk = await file.read(8 * 1024 * 1024)  # 8MB
-            if not chunk: break
-            tmp.write(chunk); total += len(chunk)
-        tmp_path = Path(tmp.name)
-    digest, final_path, size = finalize_upload(tmp_path, file.filename)
-    return UploadResponse(upload_id=digest, filename=final_path.name, size=size)
+async def upload(request: Request, sha256: str | None = None):
+    # Con `sha256` (hash completo que calculó el cliente) un contenido ya guardado no se vuelve
+    # a recibir: se responde antes de leer el body.
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        if not _valid_sha256(sha256):
+            return JSONResponse(status_code=400, content={"detail": "sha256 inválido"})
+        existing = find_upload(sha256)
+        if existing is not None:
+            return _upload_response(sha256[:16], existing, existing.stat().st_size, True)
+    # Escritura streaming sin cargar el archivo a RAM; el sha256 se calcula con cada chunk
+    sink = UploadSink()
+    try:
+        filename = await receive_upload(request, sink)
+    except UploadError as e:
+        sink.discard()
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    except BaseException:
+        sink.discard()
+        raise
+    sink.close()
+    digest = sink.hexdigest()
+    if sha256 is not None and digest != sha256:
+        sink.path.unlink(missing_ok=True)
+        return JSONResponse(status_code=400, content={"detail": "el contenido no coincide con sha256"})
+    return _upload_response(*finalize_upload(sink.path, filename, digest))
 
-@app.post("/api/process", response_model=ProcessResponse)
-async def process(req: ProcessRequest, bg: BackgroundTasks):
-    run_id = datetime.utcnow().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
-    RUN_LOGS[run_id] = []
-    RUN_WARN[run_id] = []
+@app.get("/api/uploads/{sha256}", response_model=UploadResponse)
+def get_upload(sha256: str):
+    """Consulta por hash (completo o los 16 primeros hex) antes de subir."""
+    sha256 = sha256.lower()
+    if not re.fullmatch(r"[0-9a-f]{16,64}", sha256):
+        return JSONResponse(status_code=400, content={"detail": "sha256 inválido"})
+    existing = find_upload(sha256)
+    if existing is None:
+        return JSONResponse(status_code=404, content={"detail": "upload no encontrado"})
+    return _upload_response(sha256[:16], existing, existing.stat().st_size, True)
 
-    def log(msg: str):
-        RUN_LOGS[run_id].append(msg)
+# Upload por partes: crear sesión, PUT de cada parte (en cualquier orden y en paralelo),
+# GET para saber cuáles faltan y complete. El resultado es un upload como el de /api/upload.
+def _session_response(s: UploadSession) -> UploadSessionResponse:
+    return UploadSessionResponse(session_id=s.session_id, part_size=s.part_size, parts=s.parts,
+                                 missing=SESSIONS.missing(s))
+
+@app.post("/api/upload-sessions", response_model=UploadSessionResponse)
+def create_upload_session(req: UploadSessionRequest):
+    sha256 = req.sha256.lower() if req.sha256 else None
+    if sha256 is not None:
+        if not _valid_sha256(sha256):
+            return JSONResponse(status_code=400, content={"detail": "sha256 inválido"})
+        existing = find_upload(sha256)
+        if existing is not None:
+            return UploadSessionResponse(upload=_upload_response(sha256[:16], existing, existing.stat().st_size, True))
+    name = Path(req.filename.replace("\\", "/")).name or "upload"
+    try:
+        s = SESSIONS.create(name, req.size, req.part_size, sha256)
+    except UploadSessionError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    return _session_response(s)
+
+@app.get("/api/upload-sessions/{session_id}", response_model=UploadSessionResponse)
+def get_upload_session(session_id: str):
+    s = SESSIONS.get(session_id)
+    if s is None:
+        return JSONResponse(status_code=404, content={"detail": "sesión no encontrada"})
+    return _session_response(s)
 
+@app.put("/api/upload-sessions/{session_id}/parts/{n}")
+async def put_upload_part(session_id: str, n: int, request: Request):
+    s = SESSIONS.get(session_id)
+    if s is None:
+        return JSONResponse(status_code=404, content={"detail": "sesión no encontrada"})
+    try:
+        w = SESSIONS.part_writer(s, n)
+    except PartAlreadyReceived as e:
+        return JSONResponse(status_code=409, content={"detail": str(e)})
+    except UploadSessionError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    try:
+        async for chunk in request.stream():
+            w.write(chunk)
+        w.close()
+    except UploadSessionError as e:
+        w.abort()
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    except BaseException:
+        w.abort()
+        raise
+    await run_in_threadpool(SESSIONS.mark, s, n)
+    return Response(status_code=204)
+
+@app.post("/api/upload-sessions/{session_id}/complete", response_model=UploadResponse)
+def complete_upload_session(session_id: str):
+    s = SESSIONS.get(session_id)
+    if s is None:
+        return JSONResponse(status_code=404, content={"detail": "sesión no encontrada"})
+    try:
+        with SESSIONS.completing(s):
+            digest = SESSIONS.completed(s)
+            if digest is not None:  # complete repetido: el mismo upload
+                existing = find_upload(digest[:16])
+                if existing is None:
+                    return JSONResponse(status_code=404, content={"detail": "el upload de la sesión ya no existe"})
+                return _upload_response(digest[:16], existing, existing.stat().st_size, True)
+            path, digest = SESSIONS.complete(s)
+            res = _upload_response(*finalize_upload(path, s.filename, digest))
+            SESSIONS.finished(s, digest)
+    except UploadSessionError as e:
+        if SESSIONS.get(session_id) is None:
+            return JSONResponse(status_code=404, content={"detail": "sesión no encontrada"})
+        return JSONResponse(status_code=409, content={"detail": str(e), "missing": SESSIONS.missing(s)})
+    return res
+
+@app.delete("/api/upload-sessions/{session_id}")
+def delete_upload_session(session_id: str):
+    if SESSIONS.get(session_id) is None or not SESSIONS.discard(session_id):
+        return JSONResponse(status_code=404, content={"detail": "sesión no encontrada"})
+    return Response(status_code=204)
+
+def delta_index_path(cliente: str, table_type: str) -> Path:
+    return index_dir(DELTA_DIR, cliente) / f"{table_type}.fp"
+
+def _resolve_uploads(ids: list[str], warnings: list[str]) -> list[Path]:
     # Resolver paths de uploads por prefijo {upload_id}_
     files: list[Path] = []
     up_dir = Path("storage/uploads")
-    for uid in req.files:
+    for uid in ids:
         matches = list(up_dir.glob(f"{uid}_*"))
         if not matches:
-            RUN_WARN[run_id].append(f"Archivo no encontrado: {uid}")
+            warnings.append(f"Archivo no encontrado: {uid}")
             continue
         files.append(matches[0])
+    return files
+
+@app.post("/api/process", response_model=ProcessResponse)
+async def process(req: ProcessRequest):
+    run_id = datetime.utcnow().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+    run = RUNS.create(run_id)
 
+    def log(msg: str):
+        RUNS.log(run_id, msg)
+
+    warnings: list[str] = []
+    files = _resolve_uploads(req.files, warnings)
+    for w in warnings:
+        run.warn(w)
     if not files:
-        RUN_WARN[run_id].append("No hay archivos válidos para procesar.")
+        run.warn("No hay archivos válidos para procesar.")
+
+    compression = req.compression or OUTPUT_COMPRESSION
+    compression = None if compression == "none" else compression
+    level = req.compression_level if req.compression_level is not None else OUTPUT_COMPRESSION_LEVEL
+    # el job escribe en una carpeta de trabajo del run; al terminar bien se publica con un rename
+    outputs = make_run_output_paths(run_id, req.cliente, req.fecha, compression, root=run_staging_dir(run_id))
+    run.files = make_run_output_paths(run_id, req.cliente, req.fecha, compression)
+    run.counts = {k: 0 for k in outputs.keys()}
+    run.params = {"cliente": req.cliente, "fecha": req.fecha, "level": level}
+    run.sources = [p.name for p in files]
 
-    outputs = make_run_output_paths(run_id, req.cliente, req.fecha)
-    RUN_FILES[run_id] = outputs
-    RUN_COUNTS[run_id] = {k: 0 for k in outputs.keys()}
-    RUN_HANDLES[run_id] = {}
+    def published(path: Path) -> Path:
+        return run_output_dir(run_id) / path.name
 
-    def job():
-        # Detectar encoding por archivo
+    parquet_paths: dict[str, Path] = {}
+    if req.parquet:
+        if parquet_available():
+            parquet_paths = make_parquet_paths(outputs)
+        else:
+            run.warn("Salida Parquet no disponible: falta pyarrow")
+
+    profiler = RunProfiler(enabled=PROFILE_RUNS if req.profile is None else req.profile)
+    managed = req.push_es and (ES_MANAGED_INDICES if req.es_managed is None else req.es_managed)
+    if managed and req.delta:
+        run.warn("Índice gestionado no disponible en modo delta: se indexa en los índices fijos")
+        managed = False
+    loads = managed_indices(req.cliente, req.fecha, run_id) if managed else {}
+    summary_paths = make_summary_paths(outputs, req.cliente, req.fecha)
+    delta_paths = make_delta_paths(outputs) if req.delta else {}
+    delta_sinks: dict[str, DeltaSink] = {}
+    delta_index: dict[str, DeltaIndex] = {}
+
+    def job(cancel: threading.Event):
+        run.status = "running"
+        tee = None
+        if req.push_es:
+            tee = es_uploader().pool(queue_chunks=ES_TEE_QUEUE_BATCHES, **es_bulk_options())
+            log(json.dumps({"type": "log", "message": "Tee a Elasticsearch activo"}))
+        t0 = time.monotonic()
+        status = "error"
+        RUNS_ACTIVE.inc()
+        # runs en delta del mismo cliente, de a uno (también entre workers): cada uno compara contra el anterior
+        delta_lock = index_lock(index_dir(DELTA_DIR, req.cliente)) if req.delta else contextlib.nullcontext()
+        try:
+            with delta_lock:
+                if req.delta:
+                    delta_index.update({t: DeltaIndex(delta_index_path(req.cliente, t)) for t in ("t1", "t2")})
+                try:
+                    for m in loads.values():
+                        m.create()
+                    profiler.call(run_job, tee, cancel)
+                finally:
+                    if tee is not None:
+                        res = es_response(tee.close(), time.monotonic() - t0)
+                        run.es = res.model_dump()
+                        log(json.dumps({"type": "log", "message": f"Elasticsearch: {res.total_docs - res.failed} ok, {res.failed} fallidos"}))
+                    if profiler.enabled:
+                        save_profile()
+                if req.delta:
+                    close_delta()
+                publish_run_outputs(run_id)
+                for idx in delta_index.values():
+                    idx.save(run_id)
+                if loads:
+                    publish_managed(loads, run, res)
+                    run.es = res.model_dump()
+                    if res.published:
+                        log(json.dumps({"type": "log", "message": "Índices publicados: " + ", ".join(
+                            f"{a} -> {i}" for a, i in res.published.items())}))
+            status = "ok"
+            log("Proceso finalizado")
+        except RunCancelled:
+            status = "cancelled"
+            log(json.dumps({"type": "log", "message": "Run cancelado"}))
+        except Exception as e:
+            log(json.dumps({"type": "error", "message": f"{type(e).__name__}: {e}"}))
+            raise
+        finally:
+            if status != "ok":
+                remove_run_outputs(run_id)  # nunca quedan salidas a medias
+                discard_indices(loads, run.warn)  # ni índices a medio cargar
+            run.status = status
+            RUNS_ACTIVE.dec()
+            RUNS_TOTAL.inc(status=status)
+            RUN_SECONDS.observe(time.monotonic() - t0, status=status)
+            RUNS.finish(run_id)
+
+    def close_delta():
+        disappeared = {t: idx.close() for t, idx in delta_index.items()}
+        run.delta = {
+            "rows": {key: sink.rows for key, sink in delta_sinks.items()},
+            "disappeared": disappeared,
+            "baseline": {t: idx.meta.get("run_id") for t, idx in delta_index.items()},
+        }
+        log(json.dumps({"type": "log", "message": "Delta: " + ", ".join(
+            f"{key} {n} nuevas o cambiadas" for key, n in run.delta["rows"].items()
+        ) + f"; desaparecidas t1 {disappeared['t1']}, t2 {disappeared['t2']}"}))
+
+    def save_profile():
+        # hilo del job + una parte por tarea del pool, unidos en un .prof y un resumen .txt
+        paths = profiler.write(make_profile_path(outputs, req.cliente, req.fecha))
+        if not paths:
+            run.warn("Perfil no disponible: hay otro run perfilándose en este proceso")
+        for p in paths:
+            run.add_artifact(f"profile{p.suffix}", published(p))
+        if paths:
+            log(json.dumps({"type": "log", "message": f"Perfil guardado: {paths[0].name}"}))
+
+    def save_summary(aggregates: AggregateSet):
+        # JSON siempre; Parquet (formato largo) si el run pidió salidas Parquet
+        run.summary = aggregates.to_json(outputs)
+        paths = {k: p for k, p in summary_paths.items() if parquet_paths or not k.endswith(".parquet")}
+        write_summaries(paths, run.summary)
+        for key, path in paths.items():
+            run.add_artifact(key, published(path))
+
+    def run_job(tee: BulkPool | None, cancel: threading.Event):
+        workers = req.workers or PROCESS_WORKERS
+        split_bytes = SPLIT_CHUNK_BYTES if req.split else None
+        _, one_pass = choose_mode(len(files), workers, split_bytes, req.single_pass)
+
+        # Encoding y tablas por archivo desde el índice sidecar del upload
         enc_by_file: dict[Path, str] = {}
+        idx_by_file: dict[Path, UploadIndex | None] = {}
         for p in files:
-            enc = detect_encoding(p)
+            if one_pass:
+                # sin índice previo no se escanea aparte: se registra al terminar de procesar
+                idx = load_index(p); cached = idx is not None
+            else:
+                idx, cached = ensure_index(p)
+            enc = idx.encoding if idx else detect_encoding(p)
             enc_by_file[p] = enc
-            log(json.dumps({"type": "log", "message": f"{p.name}: encoding detectado = {enc}"}))
+            idx_by_file[p] = idx
+            origen = " (índice)" if cached else ""
+            log(json.dumps({"type": "log", "message": f"{p.name}: encoding detectado = {enc}{origen}"}))
+        tables_by_file: dict[Path, list[TableMark]] = {p: [] for p in files}
+        previews = PreviewSet(PREVIEW_HEAD_ROWS, PREVIEW_SAMPLE_ROWS)
+        aggregates = AggregateSet()
+
+        def sinks(key: str, fieldnames: list[str]) -> list[RowSink]:
+            extra: list[RowSink] = []
+            if parquet_paths:
+                pq_key = f"{key}.parquet"
+                extra.append(ParquetSink(parquet_paths[pq_key], fieldnames, row_group_rows=PARQUET_ROW_GROUP_ROWS))
+                run.add_artifact(pq_key, published(parquet_paths[pq_key]))
+            if delta_paths:
+                # en delta el tee recibe solo las filas nuevas o cambiadas (sin checkpoint:
+                # push-to-es retoma sobre la salida completa)
+                d_key = f"{key}.delta"
+                es_sinks = [tee.stream(delta_paths[d_key].name, es_index_for(key), fieldnames)] if tee else []
+                out = open_output(delta_paths[d_key], level=level)
+                sink = delta_sinks[key] = DeltaSink(delta_index[key[:2]], fieldnames, out, es_sinks)
+                extra.append(sink)
+                run.add_artifact(d_key, published(delta_paths[d_key]))
+            elif loads:
+                # índice propio del run: sin checkpoint, si la carga falla se descarta entero
+                extra.append(tee.stream(outputs[key].name, loads[key[:2]].index, fieldnames))
+            elif tee is not None:
+                # el checkpoint del tee permite retomar luego con push-to-es si ES falló a mitad
+                reset_state(run_id, key)
+                cp = Checkpointer(run_id, Checkpoint(key, outputs[key].name, es_index_for(key)))
+                extra.append(tee.stream(outputs[key].name, es_index_for(key), fieldnames, checkpoint=cp))
+            return extra
+
+        def open_out(key: str, path: Path):
+            # comprime de forma incremental según el sufijo; registra el tamaño sin comprimir
+            return open_output(path, level=level,
+                               on_close=lambda n: run.set_raw_size(key, n))
+
+        def save_indexes():
+            for p in files:
+                record_tables(p, idx_by_file[p], tables_by_file[p], enc_by_file[p])
 
         y, m, d = parse_fecha(req.fecha)
 
-        # 1) Unión de headers por tipo (con progreso)
-        t1n: list[str] = []; t1a: list[str] = []
-        t2n: list[str] = []; t2a: list[str] = []
         def progress_evt(evt: dict):
             # Calcula tasas promedio usando elapsed_s
             e = max(evt.get("elapsed_s", 0.0), 1e-6)
             evt["rows_per_sec"] = round(evt.get("rows", 0) / e, 2)
             evt["mb_per_sec"] = round((evt.get("bytes", 0) / 1_000_000.0) / e, 2)
-            RUN_LOGS[run_id].append(json.dumps({"type": "progress", **evt}))
+            log(json.dumps({"type": "progress", **evt}))
+
+        run.fns = process_files(
+            files, enc_by_file, outputs,
+            cliente=req.cliente, y=y, m=m, d=d,
+            counts=run.counts,
+            open_out=open_out,
+            spill_dir=OUTPUTS_DIR,
+            log=lambda m: log(json.dumps({"type": "log", "message": m})),
+            progress=progress_evt,
+            sinks=sinks,
+            workers=workers,
+            split_bytes=split_bytes,
+            single_pass=req.single_pass,
+            # dos pasadas: headers desde el índice, sin releer el archivo
+            tables_of=lambda p: idx_by_file[p].tables,
+            offsets_by_file={p: i.marker_offsets() for p, i in idx_by_file.items() if i},
+            tables_by_file=tables_by_file,
+            profiler=profiler if profiler.enabled else None,
+            preview=previews,
+            aggregates=aggregates,
+            cancel=cancel,
+        )
+        run.preview = previews.to_json(run.fns)
+        save_summary(aggregates)
+        save_indexes()
+
+    try:
+        position = SCHEDULER.submit(run_id, job, priority=req.priority)
+    except QueueFull as e:
+        run.status = "rejected"
+        run.warn(f"Cola llena: {e}")
+        RUNS.finish(run_id)
+        return JSONResponse(status_code=429, content={"detail": f"cola de runs llena ({e})", "run_id": run_id})
+    return ProcessResponse(run_id=run_id, position=position)
+
+@app.post("/api/runs/{run_id}/files", response_model=ProcessResponse)
+async def append_files(run_id: str, req: AppendRequest):
+    """Agrega reportes a un run terminado: parsea solo los nuevos y extiende sus salidas."""
+    prev = RUNS.get(run_id)
+    if prev is None:
+        return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+    if not prev.params:
+        return JSONResponse(status_code=409, content={"detail": "el run no guarda sus parámetros (es anterior a esta versión)"})
+    if prev.status != "ok" or prev.finished is None:
+        return JSONResponse(status_code=409, content={"detail": f"el run no está terminado ok ({prev.status})"})
+    if prev.delta is not None:
+        # las salidas -delta y el índice de huellas del cliente quedaron fijados al cerrar el run
+        # (y otro run en delta pudo reemplazar ese índice): agregar filas los dejaría inconsistentes
+        return JSONResponse(status_code=409, content={"detail": "no se pueden agregar archivos a un run en delta: lanzar un run nuevo"})
+    warnings: list[str] = []
+    files = [p for p in _resolve_uploads(req.files, warnings) if p.name not in prev.sources]
+    if len(files) < len(req.files) - len(warnings):
+        warnings.append("Se omitieron archivos que el run ya tenía")
+    if not files:
+        return JSONResponse(status_code=400, content={"detail": "no hay archivos nuevos para agregar", "warnings": warnings})
+    run = RUNS.reopen(run_id)
+    if run is None:
+        return JSONResponse(status_code=409, content={"detail": "el run está en curso"})
+    run.status = "queued"
+    for w in warnings:
+        run.warn(w)
+    cliente, fecha, level = run.params["cliente"], run.params["fecha"], run.params.get("level")
+
+    def log(msg: str):
+        RUNS.log(run_id, json.dumps({"type": "log", "message": msg}))
 
+    def job(cancel: threading.Event):
+        run.status = "running"
+        RUNS_ACTIVE.inc()
+        try:
+            append_job(cancel)
+            log(f"Agregados {len(files)} archivos")
+        except RunCancelled:
+            run.warn("Agregado de archivos cancelado: las salidas quedan como estaban")
+            log("Agregado cancelado")
+        except Exception as e:
+            run.warn(f"Falló el agregado de archivos: {type(e).__name__}: {e}")
+            RUNS.log(run_id, json.dumps({"type": "error", "message": f"{type(e).__name__}: {e}"}))
+            raise
+        finally:
+            run.status = "ok"  # con error o cancelado, las salidas anteriores siguen intactas
+            RUNS_ACTIVE.dec()
+            RUNS.finish(run_id)
+
+    def append_job(cancel: threading.Event):
+        idx_by_file: dict[Path, UploadIndex] = {}
+        union = HeaderUnion([], [], [], [])
         for p in files:
-            log(json.dumps({"type": "log", "message": f"Escaneando headers: {p.name}"}))
-            u = scan_file_headers(p, encoding=enc_by_file[p], progress=progress_evt)
-            t1n = list(dict.fromkeys(t1n + u.t1_normal))
-            t1a = list(dict.fromkeys(t1a + u.t1_ajustada))
-            t2n = list(dict.fromkeys(t2n + u.t2_normal))
-            t2a = list(dict.fromkeys(t2a + u.t2_ajustada))
-
-
-        # 2) Fieldnames finales (incluye columnas extra)
-        fns = {
-            "t1_normal":   _ensure_extra_cols_for_table1(t1n),
-            "t1_ajustada": _ensure_extra_cols_for_table1(t1a),
-            "t2_normal":   _ensure_extra_cols_for_table2(t2n),
-            "t2_ajustada": _ensure_extra_cols_for_table2(t2a),
-        }
-        RUN_FNS[run_id] = fns
-
-        # 3) Abrir writers con fieldnames definitivos
-        writers: dict[str, csv.DictWriter] = {}
-        handles = {}
-        for key, path in outputs.items():
-            path.parent.mkdir(parents=True, exist_ok=True)
-            fh = path.open("w", encoding="utf-8", newline="")
-            handles[key] = fh
-            writers[key] = csv.DictWriter(fh, fieldnames=fns[key], extrasaction="ignore")
-
-        # 4) Procesar archivos
+            idx, cached = ensure_index(p)
+            idx_by_file[p] = idx
+            log(f"{p.name}: encoding detectado = {idx.encoding}{' (índice)' if cached else ''}")
+            for t in idx.tables:
+                add_header_to_union(union, t.mark, t.header)
+        # columnas nuevas al final: las filas existentes solo se rellenan con vacíos
+        added = {key: new_columns(run.fns[key], getattr(union, key)) for key in run.files}
+        fns = {key: run.fns[key] + added[key] for key in run.files}
+        for key, cols in added.items():
+            if cols:
+                log(f"{key}: {len(cols)} columnas nuevas ({', '.join(cols[:5])}{'…' if len(cols) > 5 else ''})")
+
+        tee = es_uploader().pool(queue_chunks=ES_TEE_QUEUE_BATCHES, **es_bulk_options()) if req.push_es else None
+        counts = dict(run.counts)
+        raw_sizes = dict(run.raw_sizes)
+        previews = PreviewSet(PREVIEW_HEAD_ROWS, PREVIEW_SAMPLE_ROWS)
+        # runs de antes de los agregados no tienen base a la que sumar: siguen sin resumen
+        aggregates = AggregateSet() if run.summary is not None else None
+        tables_by_file: dict[Path, list[TableMark]] = {p: [] for p in files}
+        rewrites: dict[Path, Path] = {}          # temporal -> salida que reemplaza
+        appended: dict[Path, int] = {}           # salida abierta al final -> tamaño previo
+        writers: dict[str, TeeWriter] = {}
+        handles = []
+        ok = False
+        t0 = time.monotonic()
+        try:
+            for key, path in run.files.items():
+                extra: list[RowSink] = []
+                pq_path = run.artifacts.get(f"{key}.parquet")
+                if pq_path is not None:
+                    tmp_pq = pq_path.with_name(f".append.{pq_path.name}")
+                    sink = ParquetSink(tmp_pq, fns[key], row_group_rows=PARQUET_ROW_GROUP_ROWS)
+                    extra.append(sink)
+                    rewrites[tmp_pq] = pq_path
+                    sink.copy_from(pq_path)
+                if tee is not None:
+                    # sin checkpoint: push-to-es retoma sobre el archivo completo, no sobre lo agregado
+                    extra.append(tee.stream(path.name, es_index_for(key, run), fns[key]))
+                if counts[key] and not added[key]:
+                    appended[path] = path.stat().st_size
+                    fh = open_output(path, level=level, append=True,
+                                     on_close=lambda n, k=key: raw_sizes.__setitem__(k, raw_sizes.get(k, 0) + n))
+                else:
+                    # sin filas previas (a lo sumo headers) o con columnas nuevas: se reescribe
+                    tmp = path.with_name(f".append.{path.name}")  # mismo sufijo: misma compresión
+                    rewrites[tmp] = path
+                    fh = open_output(tmp, level=level, on_close=lambda n, k=key: raw_sizes.__setitem__(k, n))
+                handles.append(fh)
+                if counts[key] and added[key]:
+                    widen_csv(path, fh, fns[key], len(added[key]))
+                writers[key] = TeeWriter(csv.DictWriter(fh, fieldnames=fns[key], extrasaction="ignore"), extra)
+
+            y, m, d = parse_fecha(fecha)
+            for p in files:
+                log(f"Procesando: {p.name}")
+                process_file(
+                    p,
+                    union=HeaderUnion(fns["t1_normal"], fns["t1_ajustada"], fns["t2_normal"], fns["t2_ajustada"]),
+                    cliente=cliente, y=y, m=m, d=d,
+                    writers=writers, counts=counts,
+                    encoding=idx_by_file[p].encoding,
+                    log=log,
+                    tables=tables_by_file[p],
+                    preview=previews,
+                    aggregates=aggregates,
+                    cancel=cancel,
+                )
+            ok = True
+        finally:
+            for w in writers.values():
+                w.close()
+            for fh in handles:
+                fh.close()
+            if tee is not None:
+                res = es_response(tee.close(), time.monotonic() - t0)
+                run.es = res.model_dump()
+                log(f"Elasticsearch (filas nuevas): {res.total_docs - res.failed} ok, {res.failed} fallidos")
+            if ok:
+                key_of = {path: key for key, path in run.files.items()}
+                for tmp, final in rewrites.items():
+                    key = key_of.get(final)
+                    if key is not None and not counts[key]:
+                        # siguió sin filas: se deja la salida como estaba
+                        tmp.unlink(missing_ok=True)
+                        raw_sizes[key] = run.raw_sizes.get(key, 0)
+                    else:
+                        tmp.replace(final)
+            else:
+                for tmp in rewrites:
+                    tmp.unlink(missing_ok=True)
+                for path, size in appended.items():
+                    with path.open("r+b") as f:
+                        f.truncate(size)
+        stored = PreviewSet.from_json(run.preview or {}, PREVIEW_HEAD_ROWS, PREVIEW_SAMPLE_ROWS)
+        stored.merge(previews)
+        run.preview = stored.to_json(fns)
+        if aggregates is not None:
+            totals = AggregateSet.from_json(run.summary)
+            totals.merge(aggregates)
+            run.summary = totals.to_json(run.files)
+            write_summaries({k: p for k, p in run.artifacts.items() if k.startswith("summary.")}, run.summary)
+        run.raw_sizes = raw_sizes
+        run.counts = counts
+        run.fns = fns
+        run.sources = run.sources + [p.name for p in files]
         for p in files:
-            log(json.dumps({"type": "log", "message": f"Procesando: {p.name}"}))
-            process_file(
-                p,
-                union=HeaderUnion(t1n, t1a, t2n, t2a),
-                cliente=req.cliente, y=y, m=m, d=d,
-                writers=writers, counts=RUN_COUNTS[run_id],
-                encoding=enc_by_file[p],
-                log=lambda m: RUN_LOGS[run_id].append(json.dumps({"type": "log", "message": m})),
-                progress=progress_evt,
-            )
-
-        # 5) Cierre de archivos
-        for fh in handles.values():
-            fh.flush(); fh.close()
-        RUN_HANDLES[run_id] = {}
-
-        log("Proceso finalizado")
-
-    bg.add_task(job)
-    return ProcessResponse(run_id=run_id)
+            record_tables(p, idx_by_file[p], tables_by_file[p], idx_by_file[p].encoding)
+
+    try:
+        position = SCHEDULER.submit(run_id, job, priority=req.priority)
+    except QueueFull as e:
+        run.status = "ok"
+        RUNS.finish(run_id)
+        return JSONResponse(status_code=429, content={"detail": f"cola de runs llena ({e})", "run_id": run_id})
+    return ProcessResponse(run_id=run_id, position=position)
+
+@app.get("/api/runs/{run_id}", response_model=RunStatusResponse)
+async def run_status(run_id: str):
+    """Estado del run y, si espera, su posición en la cola (1 = el próximo)."""
+    run = RUNS.get(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+    pos = SCHEDULER.position(run_id)
+    return RunStatusResponse(
+        run_id=run_id, status=run.status, position=pos or None,
+        created=run.created, finished=run.finished, counts=run.counts,
+    )
+
+@app.delete("/api/runs/{run_id}")
+async def delete_run(run_id: str):
+    """En espera: sale de la cola. En curso: se cancela (202). Terminado: se borran sus salidas y su estado."""
+    run = RUNS.get(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+    if run.finished is None:
+        res = SCHEDULER.cancel(run_id)
+        if res == "cancelling":
+            RUNS.log(run_id, json.dumps({"type": "log", "message": "Cancelación solicitada"}))
+            return JSONResponse(status_code=202, content={"run_id": run_id, "status": "cancelling"})
+        if res is None:
+            return JSONResponse(status_code=409, content={"detail": "el run no corre en este proceso"})
+        run.status = "cancelled"
+        RUNS.log(run_id, json.dumps({"type": "log", "message": "Run cancelado antes de iniciar"}))
+        RUNS.finish(run_id)
+        return {"run_id": run_id, "status": "cancelled"}
+    _evict_run(run_id)
+    RUNS.delete(run_id)
+    return {"run_id": run_id, "status": "deleted"}
 
 @app.get("/api/runs/{run_id}/logs")
-async def stream_logs(run_id: str):
+async def stream_logs(run_id: str, request: Request, last_event_id: int | None = None):
+    """SSE de logs/progreso; cada evento lleva `id` y se retoma con Last-Event-ID.
+
+    El stream despierta cuando el job publica (sin polling) y termina con un evento `end`
+    cuando el run finaliza. El progreso pendiente se resume al último por archivo.
+    """
+    if RUNS.get(run_id) is None:
+        return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+    header = request.headers.get("last-event-id")
+    if last_event_id is None and header and header.isdigit():
+        last_event_id = int(header)
+    # reconexión a un run ya terminado y sin nada nuevo: 204 corta el reintento del EventSource
+    if last_event_id is not None and RUNS.is_finished(run_id) and not RUNS.events_since(run_id, last_event_id):
+        return Response(status_code=204)
+
     async def event_gen():
-        last = 0
         import asyncio
-        while True:
-            logs = RUN_LOGS.get(run_id, [])
-            for i in range(last, len(logs)):
-                yield f"data: {logs[i]}\n\n"
-            last = len(logs)
-            if logs and logs[-1] == "Proceso finalizado":
-                break
-            await asyncio.sleep(0.4)
-    return StreamingResponse(event_gen(), media_type="text/event-stream")
+        last = last_event_id or 0
+        idle = 0.0
+        wake = HUB.subscribe(run_id)
+        try:
+            while True:
+                wake.clear()
+                finished = RUNS.is_finished(run_id)
+                events = RUNS.events_since(run_id, last)
+                for seq, data in coalesce_progress(events):
+                    yield f"id: {seq}\ndata: {data}\n\n"
+                if events:
+                    last = events[-1][0]
+                if finished:
+                    yield f"id: {last}\nevent: end\ndata: {{}}\n\n"
+                    return
+                timeout = SSE_KEEPALIVE_S if RUNS.is_live(run_id) else SSE_REMOTE_POLL_S
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                    idle = 0.0
+                except asyncio.TimeoutError:
+                    idle += timeout
+                    if idle >= SSE_KEEPALIVE_S:
+                        idle = 0.0
+                        yield ": keepalive\n\n"
+        finally:
+            HUB.unsubscribe(run_id, wake)
+    return StreamingResponse(event_gen(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/api/runs/{run_id}/results", response_model=ResultsResponse)
 async def results(run_id: str):
-    outs = RUN_FILES.get(run_id)
-    counts = RUN_COUNTS.get(run_id, {})
-    fns = RUN_FNS.get(run_id, {})
-    if not outs:
+    run = RUNS.get(run_id)
+    if not run or not run.files:
         return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+    outs, counts, fns = run.files, run.counts, run.fns
     files = []
     for k, p in outs.items():
         rows = max(0, counts.get(k, 0))
         cols = len(fns.get(k, []))
         files.append(ResultFile(
             name=p.name, url=f"/api/download/{run_id}/{k}",
-            rows=rows, cols=cols, warnings=RUN_WARN.get(run_id, [])
+            rows=rows, cols=cols, warnings=run.warnings,
+            size=p.stat().st_size if p.exists() else None,
+            uncompressed_size=run.raw_sizes.get(k),
+            compression=compression_of(p),
         ))
-    return ResultsResponse(files=files)
+    for k, p in run.artifacts.items():
+        table, fmt = k.split(".", 1)
+        rows = counts.get(table, 0)
+        if fmt == "delta":  # CSV con las filas nuevas o cambiadas
+            rows = (run.delta or {}).get("rows", {}).get(table, 0)
+        files.append(ResultFile(
+            name=p.name, url=f"/api/download/{run_id}/{k}",
+            rows=max(0, rows), cols=len(fns.get(table, [])),
+            warnings=run.warnings,
+            size=p.stat().st_size if p.exists() else None, format=fmt,
+            compression=compression_of(p) if fmt == "delta" else None,
+        ))
+    return ResultsResponse(files=files, es=PushToESResponse(**run.es) if run.es else None,
+                           delta=DeltaSummary(**run.delta) if run.delta else None)
+
+@app.get("/api/runs/{run_id}/preview", response_model=PreviewResponse)
+async def preview(run_id: str, table: str | None = None):
+    """Primeras filas y muestra uniforme de cada salida (o solo de `table`), sin descargar los CSV."""
+    run = RUNS.get(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+    if run.preview is None:
+        if run.finished is None:
+            return JSONResponse(status_code=409, content={"detail": "el run sigue en curso"})
+        return JSONResponse(status_code=404, content={"detail": "preview no disponible"})
+    tables = {k: PreviewTable(**v) for k, v in run.preview.items() if table is None or k == table}
+    if table is not None and not tables:
+        return JSONResponse(status_code=404, content={"detail": "tabla no encontrada"})
+    return PreviewResponse(tables=tables)
 
-@app.get("/api/download/{run_id}/{key}")
-async def download(run_id: str, key: str):
-    p = RUN_FILES.get(run_id, {}).get(key)
+@app.get("/api/runs/{run_id}/summary", response_model=SummaryResponse)
+async def summary(run_id: str, table: str | None = None, dimension: str | None = None):
+    """Agregados de cumplimiento de cada salida (o solo de `table`); con `dimension` (control,
+    os, host) solo se devuelve esa."""
+    run = RUNS.get(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+    if run.summary is None:
+        if run.finished is None:
+            return JSONResponse(status_code=409, content={"detail": "el run sigue en curso"})
+        return JSONResponse(status_code=404, content={"detail": "resumen no disponible"})
+    tables = {}
+    for k, v in run.summary.items():
+        if table is not None and k != table:
+            continue
+        if dimension is not None:
+            v = {**v, "by": {d: vals for d, vals in v["by"].items() if d == dimension}}
+        tables[k] = SummaryTable(**v)
+    if table is not None and not tables:
+        return JSONResponse(status_code=404, content={"detail": "tabla no encontrada"})
+    return SummaryResponse(tables=tables)
+
+@app.api_route("/api/download/{run_id}/{key}", methods=["GET", "HEAD"])
+async def download(run_id: str, key: str, request: Request, raw: bool = False):
+    run = RUNS.get(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"detail": "archivo no encontrado"})
+    p = run.files.get(key)
+    if p and p.exists():
+        return serve_output(request, p, raw=raw, uncompressed_size=run.raw_sizes.get(key))
+    p = run.artifacts.get(key)
     if not p or not p.exists():
         return JSONResponse(status_code=404, content={"detail": "archivo no encontrado"})
-    return FileResponse(p)
+    return serve_file(request, p, filename=p.name, media_type="application/octet-stream")
 
 @app.post("/api/runs/{run_id}/push-to-es", response_model=PushToESResponse)
-async def push_es(run_id: str):
-    outs = RUN_FILES.get(run_id)
+async def push_es(run_id: str, restart: bool = False, managed: bool | None = None):
+    """Envía las salidas a ES retomando desde el checkpoint de cada una (`restart` lo descarta).
+
+    Con `managed` (None = ES_MANAGED_INDICES) carga todo en índices nuevos y los publica con
+    un swap de alias solo si ES aceptó todos los documentos.
+    """
+    run = RUNS.get(run_id)
+    outs = run.files if run else None
     if not outs:
         return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
-    es = ESUploader(ES.url, ES.username, ES.password)
-    total = 0; failed = 0; details: list[dict] = []
+    if ES_MANAGED_INDICES if managed is None else managed:
+        if not run.params:
+            return JSONResponse(status_code=409, content={"detail": "el run no guarda sus parámetros (es anterior a esta versión)"})
+        return await run_in_threadpool(push_managed, run)
+    jobs: list[PushJob] = []
+    done: list[BulkStats] = []
     for key, path in outs.items():
-        if not path.exists(): continue
-        idx = ES.index_t1 if key.startswith("t1_") else ES.index_t2
-        ok, fail, det = es.bulk_file(path, idx)
-        total += ok + fail; failed += fail
-        details.append({"file": path.name, "ok": ok, "failed": fail})
-    return PushToESResponse(total_docs=total, failed=failed, details=details)
+        if not path.exists():
+            continue
+        index = es_index_for(key, run)
+        if restart:
+            reset_state(run_id, key)
+        cp = load_checkpoint(run_id, key, path.name, index) or Checkpoint(key, path.name, index)
+        if cp.complete:
+            done.append(BulkStats(path.name, index, resumed_from=cp.rows))
+            continue
+        jobs.append(PushJob(path.name, path, index, Checkpointer(run_id, cp)))
+    # las 4 salidas se envían a la vez, con los workers de bulk compartidos
+    t0 = time.monotonic()
+    stats = await run_in_threadpool(es_uploader().bulk_files, jobs, **es_bulk_options()) if jobs else []
+    return es_response(done + stats, time.monotonic() - t0)
+
+def push_managed(run: RunState) -> PushToESResponse:
+    """Carga completa de las salidas del run en índices nuevos (sin checkpoints)."""
+    loads = managed_indices(run.params["cliente"], run.params["fecha"],
+                            datetime.utcnow().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6])
+    t0 = time.monotonic()
+    try:
+        for m in loads.values():
+            m.create()
+        jobs = [PushJob(p.name, p, loads[key[:2]].index) for key, p in run.files.items() if p.exists()]
+        stats = es_uploader().bulk_files(jobs, **es_bulk_options())
+    except BaseException:
+        discard_indices(loads, run.warn)
+        raise
+    res = es_response(stats, time.monotonic() - t0)
+    publish_managed(loads, run, res)
+    RUNS.save(run)
+    return res
+
+@app.post("/api/runs/{run_id}/push-to-es/failed", response_model=PushToESResponse)
+async def push_es_failed(run_id: str):
+    """Reenvía solo los documentos que ES rechazó en pushes anteriores del run."""
+    run = RUNS.get(run_id)
+    outs = run.files if run else None
+    if not outs:
+        return JSONResponse(status_code=404, content={"detail": "run no encontrado"})
+
+    def resend() -> list[BulkStats]:
+        stats = []
+        for key, path in outs.items():
+            index = es_index_for(key, run)
+            cp = load_checkpoint(run_id, key, path.name, index)
+            src = failed_path(run_id, key)
+            if cp is None or not src.exists():
+                continue
+            stats.append(es_uploader().resend_lines(
+                path.name, index, src, Checkpointer(run_id, cp, resend=True), **es_bulk_options(),
+            ))
+        return stats
+
+    t0 = time.monotonic()
+    stats = await run_in_threadpool(resend)
+    return es_response(stats, time.monotonic() - t0)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas en formato de texto de Prometheus (por proceso: con varios workers, scrapear cada uno)."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
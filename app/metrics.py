@@ -0,0 +1,162 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Iterator
+import bisect, threading, time
+
+# Formato de exposición de Prometheus (texto 0.0.4) sin dependencias: los valores viven en
+# memoria de cada proceso. Los workers del pool devuelven sus deltas con `drain()` y el
+# proceso principal los suma con `merge()`, así /metrics incluye el trabajo de los workers.
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LONG_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], object] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1.0, **labels: str) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + n
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, n: float = 1.0, **labels: str) -> None:
+        self.inc(-n, **labels)
+
+    def set(self, v: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = v
+
+class Histogram(_Metric):
+    """Histograma de segundos; guarda conteos por bucket (no acumulados) y la suma."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, v: float, **labels: str) -> None:
+        k = self._key(labels)
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock:
+            st = self._values.get(k)
+            if st is None:
+                st = self._values[k] = [0] * (len(self.buckets) + 1) + [0.0]
+            st[i] += 1
+            st[-1] += v
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(st)) for k, st in self._values.items())
+        out = self._header()
+        for k, st in items:
+            acc = 0
+            for le, n in zip((*map(_fmt, self.buckets), "+Inf"), st[:-1]):
+                acc += n
+                le_label = 'le="%s"' % le
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_fmt(st[-1])}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {acc}")
+        return out
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, m: _Metric) -> None:
+        self._metrics[m.name] = m
+
+    def render(self) -> str:
+        return "\n".join(line for m in self._metrics.values() for line in m.render()) + "\n"
+
+    def drain(self) -> dict[str, dict]:
+        """Devuelve y pone en cero los contadores e histogramas (para enviarlos a otro proceso)."""
+        out = {}
+        for name, m in self._metrics.items():
+            if isinstance(m, Gauge):
+                continue
+            with m._lock:
+                if m._values:
+                    out[name], m._values = m._values, {}
+        return out
+
+    def merge(self, snapshot: dict[str, dict]) -> None:
+        for name, values in snapshot.items():
+            m = self._metrics.get(name)
+            if m is None:
+                continue
+            with m._lock:
+                for k, v in values.items():
+                    cur = m._values.get(k)
+                    if cur is None:
+                        m._values[k] = v
+                    elif isinstance(m, Histogram):
+                        m._values[k] = [a + b for a, b in zip(cur, v)]
+                    else:
+                        m._values[k] = cur + v
+
+REGISTRY = Registry()
+
+# --- métricas del pipeline ---
+ENCODING_SECONDS = Histogram("qualys_encoding_detect_seconds", "Detección de encoding por archivo")
+HEADER_SCAN_SECONDS = Histogram("qualys_header_scan_seconds", "Escaneo de marcadores y headers por archivo")
+PROCESS_SECONDS = Histogram("qualys_process_file_seconds", "Procesamiento de filas por archivo o rango",
+                            buckets=LONG_BUCKETS)
+CSV_WRITE_SECONDS = Histogram("qualys_csv_write_seconds", "Escritura CSV por lote de filas", ("table",))
+FINALIZE_SECONDS = Histogram("qualys_spill_finalize_seconds", "Consolidación de segmentos por salida (una pasada)",
+                             ("table",), buckets=LONG_BUCKETS)
+UPLOAD_HASH_SECONDS = Histogram("qualys_upload_hash_seconds", "sha256 de cada upload (sumado chunk a chunk mientras se recibe)")
+UPLOAD_FINALIZE_SECONDS = Histogram("qualys_upload_finalize_seconds", "Cierre de cada upload (dedup y movimiento)")
+ES_BULK_SECONDS = Histogram("qualys_es_bulk_seconds", "Latencia de cada request _bulk a Elasticsearch")
+RUN_SECONDS = Histogram("qualys_run_seconds", "Duración total de cada run", ("status",), buckets=LONG_BUCKETS)
+
+ROWS = Counter("qualys_rows_total", "Filas escritas por tabla de salida", ("table",))
+BYTES_READ = Counter("qualys_bytes_read_total", "Bytes de reporte leídos al procesar")
+UPLOAD_BYTES = Counter("qualys_upload_bytes_total", "Bytes de uploads nuevos guardados (sin duplicados)")
+ES_DOCS = Counter("qualys_es_docs_total", "Documentos enviados a Elasticsearch por resultado", ("result",))
+ES_RETRIES = Counter("qualys_es_retries_total", "Reintentos de bulk (429 o error de transporte)")
+RUNS_TOTAL = Counter("qualys_runs_total", "Runs terminados por estado", ("status",))
+RUNS_ACTIVE = Gauge("qualys_runs_active", "Runs en curso en este proceso")
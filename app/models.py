@@ -1,18 +1,70 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Literal
 
 class UploadResponse(BaseModel):
     upload_id: str
     filename: str
     size: int
+    deduplicated: bool = False  # el contenido ya estaba guardado (se devuelve ese upload)
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    part_size: int | None = None  # default UPLOAD_PART_BYTES
+    sha256: str | None = None  # si viene, se verifica al completar (y si ya existe no hay que subir nada)
+
+class UploadSessionResponse(BaseModel):
+    session_id: str | None = None
+    part_size: int = 0
+    parts: int = 0
+    missing: list[int] = []  # partes que faltan subir
+    upload: UploadResponse | None = None  # el contenido ya estaba guardado
 
 class ProcessRequest(BaseModel):
     cliente: str = Field(min_length=1)
     fecha: str   # YYYY-MM-DD
     files: List[str]
+    # Una sola lectura por archivo: segmentos temporales + remapeo final de columnas
+    single_pass: bool = False
+    # Procesos del pool (un archivo por tarea); None = PROCESS_WORKERS
+    workers: int | None = Field(default=None, ge=1)
+    # Parte archivos grandes en rangos por tabla (requiere workers > 1)
+    split: bool = False
+    # Además de los CSV, escribe cada tabla en Parquet (requiere pyarrow)
+    parquet: bool = False
+    # CSV comprimidos mientras se escriben; None = OUTPUT_COMPRESSION
+    compression: Literal["none", "gzip", "zstd"] | None = None
+    compression_level: int | None = None
+    # Tee: indexa en ES a la vez que se escriben los CSV
+    push_es: bool = False
+    # Perfil cProfile del run como artefacto (.prof + resumen .txt); None = PROFILE_RUNS
+    profile: bool | None = None
+    # Mayor prioridad sale antes de la cola de runs
+    priority: int = 0
+    # Además escribe salidas -delta con las filas nuevas o cambiadas desde el último run en delta
+    # del cliente; con push_es solo esas se indexan
+    delta: bool = False
+    # Con push_es: carga en un índice propio del run y lo publica con un swap de alias (ver
+    # es_index.py); None = ES_MANAGED_INDICES. No aplica con delta (solo hay filas cambiadas)
+    es_managed: bool | None = None
+
+class AppendRequest(BaseModel):
+    files: List[str]  # upload_id de los reportes nuevos
+    # Tee: indexa en ES solo las filas nuevas
+    push_es: bool = False
+    priority: int = 0
 
 class ProcessResponse(BaseModel):
     run_id: str
+    position: int | None = None  # lugar en la cola al encolarse (1 = el próximo)
+
+class RunStatusResponse(BaseModel):
+    run_id: str
+    status: str  # queued, running, ok, error, cancelled, rejected, interrupted
+    position: int | None = None
+    created: float
+    finished: float | None = None
+    counts: dict[str, int] = {}
 
 class ResultFile(BaseModel):
     name: str
@@ -20,11 +72,43 @@ class ResultFile(BaseModel):
     rows: int
     cols: int
     warnings: list[str] = []
-
-class ResultsResponse(BaseModel):
-    files: list[ResultFile]
+    size: int | None = None  # bytes en disco (comprimido si aplica)
+    uncompressed_size: int | None = None
+    compression: str | None = None
+    format: str = "csv"
 
 class PushToESResponse(BaseModel):
     total_docs: int
     failed: int
-    details: list[dict]
+    details: list[dict]  # por archivo: ok, failed, bytes, retries, seconds, docs_per_sec
+    seconds: float | None = None
+    docs_per_sec: float | None = None
+    published: dict[str, str] | None = None  # índice gestionado: alias -> índice que quedó activo
+
+class PreviewTable(BaseModel):
+    fieldnames: list[str]
+    rows: int                # filas totales de la salida
+    head: list[list[str]]    # primeras filas, en el orden de `fieldnames`
+    sample: list[list[str]]  # muestra uniforme de todo el archivo
+
+class PreviewResponse(BaseModel):
+    tables: dict[str, PreviewTable]
+
+class SummaryTable(BaseModel):
+    rows: int  # filas de la salida
+    status: dict[str, int]  # total por estado (Passed, Failed, Error, ...)
+    by: dict[str, dict[str, dict[str, int]]]  # dimensión (control, os, host) -> valor -> estado -> cantidad
+    controls: dict[str, str] = {}  # Control ID -> título
+
+class SummaryResponse(BaseModel):
+    tables: dict[str, SummaryTable]
+
+class DeltaSummary(BaseModel):
+    rows: dict[str, int]  # filas nuevas o cambiadas por salida
+    disappeared: dict[str, int]  # por tipo (t1/t2): filas del run anterior que ya no están
+    baseline: dict[str, str | None]  # por tipo: run contra el que se comparó (None = primero)
+
+class ResultsResponse(BaseModel):
+    files: list[ResultFile]
+    es: PushToESResponse | None = None  # resultado del modo tee, si se pidió
+    delta: DeltaSummary | None = None
@@ -1,18 +1,31 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Iterable, Iterator, Optional, Callable
-import csv, io, time, os
+from typing import Iterable, Iterator, Optional, Callable, TYPE_CHECKING
+import csv, io, time, os, codecs, re, operator, mmap, sys
 from pathlib import Path
+from .metrics import HEADER_SCAN_SECONDS, PROCESS_SECONDS, CSV_WRITE_SECONDS, ROWS, BYTES_READ
 from .utils import (
     extract_operating_system, has_domain_controller, is_adjusted,
     make_scan_name, make_periodo
 )
 
+if TYPE_CHECKING:
+    import threading
+    from .spill import SpillSet
+    from .preview import PreviewSet
+    from .aggregates import AggregateSet
+
 MARK_T1 = "Control Statistics"
 MARK_T2 = "RESULTS"
 
+# Subir cuando cambie la detección de tablas/headers: invalida los índices de uploads
+PARSER_VERSION = 2
+
 ProgressCb = Callable[[dict], None]
 
+class RunCancelled(Exception):
+    """El run se canceló (ver scheduler); process_file la lanza en su próximo chequeo."""
+
 def _clean_marker_line(s: str) -> str:
     return s.strip().strip('"').strip("'")
 
@@ -60,24 +73,148 @@ def _update_union(cur: list[str], new_cols: list[str]) -> list[str]:
             cur.append(c); seen.add(c)
     return cur
 
-def scan_file_headers(path: Path, encoding: str = "utf-8", progress: ProgressCb | None = None) -> 'HeaderUnion':
-    t1_n: list[str] = []; t1_a: list[str] = []
-    t2_n: list[str] = []; t2_a: list[str] = []
+def add_header_to_union(u: HeaderUnion, mark: str, header: list[str]) -> None:
+    # Los headers T1 alimentan ambas variantes (normal/ajustada); igual los T2
+    if mark == MARK_T1:
+        _update_union(u.t1_normal, header)
+        _update_union(u.t1_ajustada, header)
+    else:
+        _update_union(u.t2_normal, header)
+        _update_union(u.t2_ajustada, header)
 
-    start = time.time()
+@dataclass
+class FileMeta:
+    """Metadata de la primera línea del reporte; se comparte entre los chunks de un archivo."""
+    adjusted: bool
+    os_name: str | None
+    domain_controller: bool
+
+    @classmethod
+    def from_first_line(cls, first_line: str) -> 'FileMeta':
+        return cls(
+            adjusted=is_adjusted(first_line),
+            os_name=extract_operating_system(first_line),
+            domain_controller=has_domain_controller(first_line),
+        )
+
+def read_file_meta(path: Path, encoding: str = "utf-8") -> FileMeta:
     with path.open("rb") as fb:
-        total_bytes = fb.seek(0, os.SEEK_END); fb.seek(0)
         txt = io.TextIOWrapper(fb, encoding=encoding, errors="replace", newline="")
-        push = PushbackIter(txt)
+        return FileMeta.from_first_line(txt.readline())
+
+@dataclass
+class TableMark:
+    """Una tabla del reporte: marcador, offsets (si se conocen) y header; `rows` tras procesar."""
+    mark: str
+    offset: int | None
+    header_offset: int | None
+    header: list[str]
+    rows: int | None = None
+
+@dataclass(frozen=True)
+class _ByteLayout:
+    """Cómo se ven las líneas en bytes: tamaño de unidad y codec sin BOM para decodificar trozos."""
+    unit: int
+    codec: str
+
+def _byte_layout(path: Path, encoding: str) -> _ByteLayout | None:
+    """Layout si los fines de línea y marcadores se pueden buscar en bytes; None si no (utf-32, multibyte)."""
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return None
+    if name in ("utf-8", "utf-8-sig", "ascii"):
+        return _ByteLayout(1, "utf-8" if name == "utf-8-sig" else name)
+    if name in ("utf-16-le", "utf-16-be"):
+        return _ByteLayout(2, name)
+    if name == "utf-16":
+        # mismo criterio que el codec: BOM si lo hay, si no orden nativo
+        with path.open("rb") as fb:
+            bom = fb.read(2)
+        if bom == b"\xff\xfe":
+            return _ByteLayout(2, "utf-16-le")
+        if bom == b"\xfe\xff":
+            return _ByteLayout(2, "utf-16-be")
+        return _ByteLayout(2, "utf-16-le" if sys.byteorder == "little" else "utf-16-be")
+    # codecs de un byte por carácter (latin-1, cp125x...)
+    if len(bytes(range(256)).decode(name, errors="replace")) == 256 and "\n".encode(name) == b"\n":
+        return _ByteLayout(1, name)
+    return None
 
-        # primera línea (metadata)
+def _ci_bytes_pattern(word: str, codec: str) -> bytes:
+    # "results" -> (?:r|R)(?:e|E)... con cada carácter ya codificado
+    parts = []
+    for ch in word:
+        lo, up = re.escape(ch.lower().encode(codec)), re.escape(ch.upper().encode(codec))
+        parts.append(lo if lo == up else b"(?:" + lo + b"|" + up + b")")
+    return b"".join(parts)
+
+def _scan_table_marks_mmap(path: Path, encoding: str) -> list[TableMark] | None:
+    """Busca los marcadores sobre el archivo mapeado en memoria, sin decodificar el cuerpo.
+
+    Solo se decodifican las líneas candidatas (confirmadas con is_marker) y los headers.
+    Sigue la máquina de estados de `process_file`: la primera línea es metadata y la línea
+    tras un marcador es header, nunca marcador. Devuelve None si el encoding no permite
+    buscar en bytes o si hay CR sueltos (ahí las líneas de texto y de bytes no coinciden).
+    """
+    layout = _byte_layout(path, encoding)
+    if layout is None:
+        return None
+    size = path.stat().st_size
+    if size == 0:
+        return []
+    u, codec = layout.unit, layout.codec
+    nl, cr = "\n".encode(codec), "\r".encode(codec)
+    lone_cr = re.compile(re.escape(cr) + b"(?!" + re.escape(nl) + b")")
+    candidate = re.compile(
+        _ci_bytes_pattern(MARK_T1, codec) + b"|" + _ci_bytes_pattern(MARK_T2, codec)
+    )
+    marks: list[TableMark] = []
+    with path.open("rb") as fb, mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if any(mo.start() % u == 0 for mo in lone_cr.finditer(mm)):
+            return None
+
+        def line_end(pos: int) -> int:
+            i = mm.find(nl, pos)
+            while i != -1 and i % u:
+                i = mm.find(nl, i + 1)
+            return size if i == -1 else i + u
+
+        def line_start(pos: int) -> int:
+            i = mm.rfind(nl, 0, pos)
+            while i != -1 and i % u:
+                i = mm.rfind(nl, 0, i)
+            return 0 if i == -1 else i + u
+
+        pos = line_end(0)  # primera línea (metadata)
+        while pos < size:
+            mo = candidate.search(mm, pos)
+            if mo is None:
+                break
+            if mo.start() % u:
+                pos = mo.start() + 1
+                continue
+            ls, le = line_start(mo.start()), line_end(mo.start())
+            mark = is_marker(mm[ls:le].decode(codec, errors="replace"))
+            if not mark:
+                pos = le
+                continue
+            if le >= size:
+                break  # marcador sin header
+            he = line_end(le)
+            header = next(csv.reader([mm[le:he].decode(codec, errors="replace")]))
+            marks.append(TableMark(mark, ls, le, header))
+            pos = he
+    return marks
+
+def _scan_table_marks_text(path: Path, encoding: str) -> list[TableMark]:
+    marks: list[TableMark] = []
+    with path.open("rb") as fb:
+        txt = io.TextIOWrapper(fb, encoding=encoding, errors="replace", newline="")
+        push = PushbackIter(txt)
         try: next(push)
         except StopIteration:
-            if progress:
-                progress({"file": path.name, "phase": "headers", "rows": 0, "bytes": fb.tell(),
-                          "total_bytes": total_bytes, "elapsed_s": time.time()-start})
-            return HeaderUnion(t1_n, t1_a, t2_n, t2_a)
-
+            return marks
         for line in push:
             mark = is_marker(line)
             if not mark:
@@ -86,24 +223,62 @@ def scan_file_headers(path: Path, encoding: str = "utf-8", progress: ProgressCb
                 header_line = next(push)
             except StopIteration:
                 break
-            header = next(csv.reader([header_line]))
-            if mark == MARK_T1:
-                t1_n = _update_union(t1_n, header)
-                t1_a = _update_union(t1_a, header)
-            else:
-                t2_n = _update_union(t2_n, header)
-                t2_a = _update_union(t2_a, header)
+            marks.append(TableMark(mark, None, None, next(csv.reader([header_line]))))
             for _ in table_line_generator(push):
                 pass
-            # progreso ocasional
-            if progress and (fb.tell() % (16 * 1024 * 1024) < 4096):  # aprox cada ~16MB
-                progress({"file": path.name, "phase": "headers", "rows": 0, "bytes": fb.tell(),
-                          "total_bytes": total_bytes, "elapsed_s": time.time()-start})
+    return marks
+
+def scan_table_marks(path: Path, encoding: str = "utf-8") -> list[TableMark]:
+    """Tablas del archivo en orden; con offsets cuando el encoding permite escanear bytes."""
+    with HEADER_SCAN_SECONDS.time():
+        marks = _scan_table_marks_mmap(path, encoding)
+        return marks if marks is not None else _scan_table_marks_text(path, encoding)
+
+def find_marker_offsets(path: Path, encoding: str = "utf-8") -> list[int]:
+    """Offsets (bytes) de las líneas marcador; [] si no se pueden obtener sin decodificar."""
+    marks = _scan_table_marks_mmap(path, encoding)
+    return [m.offset for m in marks] if marks else []
 
+def plan_byte_ranges(
+    path: Path, encoding: str, chunk_bytes: int, offsets: list[int] | None = None,
+) -> list[tuple[int, int]]:
+    """Divide el archivo en rangos de ~chunk_bytes cortando solo en marcadores de tabla."""
+    total = path.stat().st_size
+    if total <= chunk_bytes:
+        return [(0, total)]
+    cuts = [0]
+    for off in (find_marker_offsets(path, encoding) if offsets is None else offsets):
+        if off - cuts[-1] >= chunk_bytes:
+            cuts.append(off)
+    return list(zip(cuts, cuts[1:] + [total]))
+
+class _ByteRange(io.RawIOBase):
+    """Vista de solo lectura de [start, end) sobre un archivo binario abierto."""
+    def __init__(self, fb, start: int, end: int):
+        fb.seek(start)
+        self._fb = fb
+        self._left = end - start
+    def readable(self) -> bool:
+        return True
+    def readinto(self, b) -> int:
+        n = min(len(b), self._left)
+        if n <= 0:
+            return 0
+        got = self._fb.readinto(memoryview(b)[:n]) or 0
+        self._left -= got
+        return got
+
+def scan_file_headers(path: Path, encoding: str = "utf-8", progress: ProgressCb | None = None) -> 'HeaderUnion':
+    """Unión de headers del archivo; con mmap solo decodifica marcadores y headers."""
+    start = time.time()
+    total_bytes = path.stat().st_size
+    u = HeaderUnion([], [], [], [])
+    for t in scan_table_marks(path, encoding):
+        add_header_to_union(u, t.mark, t.header)
     if progress:
         progress({"file": path.name, "phase": "headers", "rows": 0, "bytes": total_bytes,
                   "total_bytes": total_bytes, "elapsed_s": time.time()-start})
-    return HeaderUnion(t1_n, t1_a, t2_n, t2_a)
+    return u
 
 def _ensure_extra_cols_for_table1(base: list[str]) -> list[str]:
     cols = list(base)
@@ -117,42 +292,115 @@ def _ensure_extra_cols_for_table2(base: list[str]) -> list[str]:
         if c not in cols: cols.append(c)
     return cols
 
+_BATCH_ROWS = 2000
+
+def _row_projector(
+    hdr: list[str], fieldnames: list[str], consts: dict[str, str], dc_col: str | None,
+) -> Callable[[list[str]], tuple]:
+    """Proyecta una fila cruda (orden `hdr`) al orden `fieldnames` con un itemgetter precalculado.
+
+    Equivale a armar el dict {fieldname: ""} + zip(hdr, row) + columnas constantes, sin
+    crear el dict por fila: la fila se copia a un buffer reutilizado de largo fijo
+    (relleno con "" o truncado como hace zip) seguido de las constantes.
+    `dc_col` aplica la reescritura "... Domain Controller" de la tabla RESULTS.
+    """
+    n = len(hdr)
+    src = {c: i for i, c in enumerate(hdr)}  # si hay duplicados gana el último, como en el dict
+    consts = dict(consts)
+    dc_i = None
+    if dc_col is not None:
+        if dc_col in src:
+            dc_i = src[dc_col]
+        else:
+            consts[dc_col] = "Domain Controller"
+    tail = [""] + list(consts.values())
+    slot = {c: n + 1 + i for i, c in enumerate(consts)}
+    get = operator.itemgetter(*[slot[c] if c in slot else src.get(c, n) for c in fieldnames])
+    buf = [""] * n + tail
+    pad = [""] * n
+
+    def project(row: list[str]) -> tuple:
+        k = len(row)
+        if k == n:
+            buf[:n] = row
+        elif k > n:
+            buf[:n] = row[:n]
+        else:
+            buf[:k] = row
+            buf[k:n] = pad[k:]
+        if dc_i is not None:
+            v = buf[dc_i].rstrip()
+            buf[dc_i] = f"{v} Domain Controller" if v else "Domain Controller"
+        return get(buf)
+
+    return project
+
 def process_file(
     path: Path,
     *,
-    union: 'HeaderUnion',
+    union: 'HeaderUnion | None' = None,
     cliente: str,
     y: int, m: int, d: int,
-    writers: dict[str, csv.DictWriter],
+    writers: dict[str, csv.DictWriter] | None = None,
     counts: dict[str, int],
     encoding: str = "utf-8",
     log: Callable[[str], None] | None = None,
     progress: ProgressCb | None = None,
+    spill: 'SpillSet | None' = None,
+    byte_range: tuple[int, int] | None = None,
+    meta: FileMeta | None = None,
+    tables: list[TableMark] | None = None,
+    preview: 'PreviewSet | None' = None,
+    aggregates: 'AggregateSet | None' = None,
+    cancel: 'threading.Event | None' = None,
 ) -> None:
+    """Transforma las tablas del archivo y las escribe en `writers`.
+
+    Con `spill` (modo una pasada) no hace falta la unión previa: cada tabla se escribe
+    en un segmento con sus propias columnas y la unión se acumula en `spill.union`.
+    Con `byte_range` (modo split) solo se procesa ese rango, que debe empezar en 0 o en
+    un offset de `plan_byte_ranges`; los chunks que no empiezan en 0 requieren `meta`.
+    Si se pasa `tables`, se agrega un TableMark (header + filas) por cada tabla leída.
+    Con `preview`, cada lote escrito alimenta la vista previa de su salida, y con
+    `aggregates`, los contadores de cumplimiento (estado por control, SO y host).
+    `cancel` (Event o proxy de Manager) se revisa por tabla y por lote: si está activo,
+    lanza RunCancelled.
+    """
     start = time.time()
     rows_total = 0
     with path.open("rb") as fb:
         total_bytes = fb.seek(0, os.SEEK_END); fb.seek(0)
-        txt = io.TextIOWrapper(fb, encoding=encoding, errors="replace", newline="")
+        lo, hi = byte_range or (0, total_bytes)
+        total_bytes = hi - lo
+        src = fb if byte_range is None else io.BufferedReader(_ByteRange(fb, lo, hi))
+        if lo > 0:
+            # a mitad de archivo no hay BOM: codec con orden de bytes explícito (utf-16)
+            layout = _byte_layout(path, encoding)
+            encoding = layout.codec if layout else encoding
+        txt = io.TextIOWrapper(src, encoding=encoding, errors="replace", newline="")
         push = PushbackIter(txt)
 
         def emit_prog(phase: str):
             if progress:
                 progress({
                     "file": path.name, "phase": phase,
-                    "rows": rows_total, "bytes": fb.tell(),
+                    "rows": rows_total, "bytes": fb.tell() - lo,
                     "total_bytes": total_bytes,
                     "elapsed_s": time.time() - start
                 })
 
-        try:
-            first_line = next(push)
-        except StopIteration:
-            emit_prog("data")
-            return
-        adjusted = is_adjusted(first_line)
-        os_name = extract_operating_system(first_line)
-        domain_flag = has_domain_controller(first_line)
+        if lo == 0:
+            try:
+                first_line = next(push)
+            except StopIteration:
+                emit_prog("data")
+                return
+            meta = meta or FileMeta.from_first_line(first_line)
+        elif meta is None:
+            raise ValueError("meta es obligatorio para chunks que no empiezan en 0")
+        adjusted = meta.adjusted
+        os_name = meta.os_name
+        domain_flag = meta.domain_controller
         if os_name and domain_flag:
             os_name = f"{os_name} Domain Controller"
 
@@ -160,61 +408,83 @@ def process_file(
             mark = is_marker(line)
             if not mark:
                 continue
+            if cancel is not None and cancel.is_set():
+                raise RunCancelled(path.name)
             try:
                 header_line = next(push)
             except StopIteration:
                 break
             hdr = next(csv.reader([header_line]))
             reader = csv.reader(table_line_generator(push))
+            seg_fh = None
+            rows_before = rows_total
 
             if mark == MARK_T1:
                 target = "t1_ajustada" if adjusted else "t1_normal"
-                fieldnames = _ensure_extra_cols_for_table1(
-                    union.t1_ajustada if adjusted else union.t1_normal
-                )
-                dw = writers[target]
+                ensure_cols = _ensure_extra_cols_for_table1
+                base = (union.t1_ajustada if adjusted else union.t1_normal) if spill is None else None
                 scan_name = make_scan_name(cliente, y, m, d, es_control_static=True, es_ajustada=adjusted)
-                periodo = make_periodo(y, m, d)
-                if counts[target] == 0:
-                    dw.writeheader()
-                for row in reader:
-                    record = {k: "" for k in fieldnames}
-                    for k, v in zip(hdr, row):
-                        record[k] = v
-                    record["operating system"] = os_name or ""
-                    record["scan_name"] = scan_name
-                    record["periodo"] = periodo
-                    dw.writerow(record)
-                    counts[target] += 1
-                    rows_total += 1
-                    if rows_total % 2000 == 0:
-                        emit_prog("data")
-
+                consts = {"operating system": os_name or ""}
+                dc_col = None
             else:
                 target = "t2_ajustada" if adjusted else "t2_normal"
-                fieldnames = _ensure_extra_cols_for_table2(
-                    union.t2_ajustada if adjusted else union.t2_normal
-                )
-                dw = writers[target]
+                ensure_cols = _ensure_extra_cols_for_table2
+                base = (union.t2_ajustada if adjusted else union.t2_normal) if spill is None else None
                 scan_name = make_scan_name(cliente, y, m, d, es_control_static=False, es_ajustada=adjusted)
-                periodo = make_periodo(y, m, d)
+                consts = {}
+                dc_col = "Operating System" if domain_flag else None
+            consts["scan_name"] = scan_name
+            consts["periodo"] = make_periodo(y, m, d)
+
+            if spill is not None:
+                spill.add_header(mark, hdr)
+                fieldnames = ensure_cols(_update_union([], hdr))
+                seg_fh, dw = spill.open_segment(target, fieldnames)
+            else:
+                fieldnames = ensure_cols(base)
+                dw = writers[target]
                 if counts[target] == 0:
                     dw.writeheader()
-                for row in reader:
-                    record = {k: "" for k in fieldnames}
-                    for k, v in zip(hdr, row):
-                        record[k] = v
-                    if domain_flag:
-                        record["Operating System"] = (record.get("Operating System") or "").rstrip()
-                        if record["Operating System"]:
-                            record["Operating System"] += " Domain Controller"
-                        else:
-                            record["Operating System"] = "Domain Controller"
-                    record["scan_name"] = scan_name
-                    record["periodo"] = periodo
-                    dw.writerow(record)
-                    counts[target] += 1
-                    rows_total += 1
-                    if rows_total % 2000 == 0:
-                        emit_prog("data")
+
+            project = _row_projector(hdr, fieldnames, consts, dc_col)
+            out = dw.writer
+            pv = preview.table(target) if preview is not None else None
+            ag = aggregates.table(target) if aggregates is not None else None
+            # los agregados miran las columnas de esta tabla, no las que agrega la unión
+            present = {*hdr, *consts, *([dc_col] if dc_col else [])} if ag is not None else None
+            batch: list[tuple] = []
+            for row in reader:
+                batch.append(project(row))
+                if len(batch) >= _BATCH_ROWS:
+                    t = time.perf_counter()
+                    out.writerows(batch)
+                    CSV_WRITE_SECONDS.observe(time.perf_counter() - t, table=target)
+                    if pv is not None:
+                        pv.offer(fieldnames, batch)
+                    if ag is not None:
+                        ag.offer(fieldnames, batch, present)
+                    counts[target] += len(batch)
+                    rows_total += len(batch)
+                    batch.clear()
+                    emit_prog("data")
+                    if cancel is not None and cancel.is_set():
+                        raise RunCancelled(path.name)
+            if batch:
+                t = time.perf_counter()
+                out.writerows(batch)
+                CSV_WRITE_SECONDS.observe(time.perf_counter() - t, table=target)
+                if pv is not None:
+                    pv.offer(fieldnames, batch)
+                if ag is not None:
+                    ag.offer(fieldnames, batch, present)
+                counts[target] += len(batch)
+                rows_total += len(batch)
+            ROWS.inc(rows_total - rows_before, table=target)
+
+            if seg_fh is not None:
+                seg_fh.close()
+            if tables is not None:
+                tables.append(TableMark(mark, None, None, hdr, rows_total - rows_before))
         emit_prog("data")
+        BYTES_READ.inc(fb.tell() - lo)
+    PROCESS_SECONDS.observe(time.time() - start)
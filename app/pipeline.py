@@ -0,0 +1,279 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Callable, TextIO
+import multiprocessing as mp
+import csv, queue, threading
+
+from .parser import (
+    process_file, plan_byte_ranges, read_file_meta, scan_table_marks, add_header_to_union,
+    _ensure_extra_cols_for_table1, _ensure_extra_cols_for_table2,
+    FileMeta, HeaderUnion, TableMark, ProgressCb, RunCancelled,
+)
+from .sinks import SinkFactory, TeeWriter
+from .spill import SpillSet, OUTPUT_KEYS
+from .metrics import REGISTRY
+from .profiling import RunProfiler
+from .preview import PreviewSet
+from .aggregates import AggregateSet
+
+def _process_shard(
+    path: Path, encoding: str, shard_parent: Path,
+    cliente: str, y: int, m: int, d: int, events,
+    byte_range: tuple[int, int] | None = None, meta: FileMeta | None = None, profile: bool = False,
+    preview: tuple[int, int] | None = None, aggregates: bool = False, cancel=None,
+) -> tuple[SpillSet, dict[str, int], list[TableMark], dict, list[dict], PreviewSet | None, AggregateSet | None]:
+    """Worker del pool: procesa un archivo (o un rango de él) en modo una pasada sobre su propio shard.
+
+    Devuelve además las métricas acumuladas por la tarea, con `profile` su perfil y con
+    `preview` (filas iniciales, tamaño de la muestra) la vista previa de lo que procesó y con
+    `aggregates` sus contadores de cumplimiento.
+    """
+    if byte_range is None:
+        events.put(("log", f"Procesando: {path.name}"))
+    else:
+        events.put(("log", f"Procesando: {path.name} [bytes {byte_range[0]}-{byte_range[1]}]"))
+    shard = SpillSet.create(shard_parent)
+    counts = {k: 0 for k in OUTPUT_KEYS}
+    tables: list[TableMark] = []
+    prof = RunProfiler(enabled=profile)
+    pv = PreviewSet(*preview) if preview else None
+    ag = AggregateSet() if aggregates else None
+    prof.call(
+        process_file,
+        path,
+        spill=shard,
+        cliente=cliente, y=y, m=m, d=d,
+        counts=counts,
+        encoding=encoding,
+        log=lambda msg: events.put(("log", msg)),
+        progress=lambda evt: events.put(("progress", evt)),
+        byte_range=byte_range, meta=meta, tables=tables, preview=pv, aggregates=ag, cancel=cancel,
+    )
+    return shard, counts, tables, REGISTRY.drain(), prof.parts, pv, ag
+
+def plan_tasks(
+    files: list[Path], enc_by_file: dict[Path, str], split_bytes: int | None,
+    offsets_by_file: dict[Path, list[int] | None] | None = None,
+) -> list[tuple[Path, tuple[int, int] | None, FileMeta | None]]:
+    """Una tarea por archivo; con `split_bytes`, los archivos grandes se parten en rangos por tabla."""
+    tasks: list[tuple[Path, tuple[int, int] | None, FileMeta | None]] = []
+    offsets_by_file = offsets_by_file or {}
+    for p in files:
+        ranges = plan_byte_ranges(p, enc_by_file[p], split_bytes, offsets_by_file.get(p)) if split_bytes else []
+        if len(ranges) <= 1:
+            tasks.append((p, None, None))
+            continue
+        meta = read_file_meta(p, enc_by_file[p])
+        tasks.extend((p, r, meta) for r in ranges)
+    return tasks
+
+def process_files_parallel(
+    files: list[Path],
+    enc_by_file: dict[Path, str],
+    *,
+    spill: SpillSet,
+    cliente: str,
+    y: int, m: int, d: int,
+    counts: dict[str, int],
+    workers: int,
+    log: Callable[[str], None],
+    progress: ProgressCb,
+    split_bytes: int | None = None,
+    offsets_by_file: dict[Path, list[int] | None] | None = None,
+    tables_by_file: dict[Path, list[TableMark]] | None = None,
+    profiler: RunProfiler | None = None,
+    preview: PreviewSet | None = None,
+    aggregates: AggregateSet | None = None,
+    cancel: threading.Event | None = None,
+) -> None:
+    """Reparte los archivos en un pool de procesos y une los shards en `spill`, en el orden de `files`.
+
+    Con `split_bytes` cada archivo mayor a ese tamaño se divide en rangos que empiezan
+    en un marcador de tabla; los rangos se procesan en paralelo y se unen en orden.
+    `offsets_by_file` (del índice del upload) evita reescanear los marcadores y
+    `tables_by_file` recibe los TableMark vistos por archivo.
+    Los eventos de log/progreso de los workers llegan por una cola del Manager y se
+    re-emiten desde este hilo, así el stream de logs del run no cambia.
+    Las métricas de cada tarea se suman a las de este proceso; con `profiler`, cada
+    tarea se perfila y su perfil se agrega ahí. Las vistas previas de las tareas se unen
+    en `preview` en el orden de los archivos y sus agregados en `aggregates`.
+    Si `cancel` se activa, las tareas en espera se descartan, las que corren cortan en su
+    próximo lote (vía un Event del Manager) y se lanza RunCancelled.
+    """
+    tasks = plan_tasks(files, enc_by_file, split_bytes, offsets_by_file)
+    if len(tasks) > len(files):
+        log(f"Modo split: {len(files)} archivos divididos en {len(tasks)} rangos")
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager, ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=ctx) as pool:
+        events = manager.Queue()
+        stop = manager.Event() if cancel is not None else None
+        futures: dict[Future, int] = {
+            pool.submit(_process_shard, p, enc_by_file[p], spill.root, cliente, y, m, d, events, rng, meta,
+                        profiler is not None,
+                        (preview.head_size, preview.sample_size) if preview is not None else None,
+                        aggregates is not None, stop): i
+            for i, (p, rng, meta) in enumerate(tasks)
+        }
+        shards: list[SpillSet | None] = [None] * len(tasks)
+        task_tables: list[list[TableMark]] = [[] for _ in tasks]
+        task_previews: list[PreviewSet | None] = [None] * len(tasks)
+        task_aggregates: list[AggregateSet | None] = [None] * len(tasks)
+        pending = set(futures)
+
+        def drain(timeout: float) -> None:
+            try:
+                kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                return
+            while True:
+                if kind == "progress":
+                    progress(payload)
+                else:
+                    log(payload)
+                try:
+                    kind, payload = events.get_nowait()
+                except queue.Empty:
+                    return
+
+        while pending:
+            if cancel is not None and cancel.is_set():
+                stop.set()
+                for fut in pending:
+                    fut.cancel()
+                raise RunCancelled("pool")
+            done, pending = wait(pending, timeout=0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                shard, shard_counts, tables, metrics, profiles, pv, ag = fut.result()
+                task_previews[futures[fut]] = pv
+                task_aggregates[futures[fut]] = ag
+                REGISTRY.merge(metrics)
+                if profiler is not None:
+                    profiler.parts.extend(profiles)
+                shards[futures[fut]] = shard
+                task_tables[futures[fut]] = tables
+                for k, v in shard_counts.items():
+                    counts[k] += v
+            if pending:
+                drain(0.2)
+        drain(0)
+
+    # Orden determinista: el de los archivos/rangos, no el de finalización
+    for shard in shards:
+        spill.absorb(shard)
+    if preview is not None:
+        for pv in task_previews:
+            if pv is not None:
+                preview.merge(pv)
+    if aggregates is not None:
+        for ag in task_aggregates:
+            if ag is not None:
+                aggregates.merge(ag)
+    if tables_by_file is not None:
+        for (p, _, _), tables in zip(tasks, task_tables):
+            tables_by_file.setdefault(p, []).extend(tables)
+
+def choose_mode(n_files: int, workers: int, split_bytes: int | None, single_pass: bool) -> tuple[bool, bool]:
+    """(pool, una pasada): el pool si hay más de un archivo o uno para partir; con pool, siempre una pasada."""
+    parallel = workers > 1 and (n_files > 1 or (split_bytes is not None and n_files > 0))
+    return parallel, single_pass or parallel
+
+def process_files(
+    files: list[Path],
+    enc_by_file: dict[Path, str],
+    outputs: dict[str, Path],
+    *,
+    cliente: str,
+    y: int, m: int, d: int,
+    counts: dict[str, int],
+    open_out: Callable[[str, Path], TextIO],
+    spill_dir: Path,
+    log: Callable[[str], None],
+    progress: ProgressCb,
+    sinks: SinkFactory | None = None,
+    workers: int = 1,
+    split_bytes: int | None = None,
+    single_pass: bool = False,
+    tables_of: Callable[[Path], list[TableMark]] | None = None,
+    offsets_by_file: dict[Path, list[int] | None] | None = None,
+    tables_by_file: dict[Path, list[TableMark]] | None = None,
+    profiler: RunProfiler | None = None,
+    preview: PreviewSet | None = None,
+    aggregates: AggregateSet | None = None,
+    cancel: threading.Event | None = None,
+) -> dict[str, list[str]]:
+    """Escribe las cuatro salidas de `files` y devuelve sus fieldnames (runs de la API y python -m app).
+
+    El modo sale de `choose_mode`: dos pasadas (unión de headers y después filas), una
+    pasada con segmentos en `spill_dir`, o el pool. `open_out(key, path)` abre cada salida
+    (compresión) y `sinks(key, fieldnames)` da los destinos extra de cada tabla (Parquet,
+    tee a ES, delta). En dos pasadas, `tables_of(path)` da las tablas del archivo (por
+    defecto se escanean). El resto se pasa tal cual a process_file/process_files_parallel.
+    """
+    parallel, one_pass = choose_mode(len(files), workers, split_bytes, single_pass)
+    tables_by_file = tables_by_file if tables_by_file is not None else {}
+    if one_pass:
+        spill = SpillSet.create(spill_dir)
+        try:
+            if parallel:
+                log(f"Procesando {len(files)} archivos con {workers} workers")
+                process_files_parallel(
+                    files, enc_by_file, spill=spill, cliente=cliente, y=y, m=m, d=d, counts=counts,
+                    workers=workers, log=log, progress=progress, split_bytes=split_bytes,
+                    offsets_by_file=offsets_by_file, tables_by_file=tables_by_file, profiler=profiler,
+                    preview=preview, aggregates=aggregates, cancel=cancel,
+                )
+            else:
+                for p in files:
+                    log(f"Procesando: {p.name}")
+                    process_file(
+                        p, spill=spill, cliente=cliente, y=y, m=m, d=d, counts=counts,
+                        encoding=enc_by_file[p], log=log, progress=progress, tables=tables_by_file.get(p),
+                        preview=preview, aggregates=aggregates, cancel=cancel,
+                    )
+            log("Consolidando columnas de salida")
+            return spill.finalize(outputs, sinks, open_out)
+        finally:
+            spill.cleanup()
+
+    # 1) Unión de headers por tipo
+    tables_of = tables_of or (lambda p: scan_table_marks(p, enc_by_file[p]))
+    u = HeaderUnion([], [], [], [])
+    for p in files:
+        tables = tables_of(p)
+        log(f"Headers: {p.name} ({len(tables)} tablas)")
+        for t in tables:
+            add_header_to_union(u, t.mark, t.header)
+
+    # 2) Fieldnames finales (incluye columnas extra)
+    fns = {
+        "t1_normal":   _ensure_extra_cols_for_table1(u.t1_normal),
+        "t1_ajustada": _ensure_extra_cols_for_table1(u.t1_ajustada),
+        "t2_normal":   _ensure_extra_cols_for_table2(u.t2_normal),
+        "t2_ajustada": _ensure_extra_cols_for_table2(u.t2_ajustada),
+    }
+
+    # 3) Writers con fieldnames definitivos y 4) filas
+    writers: dict[str, TeeWriter] = {}
+    handles = []
+    try:
+        for key, path in outputs.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fh = open_out(key, path)
+            handles.append(fh)
+            dw = csv.DictWriter(fh, fieldnames=fns[key], extrasaction="ignore")
+            writers[key] = TeeWriter(dw, sinks(key, fns[key]) if sinks else [])
+        for p in files:
+            log(f"Procesando: {p.name}")
+            process_file(
+                p, union=u, cliente=cliente, y=y, m=m, d=d, writers=writers, counts=counts,
+                encoding=enc_by_file[p], log=log, progress=progress, tables=tables_by_file.get(p),
+                preview=preview, aggregates=aggregates, cancel=cancel,
+            )
+    finally:
+        # 5) Cierre (también si se canceló: quien llama descarta las salidas)
+        for w in writers.values():
+            w.close()
+        for fh in handles:
+            fh.flush(); fh.close()
+    return fns
@@ -0,0 +1,114 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+import math, random
+
+# Vista previa de cada salida: las primeras filas y una muestra uniforme (reservoir) de todo el
+# archivo. Se alimenta con los mismos lotes que se escriben, así el costo por fila es una
+# comparación; solo las filas elegidas se copian (como dict, porque en modo una pasada cada
+# segmento tiene sus propias columnas) y se reordenan con los fieldnames finales al terminar.
+
+MAX_CELL_CHARS = 300  # celdas largas (Evidence, Remediation) se recortan en la preview
+
+def _as_dict(fieldnames: list[str], row: tuple) -> dict[str, str]:
+    return {c: v if len(v) <= MAX_CELL_CHARS else v[:MAX_CELL_CHARS] + "…" for c, v in zip(fieldnames, row) if v}
+
+@dataclass
+class TablePreview:
+    head_size: int
+    sample_size: int
+    seen: int = 0
+    head: list[dict] = field(default_factory=list)
+    sample: list[dict] = field(default_factory=list)
+    _w: float = 0.0     # Algoritmo L (Li, 1994): saltos geométricos entre reemplazos
+    _next: int = 0      # índice global de la próxima fila que entra al reservoir
+
+    def offer(self, fieldnames: list[str], rows: list[tuple]) -> None:
+        start, end = self.seen, self.seen + len(rows)
+        self.seen = end
+        if len(self.head) < self.head_size:
+            self.head.extend(_as_dict(fieldnames, r) for r in rows[:self.head_size - len(self.head)])
+        k = self.sample_size
+        if k <= 0:
+            return
+        i = start
+        while len(self.sample) < k and i < end:
+            self.sample.append(_as_dict(fieldnames, rows[i - start]))
+            i += 1
+            if len(self.sample) == k:
+                self._w = math.exp(math.log(random.random()) / k)
+                self._next = i - 1 + self._skip()
+        if len(self.sample) < k:
+            return
+        while self._next < end:
+            self.sample[random.randrange(k)] = _as_dict(fieldnames, rows[self._next - start])
+            self._w *= math.exp(math.log(random.random()) / k)
+            self._next += self._skip()
+
+    def _skip(self) -> int:
+        return int(math.log(random.random()) / math.log1p(-self._w)) + 1
+
+    def merge(self, other: 'TablePreview') -> None:
+        """Agrega lo visto por `other` (filas posteriores, p. ej. el siguiente shard del pool).
+
+        Cuántos lugares de la muestra vienen de cada reservoir se sortea como si se sacaran
+        `sample_size` filas sin reposición de la unión (hipergeométrica): la muestra sigue uniforme.
+        """
+        if len(self.head) < self.head_size:
+            self.head.extend(other.head[:self.head_size - len(self.head)])
+        ra, rb = self.seen, other.seen
+        take_a = 0
+        for _ in range(min(self.sample_size, ra + rb)):
+            if random.random() * (ra + rb) < ra:
+                take_a += 1; ra -= 1
+            else:
+                rb -= 1
+        n = min(self.sample_size, self.seen + other.seen)
+        self.sample = random.sample(self.sample, take_a) + random.sample(other.sample, n - take_a)
+        self.seen += other.seen
+        if self.sample_size and len(self.sample) == self.sample_size:
+            # sigue como reservoir lleno: el umbral de L tras `seen` filas es Beta(k, seen - k + 1)
+            self._w = random.betavariate(self.sample_size, self.seen - self.sample_size + 1)
+            self._next = self.seen - 1 + self._skip()
+
+    @classmethod
+    def from_json(cls, d: dict, head_size: int, sample_size: int) -> 'TablePreview':
+        """Preview guardada de un run terminado; sirve como lado izquierdo de `merge`."""
+        fns = d["fieldnames"]
+        t = cls(head_size, sample_size, seen=d["rows"])
+        t.head = [dict(zip(fns, r)) for r in d["head"]]
+        t.sample = [dict(zip(fns, r)) for r in d["sample"]]
+        return t
+
+    def to_json(self, fieldnames: list[str]) -> dict:
+        return {
+            "fieldnames": fieldnames,
+            "rows": self.seen,
+            "head": [[r.get(c, "") for c in fieldnames] for r in self.head],
+            "sample": [[r.get(c, "") for c in fieldnames] for r in self.sample],
+        }
+
+class PreviewSet:
+    """Una TablePreview por salida (t1_normal, ...); picklable para volver de los workers."""
+    def __init__(self, head_size: int, sample_size: int):
+        self.head_size = head_size
+        self.sample_size = sample_size
+        self.tables: dict[str, TablePreview] = {}
+
+    def table(self, key: str) -> TablePreview:
+        t = self.tables.get(key)
+        if t is None:
+            t = self.tables[key] = TablePreview(self.head_size, self.sample_size)
+        return t
+
+    @classmethod
+    def from_json(cls, d: dict[str, dict], head_size: int, sample_size: int) -> 'PreviewSet':
+        ps = cls(head_size, sample_size)
+        ps.tables = {key: TablePreview.from_json(t, head_size, sample_size) for key, t in d.items()}
+        return ps
+
+    def merge(self, other: 'PreviewSet') -> None:
+        for key, t in other.tables.items():
+            self.table(key).merge(t)
+
+    def to_json(self, fns: dict[str, list[str]]) -> dict[str, dict]:
+        return {key: self.table(key).to_json(fieldnames) for key, fieldnames in fns.items()}
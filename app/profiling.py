@@ -0,0 +1,56 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Callable
+import cProfile, io, pstats
+
+# Perfil opcional por run (cProfile): el hilo del job y cada tarea del pool se perfilan por
+# separado y se unen en un solo .prof (abrible con snakeviz/pstats) más un resumen en texto.
+
+TOP_FUNCTIONS = 60  # filas del resumen .txt
+
+class _Stats:
+    """Adaptador para `pstats.Stats.add` a partir del dict de stats de otro proceso."""
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+class RunProfiler:
+    """Acumula los perfiles de un run; `parts` son dicts de stats (picklables, vienen de los workers).
+
+    Con `enabled=False`, `call` solo ejecuta la función.
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.parts: list[dict] = []
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # 3.12+: ya hay un perfilador activo en el proceso (otro run perfilado)
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            prof.disable()
+            prof.create_stats()
+            self.parts.append(prof.stats)
+
+    def write(self, path: Path) -> list[Path]:
+        """Une los perfiles en `path` (.prof) y escribe el resumen por tiempo acumulado en `.txt`."""
+        if not self.parts:
+            return []
+        st = pstats.Stats(_Stats(self.parts[0]))
+        for p in self.parts[1:]:
+            st.add(_Stats(p))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        st.dump_stats(str(path))
+        buf = io.StringIO()
+        pstats.Stats(str(path), stream=buf).strip_dirs().sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        txt = path.with_suffix(".txt")
+        txt.write_text(buf.getvalue(), encoding="utf-8")
+        return [path, txt]
@@ -0,0 +1,51 @@
+from __future__ import annotations
+import asyncio, json, threading
+
+class EventHub:
+    """Suscripciones asyncio por run: el job (en otro hilo) avisa y los streams SSE despiertan.
+
+    Solo se transmite el aviso "hay eventos nuevos"; cada stream lee lo pendiente desde
+    el RunStore con su propio cursor, así un cliente lento no acumula una cola propia.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def subscribe(self, run_id: str) -> asyncio.Event:
+        ev = asyncio.Event()
+        with self._lock:
+            self._subs.setdefault(run_id, set()).add((asyncio.get_running_loop(), ev))
+        return ev
+
+    def unsubscribe(self, run_id: str, ev: asyncio.Event) -> None:
+        with self._lock:
+            subs = self._subs.get(run_id)
+            if subs is None:
+                return
+            subs.difference_update({s for s in subs if s[1] is ev})
+            if not subs:
+                del self._subs[run_id]
+
+    def notify(self, run_id: str) -> None:
+        """Thread-safe; si el stream ya tiene un aviso pendiente no se encola otro."""
+        with self._lock:
+            subs = list(self._subs.get(run_id, ()))
+        for loop, ev in subs:
+            if not ev.is_set():
+                try:
+                    loop.call_soon_threadsafe(ev.set)
+                except RuntimeError:  # loop cerrado
+                    pass
+
+def coalesce_progress(events: list[tuple[int, str]]) -> list[tuple[int, str]]:
+    """Deja solo el último evento de progreso por archivo; los logs pasan todos, en orden."""
+    latest: dict[str, int] = {}
+    files: dict[int, str] = {}
+    for i, (_, data) in enumerate(events):
+        if data.startswith('{"type": "progress"'):
+            f = json.loads(data).get("file", "")
+            latest[f] = i
+            files[i] = f
+    if len(latest) == len(files):
+        return events
+    return [e for i, e in enumerate(events) if i not in files or latest[files[i]] == i]
@@ -0,0 +1,303 @@
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Callable
+import json, sqlite3, threading, time
+
+from .logging_setup import logger
+
+@dataclass
+class RunState:
+    """Estado de un run: salidas, conteos, fieldnames, artefactos y avisos."""
+    run_id: str
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    status: str = "queued"  # queued, running, ok, error, cancelled, rejected, interrupted
+    files: dict[str, Path] = field(default_factory=dict)
+    counts: dict[str, int] = field(default_factory=dict)
+    fns: dict[str, list[str]] = field(default_factory=dict)
+    artifacts: dict[str, Path] = field(default_factory=dict)  # salidas extra (Parquet, ...) por key
+    raw_sizes: dict[str, int] = field(default_factory=dict)   # bytes sin comprimir por salida
+    warnings: list[str] = field(default_factory=list)
+    es: dict | None = None  # resultado del modo tee
+    es_indices: dict[str, str] = field(default_factory=dict)  # índice gestionado publicado por tipo (t1/t2)
+    preview: dict | None = None  # por salida: fieldnames, filas, head y sample (ver preview.py)
+    summary: dict | None = None  # por salida: agregados de cumplimiento (ver aggregates.py)
+    delta: dict | None = None  # modo delta: filas nuevas por salida, desaparecidas y run base por tipo
+    params: dict = field(default_factory=dict)  # cliente, fecha, compresión: para agregar archivos después
+    sources: list[str] = field(default_factory=list)  # uploads procesados ({digest}_{nombre})
+
+    def __post_init__(self):
+        # no es un campo (asdict no lo copia): lo toman to_json y los métodos que mutan
+        # listas/dicts en el lugar, porque el hilo del store serializa mientras el job escribe
+        self._lock = threading.Lock()
+
+    def warn(self, msg: str) -> None:
+        with self._lock:
+            self.warnings.append(msg)
+
+    def add_artifact(self, key: str, path: Path) -> None:
+        with self._lock:
+            self.artifacts[key] = path
+
+    def set_raw_size(self, key: str, n: int) -> None:
+        with self._lock:
+            self.raw_sizes[key] = n
+
+    def to_json(self) -> str:
+        with self._lock:
+            d = asdict(self)
+        d["files"] = {k: str(p) for k, p in d["files"].items()}
+        d["artifacts"] = {k: str(p) for k, p in d["artifacts"].items()}
+        return json.dumps(d, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> 'RunState':
+        d = json.loads(raw)
+        d["files"] = {k: Path(p) for k, p in d["files"].items()}
+        d["artifacts"] = {k: Path(p) for k, p in d["artifacts"].items()}
+        return cls(**d)
+
+@dataclass
+class _Live:
+    state: RunState
+    events: deque = field(default_factory=deque)  # (seq, data), acotado a `ring`
+    seq: int = 0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY, created REAL, finished REAL, updated REAL, accessed REAL, state TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    run_id TEXT, seq INTEGER, data TEXT, PRIMARY KEY (run_id, seq)
+) WITHOUT ROWID;
+"""
+
+class RunStore:
+    """Estado de los runs en SQLite, compartible entre workers de uvicorn y persistente entre reinicios.
+
+    Los runs en curso viven en memoria (`log` y los conteos no tocan el disco) y un hilo
+    los vuelca cada `flush_interval` segundos en una sola transacción. De cada run se
+    guardan solo los últimos `ring` eventos. Los runs terminados se borran pasado `ttl`
+    segundos o, si hay más de `max_runs`, los de acceso más antiguo (LRU). Un run sin
+    terminar que deja de actualizarse (el worker murió) se marca como interrumpido.
+    `on_change(run_id)` se llama (desde el hilo que escribe) con cada evento y al terminar.
+    """
+    def __init__(self, path: Path | str, *, ring: int = 5000, ttl: float = 72 * 3600,
+                 max_runs: int = 500, flush_interval: float = 0.5,
+                 on_evict: Callable[[str], None] | None = None,
+                 on_change: Callable[[str], None] | None = None):
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._live: dict[str, _Live] = {}
+        self._pending: list[tuple[str, int, str]] = []
+        self._finishing: set[str] = set()
+        self._touched: dict[str, float] = {}
+        self.ring = ring
+        self.ttl = ttl
+        self.max_runs = max_runs
+        self.flush_interval = flush_interval
+        self._on_evict = on_evict
+        self._on_change = on_change
+        self._last_sweep = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flusher, name="run-store", daemon=True)
+        self._thread.start()
+
+    # --- escritura (hot path: solo memoria) ---
+    def create(self, run_id: str) -> RunState:
+        live = _Live(RunState(run_id), deque(maxlen=self.ring))
+        with self._lock:
+            self._live[run_id] = live
+        return live.state
+
+    def log(self, run_id: str, data: str) -> None:
+        with self._lock:
+            live = self._live.get(run_id)
+            if live is None:
+                return
+            live.seq += 1
+            live.events.append((live.seq, data))
+            self._pending.append((run_id, live.seq, data))
+        if self._on_change:
+            self._on_change(run_id)
+
+    def finish(self, run_id: str) -> None:
+        with self._lock:
+            live = self._live.get(run_id)
+            if live is not None and live.state.finished is None:
+                live.state.finished = time.time()
+                self._finishing.add(run_id)
+        if self._on_change:
+            self._on_change(run_id)
+
+    def reopen(self, run_id: str) -> RunState | None:
+        """Vuelve a poner en curso un run terminado (p. ej. para agregarle archivos).
+
+        None si no existe o ya está en curso; entre workers, solo uno lo consigue.
+        """
+        self.flush()  # un finish pendiente tiene que llegar a SQLite antes
+        with self._db_lock:
+            cur = self._db.execute(
+                "UPDATE runs SET finished = NULL, updated = ? WHERE run_id = ? AND finished IS NOT NULL",
+                (time.time(), run_id),
+            )
+            if cur.rowcount != 1:
+                return None
+            (raw,) = self._db.execute("SELECT state FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            events = self._db.execute(
+                "SELECT seq, data FROM events WHERE run_id = ? ORDER BY seq DESC LIMIT ?", (run_id, self.ring),
+            ).fetchall()
+        st = RunState.from_json(raw)
+        st.finished = None
+        live = _Live(st, deque(reversed(events), maxlen=self.ring), events[0][0] if events else 0)
+        with self._lock:
+            self._live[run_id] = live
+        return st
+
+    def save(self, state: RunState) -> None:
+        """Guarda cambios a un run terminado que ya no está en memoria (los en curso se vuelcan solos)."""
+        with self._lock:
+            if state.run_id in self._live:
+                return
+        with self._db_lock:
+            self._db.execute("UPDATE runs SET state = ? WHERE run_id = ?", (state.to_json(), state.run_id))
+
+    def delete(self, run_id: str) -> None:
+        """Borra el run (terminado) y sus eventos; no llama a `on_evict`."""
+        with self._lock:
+            self._live.pop(run_id, None)
+            self._pending = [e for e in self._pending if e[0] != run_id]
+            self._finishing.discard(run_id)
+            self._touched.pop(run_id, None)
+        with self._db_lock:
+            db = self._db
+            db.execute("BEGIN")
+            db.execute("DELETE FROM events WHERE run_id = ?", (run_id,))
+            db.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            db.execute("COMMIT")
+
+    # --- lectura ---
+    def get(self, run_id: str) -> RunState | None:
+        with self._lock:
+            live = self._live.get(run_id)
+            if live is not None:
+                return live.state
+            self._touched[run_id] = time.time()
+        with self._db_lock:
+            row = self._db.execute("SELECT state FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return RunState.from_json(row[0]) if row else None
+
+    def events_since(self, run_id: str, after: int = 0) -> list[tuple[int, str]]:
+        """Eventos con seq > `after` (los más viejos que el ring ya no están)."""
+        with self._lock:
+            live = self._live.get(run_id)
+            if live is not None:
+                return [e for e in live.events if e[0] > after]
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT seq, data FROM events WHERE run_id = ? AND seq > ? ORDER BY seq", (run_id, after),
+            ).fetchall()
+
+    def is_live(self, run_id: str) -> bool:
+        """True si el run está en curso en este proceso."""
+        with self._lock:
+            return run_id in self._live
+
+    def is_finished(self, run_id: str) -> bool:
+        st = self.get(run_id)
+        return st is None or st.finished is not None
+
+    # --- volcado en lote ---
+    def _flusher(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # se reintenta en el próximo ciclo; los eventos siguen en memoria
+                logger.exception("run_store_flush_failed")
+
+    def flush(self) -> None:
+        now = time.time()
+        with self._lock:
+            events, self._pending = self._pending, []
+            finishing, self._finishing = self._finishing, set()
+            touched, self._touched = self._touched, {}
+            states = [(live.state.run_id, live.state.created, live.state.finished, live.state.to_json())
+                      for live in self._live.values()]
+            trims = {live.state.run_id: live.seq - self.ring for live in self._live.values() if live.seq > self.ring}
+        with self._db_lock:
+            db = self._db
+            try:
+                db.execute("BEGIN")
+                db.executemany(
+                    "INSERT OR REPLACE INTO runs (run_id, created, finished, updated, accessed, state) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(rid, created, finished, now, now, raw) for rid, created, finished, raw in states],
+                )
+                db.executemany("INSERT OR REPLACE INTO events (run_id, seq, data) VALUES (?, ?, ?)", events)
+                db.executemany("DELETE FROM events WHERE run_id = ? AND seq <= ?", list(trims.items()))
+                db.executemany("UPDATE runs SET accessed = ? WHERE run_id = ?", [(t, r) for r, t in touched.items()])
+                db.execute("COMMIT")
+            except sqlite3.Error:
+                db.execute("ROLLBACK")
+                with self._lock:
+                    self._pending[:0] = events
+                    self._finishing |= finishing
+                raise
+        with self._lock:
+            for rid in finishing:
+                self._live.pop(rid, None)
+        if now - self._last_sweep >= 60:
+            self._last_sweep = now
+            self.sweep(now)
+
+    def sweep(self, now: float | None = None) -> list[str]:
+        """Borra runs terminados vencidos (TTL) o sobrantes (LRU) y marca los huérfanos."""
+        now = now or time.time()
+        with self._lock:
+            live_ids = set(self._live)
+        with self._db_lock:
+            db = self._db
+            stale = [r for (r,) in db.execute(
+                "SELECT run_id FROM runs WHERE finished IS NULL AND updated < ?", (now - max(60.0, 20 * self.flush_interval),),
+            ) if r not in live_ids]
+            for rid in stale:
+                row = db.execute("SELECT state FROM runs WHERE run_id = ?", (rid,)).fetchone()
+                st = RunState.from_json(row[0])
+                st.finished = now
+                st.status = "interrupted"
+                st.warnings.append("Run interrumpido: el proceso que lo ejecutaba terminó")
+                db.execute("UPDATE runs SET finished = ?, state = ? WHERE run_id = ?", (now, st.to_json(), rid))
+            expired = [r for (r,) in db.execute(
+                "SELECT run_id FROM runs WHERE finished IS NOT NULL AND finished < ?", (now - self.ttl,),
+            )]
+            (n_finished,) = db.execute("SELECT COUNT(*) FROM runs WHERE finished IS NOT NULL").fetchone()
+            extra = max(0, n_finished - len(expired) - self.max_runs)
+            if extra:
+                expired += [r for (r,) in db.execute(
+                    "SELECT run_id FROM runs WHERE finished IS NOT NULL AND finished >= ? "
+                    "ORDER BY accessed LIMIT ?", (now - self.ttl, extra),
+                )]
+            if expired:
+                db.execute("BEGIN")
+                db.executemany("DELETE FROM events WHERE run_id = ?", [(r,) for r in expired])
+                db.executemany("DELETE FROM runs WHERE run_id = ?", [(r,) for r in expired])
+                db.execute("COMMIT")
+        for rid in expired:
+            if self._on_evict:
+                self._on_evict(rid)
+        return expired
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        self._db.close()
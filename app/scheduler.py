@@ -0,0 +1,134 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Callable
+import heapq, itertools, threading
+
+class QueueFull(Exception):
+    pass
+
+@dataclass(order=True)
+class _Entry:
+    sort_key: tuple[int, int]
+    run_id: str = field(compare=False)
+    fn: Callable[[threading.Event], None] = field(compare=False)
+    cancel: threading.Event = field(compare=False, default_factory=threading.Event)
+
+class JobScheduler:
+    """Cola de runs con prioridad y un máximo de runs en ejecución, en hilos propios.
+
+    Los jobs reciben un `threading.Event` de cancelación que deben revisar (process_file lo
+    hace por lote). Mayor `priority` sale antes; a igual prioridad, en orden de llegada.
+    `on_queue(run_id, position)` avisa a cada run en espera cuando cambia su posición (solo a
+    los que cambiaron). `on_done(run_id)` se llama siempre al terminar un job, también si
+    lanzó algo que no es Exception: ahí se marca el run si el job no llegó a hacerlo.
+    """
+    def __init__(self, max_running: int = 2, max_queued: int = 100,
+                 on_queue: Callable[[str, int], None] | None = None,
+                 on_error: Callable[[str, BaseException], None] | None = None,
+                 on_done: Callable[[str], None] | None = None):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self._on_queue = on_queue
+        self._on_error = on_error
+        self._on_done = on_done
+        self._announced: dict[str, int] = {}  # última posición avisada a cada run en espera
+        self._cv = threading.Condition()
+        self._heap: list[_Entry] = []
+        self._running: dict[str, _Entry] = {}
+        self._seq = itertools.count()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"run-worker-{i}", daemon=True)
+            for i in range(max_running)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, run_id: str, fn: Callable[[threading.Event], None], priority: int = 0) -> int:
+        """Encola el run y devuelve su posición (1 = el próximo en arrancar)."""
+        with self._cv:
+            if len(self._heap) >= self.max_queued:
+                raise QueueFull(f"hay {len(self._heap)} runs en cola")
+            heapq.heappush(self._heap, _Entry((-priority, next(self._seq)), run_id, fn))
+            self._cv.notify()
+            pos = self._position(run_id)
+        self._announce()
+        return pos
+
+    def position(self, run_id: str) -> int | None:
+        """Posición en la cola; 0 si está corriendo, None si no está en el scheduler."""
+        with self._cv:
+            if run_id in self._running:
+                return 0
+            return self._position(run_id)
+
+    def _position(self, run_id: str) -> int | None:
+        for i, e in enumerate(sorted(self._heap), 1):
+            if e.run_id == run_id:
+                return i
+        return None
+
+    def cancel(self, run_id: str) -> str | None:
+        """'dequeued' si estaba en espera, 'cancelling' si corre (el job corta en su próximo chequeo)."""
+        with self._cv:
+            e = self._running.get(run_id)
+            if e is not None:
+                e.cancel.set()
+                return "cancelling"
+            for i, e in enumerate(self._heap):
+                if e.run_id == run_id:
+                    self._heap.pop(i)
+                    heapq.heapify(self._heap)
+                    break
+            else:
+                return None
+        self._announce()
+        return "dequeued"
+
+    def stats(self) -> tuple[int, int]:
+        with self._cv:
+            return len(self._running), len(self._heap)
+
+    def _announce(self) -> None:
+        if self._on_queue is None:
+            return
+        with self._cv:
+            positions = {e.run_id: i for i, e in enumerate(sorted(self._heap), 1)}
+            changed = [(rid, i) for rid, i in positions.items() if self._announced.get(rid) != i]
+            self._announced = positions
+        for rid, i in changed:
+            self._on_queue(rid, i)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cv:
+                while not self._heap and not self._closed:
+                    self._cv.wait()
+                if self._closed:
+                    return
+                e = heapq.heappop(self._heap)
+                self._running[e.run_id] = e
+            self._announce()
+            try:
+                e.fn(e.cancel)
+            except BaseException as exc:  # el job ya reportó el error en su log; el hilo sigue
+                if self._on_error:
+                    self._on_error(e.run_id, exc)
+            finally:
+                with self._cv:
+                    self._running.pop(e.run_id, None)
+                if self._on_done:
+                    self._on_done(e.run_id)
+
+    def shutdown(self, timeout: float | None = None) -> list[str]:
+        """Cancela los runs en curso, descarta la cola (devuelve sus run_id) y espera a los hilos."""
+        with self._cv:
+            self._closed = True
+            for e in self._running.values():
+                e.cancel.set()
+            dropped = [e.run_id for e in self._heap]
+            self._heap.clear()
+            self._cv.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        return dropped
@@ -0,0 +1,95 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Callable, Iterable, Protocol
+import csv
+
+try:  # opcional: solo para la salida Parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+class RowSink(Protocol):
+    """Destino adicional de filas ya proyectadas (tuplas en el orden de los fieldnames)."""
+    def writerows(self, rows: list) -> None: ...
+    def close(self) -> None: ...
+
+# (key de salida, fieldnames finales) -> sinks extra para esa tabla
+SinkFactory = Callable[[str, list[str]], list[RowSink]]
+
+class TeeWriter:
+    """Misma interfaz que usa process_file de csv.DictWriter (fieldnames, writeheader,
+    writer.writerows) pero replica cada lote de filas en los sinks extra."""
+    def __init__(self, dw: csv.DictWriter, sinks: Iterable[RowSink]):
+        self.fieldnames = dw.fieldnames
+        self._dw = dw
+        self._sinks = list(sinks)
+        self.writer = self
+
+    def writeheader(self) -> None:
+        self._dw.writeheader()
+
+    def writerows(self, rows: list) -> None:
+        self._dw.writer.writerows(rows)
+        for s in self._sinks:
+            s.writerows(rows)
+
+    def close(self) -> None:
+        for s in self._sinks:
+            s.close()
+
+def parquet_available() -> bool:
+    return pa is not None
+
+class ParquetSink:
+    """Escribe a Parquet en row groups; todas las columnas string con dictionary encoding.
+
+    Columnas como scan_name, periodo, Operating System o el estado del control se repiten
+    en casi todas las filas, así que el diccionario las deja en unos pocos bytes por página.
+    """
+    def __init__(self, path: Path, fieldnames: list[str], *, row_group_rows: int = 65536,
+                 compression: str = "zstd"):
+        if pa is None:
+            raise RuntimeError("pyarrow no está instalado")
+        self.path = path
+        self._names = list(fieldnames)
+        self._schema = pa.schema([(c, pa.string()) for c in self._names])
+        self._cols: list[list[str]] = [[] for _ in self._names]
+        self._buffered = 0
+        self._row_group_rows = row_group_rows
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = pq.ParquetWriter(
+            str(path), self._schema, compression=compression, use_dictionary=True,
+        )
+
+    def copy_from(self, src: Path) -> None:
+        """Copia las filas de otro Parquet row group por row group; columnas que no tiene quedan en ""."""
+        self._flush()
+        f = pq.ParquetFile(str(src))
+        for i in range(f.num_row_groups):
+            t = f.read_row_group(i)
+            arrays = [t.column(c) if c in t.column_names else pa.array([""] * t.num_rows, type=pa.string())
+                      for c in self._names]
+            self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def writerows(self, rows: list) -> None:
+        if not rows:
+            return
+        for col, values in zip(self._cols, zip(*rows)):
+            col.extend(values)
+        self._buffered += len(rows)
+        if self._buffered >= self._row_group_rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffered:
+            return
+        arrays = [pa.array(col, type=pa.string()) for col in self._cols]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        self._cols = [[] for _ in self._names]
+        self._buffered = 0
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
@@ -0,0 +1,126 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, TextIO
+import csv, itertools, operator, shutil, tempfile
+from .metrics import FINALIZE_SECONDS
+
+from .parser import (
+    _update_union, _ensure_extra_cols_for_table1, _ensure_extra_cols_for_table2,
+    add_header_to_union, HeaderUnion, _BATCH_ROWS,
+)
+from .sinks import RowSink, SinkFactory
+from .storage import open_output
+
+OUTPUT_KEYS = ("t1_normal", "t1_ajustada", "t2_normal", "t2_ajustada")
+
+@dataclass
+class SpillSegment:
+    """Cuerpo de una tabla ya transformado, con las columnas propias de esa tabla (sin header)."""
+    target: str
+    path: Path
+    fieldnames: list[str]
+
+@dataclass
+class SpillSet:
+    """Segmentos temporales por tabla + unión de headers, para procesar en una sola pasada.
+
+    `process_file(..., spill=...)` escribe cada tabla en su propio segmento mientras
+    acumula la unión de headers; `finalize` remapea columnas y concatena los segmentos
+    en orden, produciendo exactamente los mismos bytes que el modo de dos pasadas.
+    """
+    root: Path
+    union: HeaderUnion = field(default_factory=lambda: HeaderUnion([], [], [], []))
+    segments: list[SpillSegment] = field(default_factory=list)
+
+    @classmethod
+    def create(cls, parent: Path) -> 'SpillSet':
+        parent.mkdir(parents=True, exist_ok=True)
+        return cls(root=Path(tempfile.mkdtemp(prefix=".spill-", dir=parent)))
+
+    def add_header(self, mark: str, header: list[str]) -> None:
+        add_header_to_union(self.union, mark, header)
+
+    def absorb(self, other: 'SpillSet') -> None:
+        """Agrega los segmentos y headers de otro shard, en orden (p. ej. un worker del pool)."""
+        for mine, theirs in zip(
+            (self.union.t1_normal, self.union.t1_ajustada, self.union.t2_normal, self.union.t2_ajustada),
+            (other.union.t1_normal, other.union.t1_ajustada, other.union.t2_normal, other.union.t2_ajustada),
+        ):
+            _update_union(mine, theirs)
+        self.segments.extend(other.segments)
+
+    def open_segment(self, target: str, fieldnames: list[str]):
+        seg = SpillSegment(target, self.root / f"seg-{len(self.segments):06d}.csv", fieldnames)
+        self.segments.append(seg)
+        fh = seg.path.open("w", encoding="utf-8", newline="")
+        return fh, csv.DictWriter(fh, fieldnames=fieldnames, extrasaction="ignore")
+
+    def fieldnames(self) -> dict[str, list[str]]:
+        u = self.union
+        return {
+            "t1_normal":   _ensure_extra_cols_for_table1(u.t1_normal),
+            "t1_ajustada": _ensure_extra_cols_for_table1(u.t1_ajustada),
+            "t2_normal":   _ensure_extra_cols_for_table2(u.t2_normal),
+            "t2_ajustada": _ensure_extra_cols_for_table2(u.t2_ajustada),
+        }
+
+    def finalize(
+        self, outputs: dict[str, Path], sinks: SinkFactory | None = None,
+        opener: Callable[[str, Path], TextIO] | None = None,
+    ) -> dict[str, list[str]]:
+        """Escribe las salidas finales a partir de los segmentos y devuelve los fieldnames.
+
+        `sinks` crea, por tabla, salidas extra que reciben las mismas filas finales.
+        `opener(key, path)` abre cada salida (por defecto storage.open_output, que
+        comprime según el sufijo).
+        """
+        opener = opener or (lambda key, path: open_output(path))
+        fns = self.fieldnames()
+        for key, path in outputs.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            extra = sinks(key, fns[key]) if sinks else []
+            try:
+                with opener(key, path) as out, FINALIZE_SECONDS.time(table=key):
+                    _write_target(out, fns[key], [s for s in self.segments if s.target == key], extra)
+            finally:
+                for sink in extra:
+                    sink.close()
+        return fns
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def _write_target(out, fieldnames: list[str], segments: list[SpillSegment], sinks: list[RowSink]) -> None:
+    w = csv.writer(out)
+    wrote_rows = False
+    for seg in segments:
+        # Réplica del modo dos pasadas: header antes de cada tabla mientras no haya filas
+        if not wrote_rows:
+            w.writerow(fieldnames)
+        if seg.path.stat().st_size == 0:
+            continue
+        wrote_rows = True
+        if seg.fieldnames == fieldnames and not sinks:
+            # mismo layout: concatenación de bytes (ya es CSV final)
+            out.flush()
+            with seg.path.open("rb") as src:
+                shutil.copyfileobj(src, out.buffer, 1024 * 1024)
+            continue
+        with seg.path.open("r", encoding="utf-8", newline="") as src:
+            pos = {c: i for i, c in enumerate(seg.fieldnames)}
+            # el slot len(seg.fieldnames) es el "" que se agrega a cada fila
+            get = operator.itemgetter(*[pos.get(c, len(pos)) for c in fieldnames])
+            for rows in _batched(csv.reader(src), _BATCH_ROWS):
+                batch = []
+                for row in rows:
+                    row.append("")
+                    batch.append(get(row))
+                w.writerows(batch)
+                for sink in sinks:
+                    sink.writerows(batch)
+
+def _batched(it, n: int):
+    it = iter(it)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
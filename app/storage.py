@@ -1,7 +1,22 @@
+import gzip
 import hashlib
+import io
+import os
 import shutil
+import tempfile
+import time
 from pathlib import Path
-from .config import UPLOADS_DIR, OUTPUTS_DIR
+from typing import Callable, TextIO
+from .config import UPLOADS_DIR, OUTPUTS_DIR, INCOMING_DIR
+from .metrics import UPLOAD_HASH_SECONDS, UPLOAD_FINALIZE_SECONDS, UPLOAD_BYTES
+
+try:  # opcional: solo para salidas .zst
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# compresión de salida -> sufijo del archivo
+COMPRESSION_SUFFIX = {"gzip": ".gz", "zstd": ".zst"}
 
 def sha256_of_file(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
     h = hashlib.sha256()
@@ -12,19 +27,179 @@ def sha256_of_file(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
             h.update(b)
     return h.hexdigest()
 
-def finalize_upload(tmp_path: Path, orig_name: str) -> tuple[str, Path, int]:
-    digest = sha256_of_file(tmp_path)[:16]
-    target = UPLOADS_DIR / f"{digest}_{orig_name}"
-    # mover (O(1) si misma partición)
-    shutil.move(str(tmp_path), target)
+class UploadSink:
+    """Archivo temporal de un upload en curso: calcula el sha256 a medida que se escriben los chunks."""
+    def __init__(self):
+        fd, name = tempfile.mkstemp(dir=INCOMING_DIR, suffix=".part")
+        self.path = Path(name)
+        self._f = os.fdopen(fd, "wb")
+        self._h = hashlib.sha256()
+        self._hash_s = 0.0  # tiempo de hash acumulado (UPLOAD_HASH_SECONDS al cerrar)
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        t = time.perf_counter()
+        self._h.update(chunk)
+        self._hash_s += time.perf_counter() - t
+        self._f.write(chunk)
+        self.size += len(chunk)
+
+    def hexdigest(self) -> str:
+        return self._h.hexdigest()
+
+    def close(self) -> None:
+        self._f.close()
+        UPLOAD_HASH_SECONDS.observe(self._hash_s)
+
+    def discard(self) -> None:
+        self._f.close()
+        self.path.unlink(missing_ok=True)
+
+def find_upload(digest: str) -> Path | None:
+    """Upload ya guardado con ese digest (los primeros 16 hex del sha256), si existe."""
+    prefix = digest[:16]
+    # va a un glob: solo hex, nunca comodines
+    if len(prefix) != 16 or not all(c in "0123456789abcdef" for c in prefix):
+        return None
+    return next(UPLOADS_DIR.glob(f"{prefix}_*"), None)
+
+def finalize_upload(tmp_path: Path, orig_name: str, digest: str | None = None) -> tuple[str, Path, int, bool]:
+    """Guarda el upload como {digest}_{nombre}; si ya hay uno con el mismo contenido, descarta
+    `tmp_path` y devuelve el existente. `digest` es el sha256 ya calculado (UploadSink);
+    sin él se lee el archivo. El último valor indica si era un duplicado."""
+    if digest is None:
+        with UPLOAD_HASH_SECONDS.time():
+            digest = sha256_of_file(tmp_path)
+    with UPLOAD_FINALIZE_SECONDS.time():
+        digest = digest[:16]
+        existing = find_upload(digest)
+        if existing is not None:
+            tmp_path.unlink(missing_ok=True)
+            return digest, existing, existing.stat().st_size, True
+        target = UPLOADS_DIR / f"{digest}_{orig_name}"
+        # mover (O(1) si misma partición)
+        shutil.move(str(tmp_path), target)
     size = target.stat().st_size
-    return digest, target, size
+    UPLOAD_BYTES.inc(size)
+    return digest, target, size, False
+
+def run_output_dir(run_id: str) -> Path:
+    return OUTPUTS_DIR / run_id
 
-def make_run_output_paths(run_id: str, cliente: str, fecha: str) -> dict[str, Path]:
+def run_staging_dir(run_id: str) -> Path:
+    # mismo filesystem que la carpeta final: publicar el run es un rename atómico
+    return OUTPUTS_DIR / f".{run_id}.partial"
+
+def make_run_output_paths(run_id: str, cliente: str, fecha: str, compression: str | None = None,
+                          root: Path | None = None) -> dict[str, Path]:
     base = f"{cliente}-hardening"
+    ext = ".csv" + COMPRESSION_SUFFIX.get(compression or "", "")
+    root = root or run_output_dir(run_id)
     return {
-        "t1_normal":   OUTPUTS_DIR / f"{base}-control-statics-{fecha}.csv",
-        "t1_ajustada": OUTPUTS_DIR / f"{base}-control-statics-{fecha}-ajustada.csv",
-        "t2_normal":   OUTPUTS_DIR / f"{base}-result-{fecha}.csv",
-        "t2_ajustada": OUTPUTS_DIR / f"{base}-result-{fecha}-ajustada.csv",
+        "t1_normal":   root / f"{base}-control-statics-{fecha}{ext}",
+        "t1_ajustada": root / f"{base}-control-statics-{fecha}-ajustada{ext}",
+        "t2_normal":   root / f"{base}-result-{fecha}{ext}",
+        "t2_ajustada": root / f"{base}-result-{fecha}-ajustada{ext}",
     }
+
+def publish_run_outputs(run_id: str) -> Path:
+    """Mueve las salidas del run de la carpeta de trabajo a la definitiva en un solo rename."""
+    final = run_output_dir(run_id)
+    run_staging_dir(run_id).replace(final)
+    return final
+
+def remove_run_outputs(run_id: str) -> None:
+    for d in (run_staging_dir(run_id), run_output_dir(run_id)):
+        shutil.rmtree(d, ignore_errors=True)
+
+def make_parquet_paths(outputs: dict[str, Path]) -> dict[str, Path]:
+    # Mismo nombre que el CSV de cada tabla, key "<tabla>.parquet"
+    return {f"{k}.parquet": p.parent / f"{csv_name(p)[:-len('.csv')]}.parquet" for k, p in outputs.items()}
+
+def make_delta_paths(outputs: dict[str, Path]) -> dict[str, Path]:
+    # Filas nuevas o cambiadas de cada tabla (modo delta), key "<tabla>.delta"
+    return {f"{k}.delta": p.parent / (f"{csv_name(p)[:-len('.csv')]}-delta.csv" + p.name[len(csv_name(p)):])
+            for k, p in outputs.items()}
+
+def make_summary_paths(outputs: dict[str, Path], cliente: str, fecha: str) -> dict[str, Path]:
+    # Agregados de cumplimiento del run, keys "summary.json" y "summary.parquet"
+    name = f"{cliente}-hardening-summary-{fecha}"
+    return {f"summary.{ext}": outputs["t1_normal"].parent / f"{name}.{ext}" for ext in ("json", "parquet")}
+
+def make_profile_path(outputs: dict[str, Path], cliente: str, fecha: str) -> Path:
+    return outputs["t1_normal"].parent / f"{cliente}-hardening-profile-{fecha}.prof"
+
+def compression_of(path: Path) -> str | None:
+    for comp, suffix in COMPRESSION_SUFFIX.items():
+        if path.name.endswith(".csv" + suffix):
+            return comp
+    return None
+
+def csv_name(path: Path) -> str:
+    """Nombre del CSV sin el sufijo de compresión."""
+    comp = compression_of(path)
+    return path.name[:-len(COMPRESSION_SUFFIX[comp])] if comp else path.name
+
+class _CountingWriter(io.RawIOBase):
+    """Cuenta los bytes sin comprimir que pasan hacia el compresor."""
+    def __init__(self, dst, on_close: Callable[[int], None] | None):
+        self._dst = dst
+        self._on_close = on_close
+        self.count = 0
+    def writable(self) -> bool:
+        return True
+    def write(self, b) -> int:
+        self._dst.write(b)
+        self.count += len(b)
+        return len(b)
+    def close(self) -> None:
+        if not self.closed:
+            self._dst.close()
+            if self._on_close:
+                self._on_close(self.count)
+        super().close()
+
+def open_output(path: Path, *, level: int | None = None,
+                on_close: Callable[[int], None] | None = None, append: bool = False) -> TextIO:
+    """Abre una salida CSV para escribir texto; comprime según el sufijo (.gz / .zst).
+
+    `on_close` recibe el tamaño sin comprimir al cerrar (de lo escrito en esta apertura).
+    Con `append` escribe al final: en .gz/.zst agrega un miembro/frame nuevo, que los
+    lectores concatenan.
+    """
+    comp = compression_of(path)
+    mode = "ab" if append else "wb"
+    if comp is None:
+        dst = path.open(mode)
+    elif comp == "gzip":
+        dst = gzip.open(path, mode, compresslevel=6 if level is None else level)
+    else:
+        if zstandard is None:
+            raise RuntimeError("zstandard no está instalado")
+        cctx = zstandard.ZstdCompressor(level=3 if level is None else level)
+        dst = cctx.stream_writer(path.open(mode), closefd=True)
+    raw = _CountingWriter(dst, on_close)
+    return io.TextIOWrapper(io.BufferedWriter(raw, 1024 * 1024), encoding="utf-8", newline="")
+
+def open_output_reader(path: Path) -> TextIO:
+    """Lee una salida CSV (comprimida o no) como texto."""
+    comp = compression_of(path)
+    if comp == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    if comp == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard no está instalado")
+        reader = zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+        return io.TextIOWrapper(io.BufferedReader(reader), encoding="utf-8", errors="replace", newline="")
+    return path.open("r", encoding="utf-8", errors="replace", newline="")
+
+def open_output_binary(path: Path):
+    """Stream binario descomprimido de una salida (para servirla a clientes sin esa compresión)."""
+    comp = compression_of(path)
+    if comp == "gzip":
+        return gzip.open(path, "rb")
+    if comp == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard no está instalado")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True))
+    return path.open("rb")
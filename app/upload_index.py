@@ -0,0 +1,102 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+import contextlib, json, os, tempfile
+
+from .encoding import detect_encoding
+from .parser import (
+    PARSER_VERSION, FileMeta, TableMark, HeaderUnion,
+    read_file_meta, scan_table_marks, add_header_to_union,
+)
+
+INDEX_VERSION = 1
+
+@dataclass
+class UploadIndex:
+    """Sidecar de un upload: encoding, metadata de la primera línea y tablas (offsets, headers, filas)."""
+    digest: str
+    size: int
+    mtime_ns: int
+    encoding: str
+    meta: FileMeta
+    tables: list[TableMark] = field(default_factory=list)
+    version: int = INDEX_VERSION
+    parser_version: int = PARSER_VERSION
+
+    def header_union(self) -> HeaderUnion:
+        u = HeaderUnion([], [], [], [])
+        for t in self.tables:
+            add_header_to_union(u, t.mark, t.header)
+        return u
+
+    def marker_offsets(self) -> list[int] | None:
+        if any(t.offset is None for t in self.tables):
+            return None
+        return [t.offset for t in self.tables]
+
+def upload_digest(path: Path) -> str:
+    # Los uploads se guardan como {digest}_{nombre} (storage.finalize_upload)
+    return path.name.split("_", 1)[0]
+
+def index_path(path: Path) -> Path:
+    return path.parent / f"{upload_digest(path)}.index.json"
+
+def load_index(path: Path) -> UploadIndex | None:
+    """Índice válido para `path`, o None si falta, es de otra versión o el archivo cambió."""
+    ip = index_path(path)
+    try:
+        raw = json.loads(ip.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    st = path.stat()
+    if (raw.get("version") != INDEX_VERSION or raw.get("parser_version") != PARSER_VERSION
+            or raw.get("size") != st.st_size or raw.get("mtime_ns") != st.st_mtime_ns):
+        return None
+    raw["meta"] = FileMeta(**raw["meta"])
+    raw["tables"] = [TableMark(**t) for t in raw["tables"]]
+    return UploadIndex(**raw)
+
+def save_index(path: Path, idx: UploadIndex) -> None:
+    ip = index_path(path)
+    # temporal único: varias corridas (dedup, append) pueden guardar el índice del mismo upload
+    fd, tmp = tempfile.mkstemp(dir=ip.parent, prefix=f".{ip.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(asdict(idx), f, ensure_ascii=False)
+        os.replace(tmp, ip)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+def build_index(path: Path, encoding: str | None = None) -> UploadIndex:
+    st = path.stat()
+    enc = encoding or detect_encoding(path)
+    return UploadIndex(
+        digest=upload_digest(path), size=st.st_size, mtime_ns=st.st_mtime_ns,
+        encoding=enc, meta=read_file_meta(path, enc),
+        tables=scan_table_marks(path, enc),
+    )
+
+def ensure_index(path: Path) -> tuple[UploadIndex, bool]:
+    """Carga o reconstruye el índice; el bool indica si vino del disco."""
+    idx = load_index(path)
+    if idx is not None:
+        return idx, True
+    idx = build_index(path)
+    save_index(path, idx)
+    return idx, False
+
+def record_tables(path: Path, idx: UploadIndex | None, tables: list[TableMark], encoding: str) -> UploadIndex:
+    """Guarda las filas por tabla vistas al procesar; crea el índice (sin offsets) si no existía."""
+    if idx is not None and [(t.mark, t.header) for t in idx.tables] == [(t.mark, t.header) for t in tables]:
+        for known, seen in zip(idx.tables, tables):
+            known.rows = seen.rows
+    else:
+        st = path.stat()
+        idx = UploadIndex(
+            digest=upload_digest(path), size=st.st_size, mtime_ns=st.st_mtime_ns,
+            encoding=encoding, meta=read_file_meta(path, encoding), tables=tables,
+        )
+    save_index(path, idx)
+    return idx
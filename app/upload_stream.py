@@ -0,0 +1,68 @@
+from __future__ import annotations
+from pathlib import Path
+
+from fastapi import Request
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+from .storage import UploadSink
+
+# Lee el multipart/form-data directo del stream del request: el campo del archivo va al
+# UploadSink (que hashea mientras escribe) sin pasar por el SpooledTemporaryFile de Starlette.
+
+class UploadError(Exception):
+    pass
+
+async def receive_upload(request: Request, sink: UploadSink, field: str = "file") -> str:
+    """Escribe en `sink` el archivo del campo `field` y devuelve su nombre original."""
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise UploadError("se esperaba multipart/form-data")
+
+    st = {"hname": b"", "hvalue": b"", "headers": {}, "target": False, "filename": None, "done": False}
+
+    def on_part_begin():
+        st["headers"] = {}
+
+    def on_header_field(data, start, end):
+        st["hname"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        st["hvalue"] += data[start:end]
+
+    def on_header_end():
+        st["headers"][st["hname"].lower()] = st["hvalue"]
+        st["hname"] = st["hvalue"] = b""
+
+    def on_headers_finished():
+        _, opts = parse_options_header(st["headers"].get(b"content-disposition", b""))
+        name = opts.get(b"name", b"").decode("utf-8", "replace")
+        st["target"] = name == field and b"filename" in opts and not st["done"]
+        if st["target"]:
+            st["filename"] = opts[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(data, start, end):
+        if st["target"]:
+            sink.write(data[start:end])
+
+    def on_part_end():
+        if st["target"]:
+            st["target"], st["done"] = False, True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field,
+        "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except MultipartParseError as e:
+        raise UploadError(f"multipart inválido: {e}") from e
+    if not st["done"]:
+        raise UploadError(f"falta el campo '{field}' con un archivo")
+    # solo el nombre: el cliente podría mandar una ruta
+    return Path(st["filename"].replace("\\", "/")).name or "upload"
@@ -0,0 +1,74 @@
+from __future__ import annotations
+from datetime import date
+from pathlib import Path
+import shutil, threading, time
+
+from .batch import Emit, emit_json, new_batch_id, run_batch
+from .parser import RunCancelled
+
+# Modo watch: revisa una carpeta cada `interval` segundos y procesa los reportes nuevos en
+# micro-lotes. Un archivo está listo cuando su tamaño y mtime no cambian durante `settle`
+# segundos (todavía se está copiando si no). Al terminar cada lote, sus archivos se mueven
+# a `done/{batch_id}/` (o a `failed/{batch_id}/`), así la carpeta no necesita estado aparte.
+
+class DirWatcher:
+    def __init__(self, root: Path, pattern: str = "*.csv", settle: float = 10.0):
+        self.root = root
+        self.pattern = pattern
+        self.settle = settle
+        self._seen: dict[Path, tuple[int, int, float]] = {}  # path -> (size, mtime_ns, desde cuándo)
+
+    def ready(self, now: float) -> list[Path]:
+        """Archivos estables, del más viejo al más nuevo."""
+        current = {}
+        for p in self.root.glob(self.pattern):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            if not p.is_file():
+                continue
+            prev = self._seen.get(p)
+            since = prev[2] if prev and prev[:2] == (st.st_size, st.st_mtime_ns) else now
+            current[p] = (st.st_size, st.st_mtime_ns, since)
+        self._seen = current
+        ready = [p for p, (_, _, since) in current.items() if now - since >= self.settle]
+        return sorted(ready, key=lambda p: (current[p][1], p.name))
+
+def _move_all(files: list[Path], dest: Path) -> None:
+    dest.mkdir(parents=True, exist_ok=True)
+    for p in files:
+        shutil.move(str(p), dest / p.name)
+
+def watch(root: Path, *, cliente: str, out_dir: Path, fecha: str | None = None,
+          pattern: str = "*.csv", interval: float = 5.0, settle: float = 10.0, batch_max: int = 20,
+          done_dir: Path | None = None, failed_dir: Path | None = None,
+          emit: Emit = emit_json, stop: threading.Event | None = None, **batch_opts) -> None:
+    """Procesa los reportes que van llegando a `root` hasta que se active `stop`.
+
+    `fecha` fija la del reporte; por defecto es la del día en que se procesa cada lote.
+    Los lotes fallidos no detienen el watch; un lote cancelado deja sus archivos en `root`.
+    """
+    stop = stop or threading.Event()
+    done_dir = done_dir or root / "done"
+    failed_dir = failed_dir or root / "failed"
+    watcher = DirWatcher(root, pattern, settle)
+    emit({"type": "watch", "dir": str(root), "pattern": pattern})
+    while not stop.is_set():
+        ready = watcher.ready(time.monotonic())
+        while ready and not stop.is_set():
+            batch, ready = ready[:batch_max], ready[batch_max:]
+            batch_id = new_batch_id()
+            try:
+                run_batch(batch, cliente=cliente, fecha=fecha or date.today().isoformat(), out_dir=out_dir,
+                          emit=emit, cancel=stop, batch_id=batch_id, **batch_opts)
+            except RunCancelled:
+                emit({"type": "cancelled", "batch": batch_id})
+                return
+            except Exception as e:
+                emit({"type": "error", "batch": batch_id, "message": f"{type(e).__name__}: {e}",
+                      "files": [str(p) for p in batch]})
+                _move_all(batch, failed_dir / batch_id)
+                continue
+            _move_all(batch, done_dir / batch_id)
+        stop.wait(interval)
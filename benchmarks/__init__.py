@@ -0,0 +1,6 @@
+"""Benchmarks reproducibles del pipeline (ver `python -m benchmarks --help`).
+
+- generate: reportes Qualys sintéticos (tamaño, tablas, drift de columnas, ajustada/DC, encodings).
+- es_stub: ES local (_bulk, índices, templates y alias) para medir y probar el push a ES sin red.
+- run: mide cada etapa en un proceso propio (tiempo, filas/s, MB/s, pico de RSS) y guarda JSON.
+"""
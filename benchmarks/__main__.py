@@ -0,0 +1,56 @@
+from __future__ import annotations
+from pathlib import Path
+import argparse, json, sys
+
+from .generate import default_specs, ensure_reports
+from .run import BENCHES, run_suite, compare
+
+ROOT = Path(__file__).resolve().parent
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks del pipeline con reportes sintéticos.")
+    ap.add_argument("--workdir", type=Path, default=ROOT / ".work", help="reportes generados y salidas (se reutilizan)")
+    ap.add_argument("--files", type=int, default=3)
+    ap.add_argument("--size-mb", type=float, default=20.0, help="tamaño aproximado de cada reporte")
+    ap.add_argument("--tables", type=int, default=4)
+    ap.add_argument("--drift", type=float, default=0.3, help="0..1, columnas opcionales que cambian entre reportes")
+    ap.add_argument("--encodings", default="utf-8,utf-16,latin-1")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--compression", choices=["gzip", "zstd"], default=None, help="compresión de las salidas")
+    ap.add_argument("--es-threads", type=int, default=4)
+    ap.add_argument("--es-latency-ms", type=float, default=0.0, help="latencia simulada por request _bulk")
+    ap.add_argument("--only", default=",".join(BENCHES), help="benches a correr, separados por coma")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--out", type=Path, default=None, help="JSON de resultados (default: results/<commit>.json)")
+    ap.add_argument("--compare", type=Path, default=None, help="JSON de una corrida anterior")
+    ap.add_argument("--threshold", type=float, default=0.10, help="regresión tolerada en --compare")
+    args = ap.parse_args(argv)
+
+    names = [n.strip() for n in args.only.split(",") if n.strip()]
+    unknown = [n for n in names if n not in BENCHES]
+    if unknown:
+        ap.error(f"benches desconocidos: {', '.join(unknown)} (disponibles: {', '.join(BENCHES)})")
+
+    # se lee antes de correr: --out puede apuntar al mismo archivo
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    specs = default_specs(args.files, args.size_mb, args.tables, args.drift,
+                          [e.strip() for e in args.encodings.split(",")], args.seed)
+    print(f"Generando {len(specs)} reportes en {args.workdir} ...")
+    reports = ensure_reports(args.workdir / "reports", specs)
+    opts = {"compression": args.compression, "es_threads": args.es_threads,
+            "es_latency": args.es_latency_ms / 1000}
+    result = run_suite(reports, args.workdir, names, opts, args.repeat)
+
+    out = args.out or ROOT / "results" / f"{result['meta']['commit'] or 'local'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"Resultados: {out}")
+
+    if baseline:
+        lines, regressed = compare(baseline, result, args.threshold)
+        print("\n".join(lines))
+        return 1 if regressed else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+from __future__ import annotations
+from collections import Counter
+from fnmatch import fnmatch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import json, re, threading, time
+
+_INFO = json.dumps({
+    "name": "bench-stub", "cluster_name": "bench",
+    "version": {"number": "8.14.0", "build_flavor": "default"}, "tagline": "You Know, for Search",
+}).encode()
+_ITEM = b'{"index":{"status":201}}'
+_NO_WRITE_INDEX = (b'{"index":{"status":400,"error":{"type":"illegal_argument_exception",'
+                   b'"reason":"no write index is defined for alias"}}}')
+_ACTION_INDEX = re.compile(rb'"_index":"([^"]*)"')
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: el cliente reutiliza las conexiones del pool
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body: bytes, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, obj, status: int = 200) -> None:
+        self._reply(json.dumps(obj).encode(), status)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path.startswith("/_alias/"):
+            return self._api("GET", path, b"")
+        self._reply(_INFO)
+
+    def do_HEAD(self):
+        # exists de índices (/{index}) y de alias (/_alias/{name}); lo demás existe siempre
+        parts = [p for p in urlsplit(self.path).path.split("/") if p]
+        srv = self.server
+        with srv.lock:
+            if parts[:1] == ["_alias"]:
+                found = bool(srv.aliases.get(parts[1]))
+            elif len(parts) == 1:
+                found = parts[0] in srv.indices or bool(srv.aliases.get(parts[0]))
+            else:
+                found = True
+        self.send_response(200 if found else 404)
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self._body()
+        if "_bulk" not in self.path:
+            return self._api(self.command, urlsplit(self.path).path, body)
+        if self.latency:
+            time.sleep(self.latency)
+        # NDJSON de a pares acción/documento: de cada acción solo se busca el _index
+        targets = _ACTION_INDEX.findall(body)
+        docs = (body.count(b"\n") + (not body.endswith(b"\n"))) // 2
+        items = self.server.index_docs(targets) if len(targets) == docs else [_ITEM] * docs
+        self.server.bulks += 1
+        errors = b"true" if _NO_WRITE_INDEX in items else b"false"
+        self._reply(b'{"errors":' + errors + b',"items":[' + b",".join(items) + b"]}")
+
+    do_PUT = do_POST
+
+    def do_DELETE(self):
+        self._body()
+        self._api("DELETE", urlsplit(self.path).path, b"")
+
+    def _api(self, method: str, path: str, body: bytes) -> None:
+        srv = self.server
+        q = parse_qs(urlsplit(self.path).query)
+        parts = [p for p in path.split("/") if p]
+        data = json.loads(body) if body.strip() else {}
+        with srv.lock:
+            srv.calls.append((method, path))
+            if parts[:1] == ["_index_template"] and method == "PUT":
+                srv.templates[parts[1]] = data
+                return self._json({"acknowledged": True})
+            if parts[:1] == ["_alias"]:
+                found = {i: {"aliases": {parts[1]: {}}} for i in srv.aliases.get(parts[1], ())}
+                if not found:
+                    return self._json({"error": f"alias [{parts[1]}] missing", "status": 404}, 404)
+                return self._json(found)
+            if parts == ["_aliases"]:
+                clash = [a["alias"] for action in data.get("actions", []) for op, a in action.items()
+                         if op == "add" and a["alias"] in srv.indices]
+                if clash:
+                    # como ES: un alias no puede llamarse como un índice; no se aplica ninguna acción
+                    return self._json({"error": {"type": "invalid_alias_name_exception", "alias": clash[0]},
+                                       "status": 400}, 400)
+                for action in data.get("actions", []):
+                    (op, a), = action.items()
+                    if op == "add":
+                        srv.aliases.setdefault(a["alias"], set()).add(a["index"])
+                    else:
+                        srv.aliases.get(a["alias"], set()).discard(a["index"])
+                srv.alias_swaps.append(data.get("actions", []))
+                return self._json({"acknowledged": True})
+            if len(parts) == 1 and method == "PUT":
+                srv.create_index(parts[0], data.get("settings", {}))
+                return self._json({"acknowledged": True, "index": parts[0]})
+            if len(parts) == 1 and method == "DELETE":
+                for name in parts[0].split(","):
+                    srv.indices.pop(name, None)
+                    for members in srv.aliases.values():
+                        members.discard(name)
+                return self._json({"acknowledged": True})
+            if len(parts) == 2 and parts[0] not in srv.indices:
+                return self._json({"error": {"type": "index_not_found_exception", "index": parts[0]},
+                                   "status": 404}, 404)
+            if len(parts) == 2 and parts[1] == "_settings":
+                srv.indices[parts[0]]["settings"].update(_flat(data))
+                return self._json({"acknowledged": True})
+            if len(parts) == 2 and parts[1] == "_forcemerge":
+                srv.indices[parts[0]]["segments"] = int(q.get("max_num_segments", ["0"])[0])
+                return self._json({"_shards": {"total": 1, "successful": 1, "failed": 0}})
+        self._json({"acknowledged": True, "_shards": {"total": 1, "successful": 1, "failed": 0}})
+
+def _flat(settings: dict) -> dict:
+    """{"index": {"refresh_interval": ...}} o {"index.refresh_interval": ...} -> {"refresh_interval": ...}"""
+    inner = settings.get("settings", settings)
+    inner = inner.get("index", inner)
+    return {k.removeprefix("index."): str(v) for k, v in inner.items()}
+
+class BulkStub(ThreadingHTTPServer):
+    """ES local para tests y benchmarks: `_bulk` acepta todo (`latency` simula el tiempo de
+    indexación por request) y las APIs de índices, templates, settings y alias guardan estado.
+
+    `indices` tiene por índice sus settings, los documentos recibidos y con qué settings
+    llegaron (`bulk_settings`); `alias_swaps` cada request a _aliases y `calls` el resto.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        handler = type("Handler", (_Handler,), {"latency": latency})
+        super().__init__(("127.0.0.1", port), handler)
+        self.docs = 0
+        self.bulks = 0
+        self.lock = threading.Lock()
+        self.indices: dict[str, dict] = {}
+        self.aliases: dict[str, set[str]] = {}
+        self.templates: dict[str, dict] = {}
+        self.alias_swaps: list[list[dict]] = []
+        self.calls: list[tuple[str, str]] = []
+        self._thread = threading.Thread(target=self.serve_forever, name="es-stub", daemon=True)
+
+    def create_index(self, name: str, settings: dict) -> dict:
+        merged: dict = {}
+        mappings = None
+        for t in sorted(self.templates.values(), key=lambda t: t.get("priority", 0)):
+            if any(fnmatch(name, p) for p in t.get("index_patterns", [])):
+                merged.update(_flat(t.get("template", {}).get("settings", {})))
+                mappings = t.get("template", {}).get("mappings", mappings)
+        merged.update(_flat(settings))
+        idx = self.indices[name] = {"settings": merged, "mappings": mappings, "docs": 0,
+                                    "bulk_settings": set(), "segments": None}
+        return idx
+
+    def index_docs(self, targets: list[bytes]) -> list[bytes]:
+        """Cuenta los documentos por índice (un alias con varios índices no acepta escrituras)."""
+        rejected = set()
+        with self.lock:
+            for raw, n in Counter(targets).items():
+                name = raw.decode()
+                members = self.aliases.get(name)
+                if members is not None and len(members) != 1:
+                    rejected.add(raw)
+                    continue
+                name = next(iter(members)) if members else name
+                idx = self.indices.get(name) or self.create_index(name, {})
+                idx["docs"] += n
+                idx["bulk_settings"].add((idx["settings"].get("refresh_interval"),
+                                          idx["settings"].get("number_of_replicas")))
+                self.docs += n
+        if not rejected:
+            return [_ITEM] * len(targets)
+        return [_NO_WRITE_INDEX if raw in rejected else _ITEM for raw in targets]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self) -> 'BulkStub':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import csv, hashlib, json, random
+
+# Columnas típicas de un export de Policy Compliance de Qualys
+T1_COLUMNS = [
+    "Control ID", "Technology", "Control", "Criticality Label", "Criticality Value",
+    "Passed", "Failed", "Error", "Exceptions", "Percentage",
+]
+T2_COLUMNS = [
+    "Host IP", "DNS Hostname", "NetBIOS Hostname", "Tracking Method", "Operating System",
+    "OS CPE", "Last Scan Date", "Evaluation Date", "Control ID", "Technology", "Control",
+    "Criticality Label", "Criticality Value", "Instance", "Rationale", "Status", "Remediation",
+    "Deprecated", "Evidence", "Exception Assignee", "Exception Status", "Cause of Failure",
+]
+# Columnas que pueden faltar o moverse entre reportes (drift)
+OPTIONAL_T1 = ["Technology", "Error", "Exceptions"]
+OPTIONAL_T2 = ["NetBIOS Hostname", "OS CPE", "Deprecated", "Exception Assignee", "Exception Status", "Cause of Failure"]
+
+BENCHMARKS = [
+    ("Microsoft Windows Server 2019", "v1.2.0"),
+    ("Microsoft Windows Server 2016", "v1.4.0"),
+    ("Red Hat Enterprise Linux 8", "v2.0.0"),
+    ("Ubuntu Linux 20.04 LTS", "v1.1.0"),
+]
+CRITICALITY = [("SERIOUS", "4"), ("CRITICAL", "5"), ("MEDIUM", "3"), ("MINIMAL", "1")]
+STATUS = ["Passed", "Failed", "Passed", "Passed", "Error"]
+WORDS = (
+    "registry value policy setting configured audit account logon password minimum length "
+    "lockout threshold service disabled enabled permission group member remote desktop "
+    "firewall profile inbound connections ntlm kerberos encryption smb signing"
+).split()
+
+@dataclass
+class ReportSpec:
+    """Forma de un reporte sintético; `seed` lo hace reproducible byte a byte."""
+    size_mb: float = 20.0
+    tables: int = 4          # alterna Control Statistics / RESULTS
+    drift: float = 0.2       # fracción de columnas opcionales que se quitan/agregan/mueven
+    adjusted: bool = False
+    domain_controller: bool = False
+    encoding: str = "utf-8"  # utf-8, utf-8-sig, utf-16, utf-16-le/be, latin-1
+    seed: int = 1
+
+    def fingerprint(self) -> str:
+        return hashlib.sha1(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()[:10]
+
+def _columns(base: list[str], optional: list[str], drift: float, r: random.Random) -> list[str]:
+    cols = list(base)
+    k = round(len(optional) * drift)
+    for c in r.sample(optional, k):
+        cols.remove(c)
+    for i in range(k):
+        cols.append(f"Custom Field {r.randint(1, 9)}")
+    if k and len(cols) > 3:
+        i, j = r.sample(range(len(cols)), 2)
+        cols[i], cols[j] = cols[j], cols[i]
+    return list(dict.fromkeys(cols))
+
+def _text(r: random.Random, lo: int, hi: int) -> str:
+    return " ".join(r.choice(WORDS) for _ in range(r.randint(lo, hi)))
+
+def _t1_row(cols: list[str], i: int, r: random.Random) -> list[str]:
+    label, value = r.choice(CRITICALITY)
+    passed = r.randint(0, 400); failed = r.randint(0, 60)
+    v = {
+        "Control ID": str(1000 + i), "Technology": "Windows", "Control": _text(r, 6, 18).capitalize(),
+        "Criticality Label": label, "Criticality Value": value, "Passed": str(passed),
+        "Failed": str(failed), "Error": str(r.randint(0, 3)), "Exceptions": "0",
+        "Percentage": f"{100 * passed / max(1, passed + failed):.2f}%",
+    }
+    return [v.get(c, _text(r, 1, 3)) for c in cols]
+
+def _t2_row(cols: list[str], i: int, r: random.Random, os_name: str) -> list[str]:
+    label, value = r.choice(CRITICALITY)
+    host = r.randint(1, 4000)
+    status = r.choice(STATUS)
+    # Evidence varía mucho de tamaño y puede traer saltos de línea (sin líneas vacías)
+    evidence = "\n".join(_text(r, 3, 25) for _ in range(r.randint(1, 6)))
+    v = {
+        "Host IP": f"10.{host // 250}.{host % 250}.{r.randint(1, 254)}",
+        "DNS Hostname": f"srv{host:05d}.corp.example", "NetBIOS Hostname": f"SRV{host:05d}",
+        "Tracking Method": "IP", "Operating System": os_name if i % 17 else "",
+        "OS CPE": "cpe:/o:microsoft:windows_server_2019:::x64", "Last Scan Date": "2025-03-06T02:11:09Z",
+        "Evaluation Date": "2025-03-06T02:15:40Z", "Control ID": str(1000 + r.randint(0, 400)),
+        "Technology": "Windows", "Control": _text(r, 6, 18).capitalize(), "Criticality Label": label,
+        "Criticality Value": value, "Instance": "os", "Rationale": _text(r, 10, 60),
+        "Status": status, "Remediation": _text(r, 8, 40), "Deprecated": "",
+        "Evidence": evidence, "Exception Assignee": "", "Exception Status": "",
+        "Cause of Failure": _text(r, 2, 8) if status == "Failed" else "",
+    }
+    return [v.get(c, _text(r, 1, 3)) for c in cols]
+
+def generate_report(path: Path, spec: ReportSpec) -> dict:
+    """Escribe un reporte de ~`size_mb` MB y devuelve filas por tabla."""
+    r = random.Random(spec.seed)
+    os_name, version = r.choice(BENCHMARKS)
+    flags = " ".join(f for f, on in (("AJUSTADA", spec.adjusted), ("DOMAIN CONTROLLER", spec.domain_controller)) if on)
+    first = f'"Compliance Report: CIS Benchmark for {os_name} {version}{" " + flags if flags else ""}"'
+    width = 2 if spec.encoding.startswith("utf-16") else 1
+    budget = spec.size_mb * 1024 * 1024 / width / max(1, spec.tables)
+    t1_cols = _columns(T1_COLUMNS, OPTIONAL_T1, spec.drift, r)
+    t2_cols = _columns(T2_COLUMNS, OPTIONAL_T2, spec.drift, r)
+    rows: list[int] = []
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding=spec.encoding, errors="replace", newline="") as f:
+        f.write(first + "\r\n\r\n")
+        w = csv.writer(f)
+        for t in range(spec.tables):
+            is_t1 = t % 2 == 0
+            f.write("Control Statistics\r\n" if is_t1 else '"RESULTS"\r\n')
+            cols = t1_cols if is_t1 else t2_cols
+            w.writerow(cols)
+            written = 0; n = 0
+            while written < budget:
+                row = _t1_row(cols, n, r) if is_t1 else _t2_row(cols, n, r, os_name)
+                w.writerow(row)
+                written += sum(map(len, row)) + len(row) + 8
+                n += 1
+            f.write("\r\n")
+            rows.append(n)
+    return {"path": str(path), "bytes": path.stat().st_size, "rows": rows}
+
+def default_specs(files: int, size_mb: float, tables: int, drift: float, encodings: list[str],
+                  seed: int = 1) -> list[ReportSpec]:
+    """Mezcla de reportes: encodings en ronda, ajustada cada 2 y Domain Controller cada 3."""
+    return [
+        ReportSpec(size_mb=size_mb, tables=tables, drift=drift if i else 0.0,
+                   adjusted=i % 2 == 1, domain_controller=i % 3 == 2,
+                   encoding=encodings[i % len(encodings)], seed=seed + i)
+        for i in range(files)
+    ]
+
+def ensure_reports(workdir: Path, specs: list[ReportSpec]) -> list[dict]:
+    """Genera los reportes que falten; el nombre incluye la huella del spec, así se reutilizan."""
+    out = []
+    for i, spec in enumerate(specs):
+        p = workdir / f"report-{i}-{spec.fingerprint()}.csv"
+        meta = p.with_suffix(".json")
+        if p.exists() and meta.exists():
+            out.append(json.loads(meta.read_text()))
+            continue
+        info = {**generate_report(p, spec), "spec": asdict(spec)}
+        meta.write_text(json.dumps(info))
+        out.append(info)
+    return out
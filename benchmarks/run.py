@@ -0,0 +1,275 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+import csv, datetime, multiprocessing as mp, os, platform, resource, shutil, statistics, subprocess, sys, time
+
+# Cada bench recibe (reportes, workdir, opciones) y devuelve {"rows", "bytes", "phases"}; corre en un
+# proceso nuevo (spawn) para que el pico de RSS sea solo suyo.
+Bench = Callable[[list[dict], Path, dict], dict]
+
+CLIENTE = "bench"
+Y, M, D = 2025, 3, 6
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB en Linux
+
+class _Phases(dict):
+    """Acumula segundos por fase: `with phases("parse"): ...`."""
+    def __call__(self, name: str):
+        phases = self
+
+        class _Timer:
+            def __enter__(self):
+                self.t = time.perf_counter()
+
+            def __exit__(self, *exc):
+                phases[name] = phases.get(name, 0.0) + time.perf_counter() - self.t
+        return _Timer()
+
+def _total_bytes(reports: list[dict]) -> int:
+    return sum(r["bytes"] for r in reports)
+
+# --- benches ---
+
+def bench_detect_encoding(reports: list[dict], workdir: Path, opts: dict) -> dict:
+    from app.encoding import detect_encoding
+    phases = _Phases()
+    detected = {}
+    with phases("detect"):
+        for r in reports:
+            detected[Path(r["path"]).name] = detect_encoding(Path(r["path"]))
+    # solo se lee una muestra: los bytes reportados son los del archivo completo que "resuelve"
+    return {"rows": 0, "bytes": _total_bytes(reports), "phases": phases, "detected": detected}
+
+def bench_scan_headers(reports: list[dict], workdir: Path, opts: dict) -> dict:
+    from app.encoding import detect_encoding
+    from app.parser import scan_table_marks
+    phases = _Phases()
+    tables = 0
+    for r in reports:
+        p = Path(r["path"])
+        enc = detect_encoding(p)
+        with phases("scan"):
+            tables += len(scan_table_marks(p, enc))
+    return {"rows": sum(sum(r["rows"]) for r in reports), "bytes": _total_bytes(reports),
+            "phases": phases, "tables": tables}
+
+def bench_process_two_pass(reports: list[dict], workdir: Path, opts: dict) -> dict:
+    from app.encoding import detect_encoding
+    from app.parser import scan_file_headers, process_file, HeaderUnion, _ensure_extra_cols_for_table1, _ensure_extra_cols_for_table2
+    from app.storage import make_run_output_paths, open_output
+    from app.spill import OUTPUT_KEYS
+    phases = _Phases()
+    files = [Path(r["path"]) for r in reports]
+    with phases("encoding"):
+        enc = {p: detect_encoding(p) for p in files}
+    u = HeaderUnion([], [], [], [])
+    with phases("headers"):
+        for p in files:
+            h = scan_file_headers(p, enc[p])
+            u.t1_normal = list(dict.fromkeys(u.t1_normal + h.t1_normal))
+            u.t1_ajustada = list(dict.fromkeys(u.t1_ajustada + h.t1_ajustada))
+            u.t2_normal = list(dict.fromkeys(u.t2_normal + h.t2_normal))
+            u.t2_ajustada = list(dict.fromkeys(u.t2_ajustada + h.t2_ajustada))
+    fns = {
+        "t1_normal": _ensure_extra_cols_for_table1(u.t1_normal),
+        "t1_ajustada": _ensure_extra_cols_for_table1(u.t1_ajustada),
+        "t2_normal": _ensure_extra_cols_for_table2(u.t2_normal),
+        "t2_ajustada": _ensure_extra_cols_for_table2(u.t2_ajustada),
+    }
+    outputs = make_run_output_paths("bench", CLIENTE, "2025-03-06", opts.get("compression"), root=workdir / "two_pass")
+    counts = {k: 0 for k in OUTPUT_KEYS}
+    with phases("process"):
+        handles = {}
+        writers = {}
+        for key, path in outputs.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handles[key] = open_output(path)
+            # el header lo escribe process_file con la primera fila, como en run_job
+            writers[key] = csv.DictWriter(handles[key], fieldnames=fns[key], extrasaction="ignore")
+        for p in files:
+            process_file(p, union=u, cliente=CLIENTE, y=Y, m=M, d=D,
+                         writers=writers, counts=counts, encoding=enc[p])
+        for fh in handles.values():
+            fh.close()
+    return {"rows": sum(counts.values()), "bytes": _total_bytes(reports), "phases": phases, "counts": counts}
+
+def bench_process_single_pass(reports: list[dict], workdir: Path, opts: dict) -> dict:
+    from app.encoding import detect_encoding
+    from app.parser import process_file
+    from app.spill import SpillSet, OUTPUT_KEYS
+    from app.storage import make_run_output_paths
+    phases = _Phases()
+    files = [Path(r["path"]) for r in reports]
+    with phases("encoding"):
+        enc = {p: detect_encoding(p) for p in files}
+    outputs = make_run_output_paths("bench", CLIENTE, "2025-03-06", opts.get("compression"), root=workdir / "single_pass")
+    counts = {k: 0 for k in OUTPUT_KEYS}
+    spill = SpillSet.create(workdir)
+    try:
+        with phases("spill"):
+            for p in files:
+                process_file(p, cliente=CLIENTE, y=Y, m=M, d=D, counts=counts, encoding=enc[p], spill=spill)
+        with phases("finalize"):
+            spill.finalize(outputs)
+    finally:
+        spill.cleanup()
+    return {"rows": sum(counts.values()), "bytes": _total_bytes(reports), "phases": phases, "counts": counts}
+
+def bench_finalize_upload(reports: list[dict], workdir: Path, opts: dict) -> dict:
+    from app import storage
+    # los archivos van a un directorio propio del bench, no a storage/uploads
+    storage.UPLOADS_DIR = workdir / "uploads"
+    storage.UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    phases = _Phases()
+    for r in reports:
+        src = Path(r["path"])
+        tmp = workdir / f"{src.name}.part"
+        shutil.copyfile(src, tmp)  # fuera del tiempo medido: simula el .part del upload
+        with phases("hash_move"):
+            _, target, _, _ = storage.finalize_upload(tmp, src.name)
+        target.unlink()
+    return {"rows": 0, "bytes": _total_bytes(reports), "phases": phases}
+
+def bench_es_bulk(reports: list[dict], workdir: Path, opts: dict) -> dict:
+    from app.es_uploader import ESUploader
+    from .es_stub import BulkStub
+    from app.storage import make_run_output_paths
+    files = make_run_output_paths("bench", CLIENTE, "2025-03-06", opts.get("compression"), root=workdir / "single_pass")
+    if not all(p.exists() for p in files.values()):
+        raise RuntimeError("es_bulk necesita las salidas de process_single_pass (correrlo antes)")
+    phases = _Phases()
+    ok = failed = 0
+    with BulkStub(latency=opts.get("es_latency", 0.0)) as stub:
+        es = ESUploader(stub.url, None, None, connections=opts.get("es_threads", 4) + 2)
+        try:
+            for key, p in files.items():
+                with phases(key):
+                    o, f, _ = es.bulk_file(p, "bench", workers=opts.get("es_threads", 4))
+                ok += o; failed += f
+        finally:
+            es.close()
+    return {"rows": ok, "bytes": sum(p.stat().st_size for p in files.values()), "phases": phases,
+            "failed": failed, "bulk_requests": stub.bulks}
+
+def bench_es_ingest(reports: list[dict], workdir: Path, opts: dict) -> dict:
+    """Como es_bulk pero en modo índice gestionado: crear índices, cargar y publicar (swap de alias)."""
+    from app.es_uploader import ESUploader
+    from app.es_index import publish, delete_indices
+    from .es_stub import BulkStub
+    from app.storage import make_run_output_paths
+    files = make_run_output_paths("bench", CLIENTE, "2025-03-06", opts.get("compression"), root=workdir / "single_pass")
+    if not all(p.exists() for p in files.values()):
+        raise RuntimeError("es_ingest necesita las salidas de process_single_pass (correrlo antes)")
+    phases = _Phases()
+    ok = failed = 0
+    with BulkStub(latency=opts.get("es_latency", 0.0)) as stub:
+        es = ESUploader(stub.url, None, None, connections=opts.get("es_threads", 4) + 2)
+        try:
+            loads = {t: es.managed_index(f"bench-{t}", CLIENTE, "2025-03-06", "bench") for t in ("t1", "t2")}
+            with phases("create"):
+                for m in loads.values():
+                    m.create()
+            for key, p in files.items():
+                with phases(key):
+                    o, f, _ = es.bulk_file(p, loads[key[:2]].index, workers=opts.get("es_threads", 4))
+                ok += o; failed += f
+            with phases("publish"):
+                delete_indices(es.client, publish(es.client, list(loads.values())))
+        finally:
+            es.close()
+    return {"rows": ok, "bytes": sum(p.stat().st_size for p in files.values()), "phases": phases,
+            "failed": failed, "bulk_requests": stub.bulks}
+
+BENCHES: dict[str, Bench] = {
+    "detect_encoding": bench_detect_encoding,
+    "scan_headers": bench_scan_headers,
+    "process_two_pass": bench_process_two_pass,
+    "process_single_pass": bench_process_single_pass,
+    "finalize_upload": bench_finalize_upload,
+    "es_bulk": bench_es_bulk,
+    "es_ingest": bench_es_ingest,
+}
+
+def _child(name: str, reports: list[dict], workdir: str, opts: dict) -> dict:
+    base = _rss_mb()
+    t = time.perf_counter()
+    res = BENCHES[name](reports, Path(workdir), opts)
+    # `seconds` es la suma de las fases (sin imports ni preparación); `wall_s` es todo el bench
+    res["wall_s"] = round(time.perf_counter() - t, 4)
+    res["seconds"] = sum(res["phases"].values())
+    res["base_rss_mb"] = round(base, 1)
+    res["peak_rss_mb"] = round(_rss_mb(), 1)
+    res["phases"] = {k: round(v, 4) for k, v in res["phases"].items()}
+    return res
+
+def run_bench(name: str, reports: list[dict], workdir: Path, opts: dict, repeat: int = 1) -> dict:
+    """Corre `name` `repeat` veces (un proceso por corrida) y resume con la mediana."""
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as ex:
+            runs.append(ex.submit(_child, name, reports, str(workdir), opts).result())
+    best = sorted(runs, key=lambda r: r["seconds"])[len(runs) // 2]
+    seconds = statistics.median(r["seconds"] for r in runs)
+    out = {**best, "seconds": round(seconds, 4), "runs": [round(r["seconds"], 4) for r in runs],
+           "peak_rss_mb": max(r["peak_rss_mb"] for r in runs)}
+    out["rows_per_s"] = round(out["rows"] / seconds, 1) if seconds and out["rows"] else None
+    out["mb_per_s"] = round(out["bytes"] / 1048576 / seconds, 2) if seconds else None
+    return out
+
+def git_commit() -> str | None:
+    root = Path(__file__).resolve().parents[1]
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "app"], cwd=root,
+                               capture_output=True, text=True).stdout.strip()
+        return sha + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(reports: list[dict], workdir: Path, names: list[str], opts: dict, repeat: int = 1,
+              log: Callable[[str], None] = print) -> dict:
+    results = {}
+    for name in names:
+        log(f"· {name} ...")
+        results[name] = run_bench(name, reports, workdir, opts, repeat)
+        log("  " + format_result(results[name]))
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "options": opts,
+            "reports": [{"file": Path(r["path"]).name, "bytes": r["bytes"], "rows": r["rows"], "spec": r["spec"]}
+                        for r in reports],
+        },
+        "results": results,
+    }
+
+def format_result(r: dict) -> str:
+    rate = f"{r['rows_per_s']:,.0f} filas/s  " if r.get("rows_per_s") else ""
+    phases = " ".join(f"{k}={v:.3f}s" for k, v in r["phases"].items())
+    return f"{r['seconds']:.3f}s  {rate}{r['mb_per_s']:.1f} MB/s  pico {r['peak_rss_mb']:.0f} MB  [{phases}]"
+
+def compare(old: dict, new: dict, threshold: float = 0.10) -> tuple[list[str], bool]:
+    """Tabla de diferencias por bench; True si algún bench es más lento que `threshold`."""
+    lines = [f"{'bench':<22}{'antes':>10}{'ahora':>10}{'Δ tiempo':>10}{'Δ RSS':>10}",
+             f"  ({old['meta'].get('commit')} → {new['meta'].get('commit')})"]
+    if [r["spec"] for r in old["meta"]["reports"]] != [r["spec"] for r in new["meta"]["reports"]]:
+        lines.append("  aviso: los reportes generados difieren (otro tamaño/seed/encodings)")
+    regressed = False
+    for name, r in new["results"].items():
+        o = old["results"].get(name)
+        if not o:
+            lines.append(f"{name:<22}{'-':>10}{r['seconds']:>9.3f}s{'nuevo':>10}")
+            continue
+        dt = (r["seconds"] - o["seconds"]) / o["seconds"] if o["seconds"] else 0.0
+        dr = r["peak_rss_mb"] - o["peak_rss_mb"]
+        flag = "  ← regresión" if dt > threshold else ""
+        regressed |= dt > threshold
+        lines.append(f"{name:<22}{o['seconds']:>9.3f}s{r['seconds']:>9.3f}s{dt:>+10.1%}{dr:>+8.0f}MB{flag}")
+    return lines, regressed
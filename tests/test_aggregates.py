@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from app.batch import run_batch
+
+# dos reportes con la misma tabla RESULTS pero distinta columna de host: en dos pasadas la
+# salida tiene ambas (unión de headers) y cada archivo deja vacía la que no trae
+REPORTS = {
+    "a.csv": (
+        '"Report CIS Benchmark for Microsoft Windows Server 2019"\n\n'
+        '"RESULTS"\n'
+        "Host IP,Operating System,Control ID,Control,Status\n"
+        "10.0.0.1,Windows,1,Uno,Passed\n"
+        "10.0.0.1,Windows,2,Dos,Failed\n"
+        "10.0.0.2,Windows,1,Uno,Passed\n"
+    ),
+    "b.csv": (
+        '"Report CIS Benchmark for Microsoft Windows Server 2019"\n\n'
+        '"RESULTS"\n'
+        "IP,Control ID,Control,Status\n"
+        "10.0.0.3,1,Uno,Failed\n"
+        "10.0.0.3,2,Dos,Passed\n"
+    ),
+}
+
+def _summary(tmp_path: Path, single_pass: bool) -> dict:
+    src = tmp_path / "in"
+    src.mkdir(exist_ok=True)
+    files = []
+    for name, content in REPORTS.items():
+        p = src / name
+        p.write_text(content, encoding="utf-8")
+        files.append(p)
+    out = tmp_path / ("one" if single_pass else "two")
+    res = run_batch(files, cliente="acme", fecha="2025-01-01", out_dir=out,
+                    single_pass=single_pass, emit=lambda evt: None)
+    path = next(Path(p) for p in res["summary"].values() if p.endswith(".json"))
+    return json.loads(path.read_text(encoding="utf-8"))
+
+def test_two_pass_aggregates_match_single_pass(tmp_path):
+    assert _summary(tmp_path, single_pass=False) == _summary(tmp_path, single_pass=True)
+
+@pytest.mark.parametrize("single_pass", [False, True])
+def test_aggregates_use_each_table_header(tmp_path, single_pass):
+    t2 = _summary(tmp_path, single_pass)["t2_normal"]
+    assert t2["rows"] == 5
+    assert t2["by"]["host"] == {
+        "10.0.0.1": {"Failed": 1, "Passed": 1},
+        "10.0.0.2": {"Passed": 1},
+        "10.0.0.3": {"Failed": 1, "Passed": 1},
+    }
+    # b.csv no trae Operating System: no se cuenta bajo ""
+    assert t2["by"]["os"] == {"Windows": {"Failed": 1, "Passed": 2}}
@@ -113,6 +113,8 @@ export default function App() {
             setProgress(p => ({ ...p, [evt.file]: evt as ProgressEvt }));
           } else if (evt.type === "log") {
             setLogs(l => [...l, evt.message]);
+          } else if (evt.type === "error") {
+            setLogs(l => [...l, `ERROR: ${evt.message}`]);
           } else {
             setLogs(l => [...l, line]);
           }
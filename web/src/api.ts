@@ -17,8 +17,10 @@ export async function startProcess(cliente: string, fecha: string, files: string
 }
 
 export function streamLogs(run_id: string, onMsg: (s: string) => void) {
+  // el navegador reenvía Last-Event-ID al reconectar; "end" marca el fin del run
   const ev = new EventSource(`/api/runs/${run_id}/logs`);
   ev.onmessage = (e) => onMsg(e.data);
+  ev.addEventListener("end", () => ev.close());
   return () => ev.close();
 }
 
@@ -28,6 +30,20 @@ export async function fetchResults(run_id: string) {
   return r.json(); // { files:[{name,url,rows,...}] }
 }
 
+export async function fetchPreview(run_id: string, table?: string) {
+  const q = table ? `?table=${encodeURIComponent(table)}` : "";
+  const r = await fetch(`/api/runs/${run_id}/preview${q}`);
+  if (!r.ok) throw new Error(await r.text());
+  return r.json(); // { tables: { t1_normal: {fieldnames, rows, head, sample}, ... } }
+}
+
+export async function cancelRun(run_id: string) {
+  // en cola o en curso: cancela; terminado: borra salidas y estado del run
+  const r = await fetch(`/api/runs/${run_id}`, { method: "DELETE" });
+  if (!r.ok) throw new Error(await r.text());
+  return r.json(); // { run_id, status }
+}
+
 export async function pushToES(run_id: string) {
   const r = await fetch(`/api/runs/${run_id}/push-to-es`, { method: "POST" });
   if (!r.ok) throw new Error(await r.text());
@@ -42,12 +58,43 @@ async function jsonOrThrow(r: Response) {
   if (!r.ok) throw new Error(`${r.status} ${r.statusText} · ${await r.text().catch(()=> "")}`);
   return r.json();
 }
-async function uploadOne(file: File): Promise<{ upload_id: string; filename: string; size: number }> {
+type Uploaded = { upload_id: string; filename: string; size: number };
+
+// Archivos grandes van por partes: varias en paralelo, cada una con reintentos; si algo
+// falla, la sesión queda y se retoma pidiendo las partes que faltan.
+const CHUNKED_MIN_BYTES = 64 * 1024 * 1024;
+const PART_CONCURRENCY = 4;
+const PART_RETRIES = 3;
+
+async function uploadOne(file: File): Promise<Uploaded> {
+  if (file.size >= CHUNKED_MIN_BYTES) return uploadChunked(file);
   const fd = new FormData();
   fd.append("file", file);
   const r = await fetch("/api/upload", { method: "POST", body: fd });
   return jsonOrThrow(r);
 }
+
+async function uploadChunked(file: File): Promise<Uploaded> {
+  const s = await jsonOrThrow(await fetch("/api/upload-sessions", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ filename: file.name, size: file.size }),
+  }));
+  const sid: string = s.session_id;
+  let missing: number[] = s.missing;
+  for (let round = 0; round < PART_RETRIES && missing.length; round++) {
+    const queue = [...missing];
+    const worker = async () => {
+      for (let n = queue.shift(); n !== undefined; n = queue.shift()) {
+        const body = file.slice(n * s.part_size, (n + 1) * s.part_size);
+        await fetch(`/api/upload-sessions/${sid}/parts/${n}`, { method: "PUT", body }).catch(() => null);
+      }
+    };
+    await Promise.all(Array.from({ length: PART_CONCURRENCY }, worker));
+    missing = (await jsonOrThrow(await fetch(`/api/upload-sessions/${sid}`))).missing;
+  }
+  return jsonOrThrow(await fetch(`/api/upload-sessions/${sid}/complete`, { method: "POST" }));
+}
 function todayStr(): string {
   const d = new Date();
   const mm = String(d.getMonth() + 1).padStart(2, "0");
@@ -96,15 +143,23 @@ export async function processFiles(
     counts[key as keyof Counts] = f.rows;
     artifacts.push({
       name: f.name,
-      size: 0,                 // tamaño no viene del backend; si quieres lo consultamos con HEAD
+      size: f.size ?? 0,
       download_url: f.url,
     });
   }
 
+  // 5) Preview: muestra uniforme de cada salida (o todas sus filas si es chica), como objetos
+  const preview: NonNullable<ProcessResponse["preview"]> = { t1_normal: [], t1_ajustada: [], t2_normal: [], t2_ajustada: [] };
+  const pv = await fetch(`/api/runs/${run_id}/preview`).then(r => (r.ok ? r.json() : { tables: {} }));
+  for (const [key, t] of Object.entries(pv.tables as Record<string, any>)) {
+    const rows: string[][] = t.rows > t.head.length ? t.sample : t.head;
+    (preview as any)[key] = rows.map(r => Object.fromEntries(t.fieldnames.map((c: string, i: number) => [c, r[i]])));
+  }
+
   const out: ProcessResponse = {
     run: { run_id, source_files, counts },
     artifacts,
-    preview: { t1_normal: [], t1_ajustada: [], t2_normal: [], t2_ajustada: [] }, // podemos añadir preview real luego
+    preview,
     warnings: results.files?.[0]?.warnings || [],
   };
   return out;